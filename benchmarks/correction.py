@@ -0,0 +1,71 @@
+"""
+Compares the throughput of the different ways of correcting frames, on synthetic images the size of a typical ND2 frame.
+
+Usage: python -m benchmarks.correction [frames] [batch size]
+
+"""
+from fylm.model.correction import CorrectiveTransform, RotationMap, intensity_scale
+from scipy import ndimage
+import numpy as np
+import sys
+import time
+
+HEIGHT = 1024
+WIDTH = 1280
+ROTATION_OFFSET = 0.7
+
+
+def make_frames(count):
+    random = np.random.RandomState(0)
+    raw_stack = (random.rand(count, HEIGHT, WIDTH) * 65535).astype(np.uint16)
+    offsets = random.randn(count, 2) * 3.0
+    return raw_stack, offsets
+
+
+def measure(name, count, correct):
+    start = time.time()
+    correct()
+    elapsed = time.time() - start
+    print("%-40s %8.2f frames/s" % (name, count / elapsed))
+
+
+def main(count=64, batch_size=16):
+    raw_stack, offsets = make_frames(count)
+    rotation_map = RotationMap(ROTATION_OFFSET)
+
+    def fused_transform():
+        for raw_image_data, (dx, dy) in zip(raw_stack, offsets):
+            CorrectiveTransform(ROTATION_OFFSET, dx, dy).apply(raw_image_data)
+
+    def rotation_map_per_frame():
+        for raw_image_data, (dx, dy) in zip(raw_stack, offsets):
+            rotation_map.correct(raw_image_data, dx, dy)
+
+    def rotation_map_regions():
+        for raw_image_data, (dx, dy) in zip(raw_stack, offsets):
+            rotation_map.correct_region(raw_image_data, dx, dy, (0, HEIGHT, 0, WIDTH))
+
+    def batched_gather():
+        # one map_coordinates call over each (frames, rows, columns) block, with every frame's registration offset
+        # subtracted from the same rotated coordinates
+        rows, columns = rotation_map.raw_coordinates((HEIGHT, WIDTH), *np.mgrid[0:HEIGHT, 0:WIDTH], dx=0.0, dy=0.0)
+        for start in range(0, count, batch_size):
+            raw_block = raw_stack[start:start + batch_size]
+            block_offsets = offsets[start:start + batch_size]
+            coordinates = np.empty((3,) + raw_block.shape)
+            coordinates[0] = np.arange(len(raw_block))[:, np.newaxis, np.newaxis]
+            np.subtract(rows, block_offsets[:, 1, np.newaxis, np.newaxis], out=coordinates[1])
+            np.subtract(columns, block_offsets[:, 0, np.newaxis, np.newaxis], out=coordinates[2])
+            corrected = ndimage.map_coordinates(raw_block, coordinates, output=np.float64, order=1, mode="constant",
+                                                cval=0.0)
+            corrected *= intensity_scale(raw_block.dtype)
+
+    print("%s frames of %sx%s, batches of %s" % (count, WIDTH, HEIGHT, batch_size))
+    measure("CorrectiveTransform.apply (per frame)", count, fused_transform)
+    measure("RotationMap.correct (per frame)", count, rotation_map_per_frame)
+    measure("RotationMap.correct_region (whole frame)", count, rotation_map_regions)
+    measure("map_coordinates (batched)", count, batched_gather)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
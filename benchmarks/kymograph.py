@@ -0,0 +1,87 @@
+"""
+Compares the ways of taking kymograph lines from frames, on synthetic frames the size of a typical ND2 frame with 28 catch
+channels, and checks that they give the same kymographs.
+
+Usage: python -m benchmarks.kymograph [frames]
+
+"""
+from fylm.model.constants import Constants
+from fylm.model.coordinates import Coordinates
+from fylm.model.correction import RotationMap
+from fylm.model.kymograph import Kymograph, KymographExtractor
+import numpy as np
+import sys
+import time
+
+HEIGHT = 1024
+WIDTH = 1280
+ROTATION_OFFSET = 0.7
+# The notch and the end of the catch channels on either side of the central trench, in pixels from the left edge
+LEFT_CHANNELS = (560, 300)
+RIGHT_CHANNELS = (690, 950)
+
+
+def make_frames(count):
+    random = np.random.RandomState(0)
+    raw_stack = (random.rand(count, HEIGHT, WIDTH) * 65535).astype(np.uint16)
+    offsets = random.randn(count, 2) * 3.0
+    return raw_stack, offsets
+
+
+def make_kymographs():
+    kymographs = []
+    for channel_number in xrange(Constants.NUM_CATCH_CHANNELS):
+        notch_x, tube_x = LEFT_CHANNELS if channel_number % 2 else RIGHT_CHANNELS
+        y = 60 + channel_number // 2 * 64
+        kymograph = Kymograph()
+        kymograph.channel_number = channel_number
+        kymograph.set_location(Coordinates(notch_x, y + 8), Coordinates(tube_x, y))
+        kymographs.append(kymograph)
+    return kymographs
+
+
+def measure(name, count, extract):
+    start = time.time()
+    extract()
+    elapsed = time.time() - start
+    print("%-40s %8.2f ms/frame" % (name, elapsed * 1000.0 / count))
+
+
+def main(count=64):
+    raw_stack, offsets = make_frames(count)
+    kymographs = make_kymographs()
+    extractor = KymographExtractor(kymographs, (HEIGHT, WIDTH))
+    rotation_map = RotationMap(ROTATION_OFFSET, np.float32)
+    results = {}
+
+    def full_frame():
+        for time_index, (raw_image_data, (dx, dy)) in enumerate(zip(raw_stack, offsets)):
+            extractor.add_lines(time_index, rotation_map.correct(raw_image_data, dx, dy))
+
+    def corrected_regions():
+        corrected_image = np.zeros((HEIGHT, WIDTH), dtype=np.float32)
+        for time_index, (raw_image_data, (dx, dy)) in enumerate(zip(raw_stack, offsets)):
+            for top, bottom, left, right in extractor.regions:
+                corrected_image[top:bottom, left:right] = rotation_map.correct_region(raw_image_data, dx, dy,
+                                                                                      (top, bottom, left, right))
+            extractor.add_lines(time_index, corrected_image)
+
+    def raw_samples():
+        for time_index, (raw_image_data, (dx, dy)) in enumerate(zip(raw_stack, offsets)):
+            extractor.add_samples(time_index, rotation_map.sample(raw_image_data, dx, dy, extractor.rows,
+                                                                  extractor.columns))
+
+    print("%s frames of %sx%s, %s catch channels" % (count, WIDTH, HEIGHT, len(kymographs)))
+    for name, extract in (("full frame correction", full_frame),
+                          ("corrected regions (corrected sampling)", corrected_regions),
+                          ("raw samples (raw sampling)", raw_samples)):
+        extractor.allocate_memory(count, np.float32)
+        measure(name, count, extract)
+        results[name] = np.hstack([kymograph.data for kymograph in kymographs])
+    reference = results["full frame correction"]
+    for name, lines in sorted(results.items()):
+        print("%-40s largest difference: %.2e" % (name, np.abs(lines - reference).max()))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,58 @@
+"""
+Compares the throughput of registration with NumPy and FFTW doing the FFTs, on synthetic images the size of a typical
+ND2 frame and on an awkward size that FFTW has to pad.
+
+Usage: python -m benchmarks.registration [frames] [threads]
+
+"""
+from fylm.model.constants import Constants
+from fylm.model.phase_correlation import FFTWTransform, NumpyTransform, PhaseCorrelator, band_windows
+import numpy as np
+import sys
+import time
+
+SHAPES = ((1024, 1280), (1021, 1279))
+
+
+def make_frames(shape, count):
+    random = np.random.RandomState(0)
+    base_image = (random.rand(*shape) * 4000).astype(np.uint16)
+    stack = (random.rand(count, *shape) * 4000).astype(np.uint16)
+    return base_image, stack
+
+
+def measure(name, count, register):
+    start = time.time()
+    register()
+    elapsed = time.time() - start
+    print("%-40s %8.2f frames/s" % (name, count / elapsed))
+
+
+def main(count=32, threads=Constants.FFT_THREADS):
+    for shape in SHAPES:
+        base_image, stack = make_frames(shape, count)
+        windows = band_windows(shape)
+        print("%s frames of %sx%s, FFTW with %s threads" % (count, shape[1], shape[0], threads))
+
+        def register_with(transform):
+            correlator = PhaseCorrelator(base_image, windows, transform=transform)
+            return lambda: list(correlator.register_images(stack))
+
+        measure("numpy", count, register_with(NumpyTransform()))
+        batch = stack[:Constants.REGISTRATION_BATCH_SIZE]
+        transform = FFTWTransform(threads)
+        start = time.time()
+        # registering one batch plans every shape we'll need
+        PhaseCorrelator(base_image, windows, transform=transform).register_stack(batch)
+        print("%-40s %8.2f s" % ("fftw first batch, with planning", time.time() - start))
+        measure("fftw (planned)", count, register_with(transform))
+        wisdom = transform.export_wisdom()
+        transform = FFTWTransform(threads)
+        transform.import_wisdom(wisdom)
+        start = time.time()
+        PhaseCorrelator(base_image, windows, transform=transform).register_stack(batch)
+        print("%-40s %8.2f s" % ("fftw first batch, with saved wisdom", time.time() - start))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
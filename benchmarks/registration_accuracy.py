@@ -0,0 +1,46 @@
+"""
+Compares coarse-to-fine registration with the reference settings on a synthetic drifting stack: how much faster each
+setting is, and how far its offsets are from the reference's. To evaluate real images, use
+`run.py --action registration-accuracy -t <time period> -f <field of view>` instead.
+
+Usage: python -m benchmarks.registration_accuracy [frames] [upsample factor]
+
+"""
+from fylm.model.constants import Constants
+from fylm.model.phase_correlation import PhaseCorrelator, band_windows, evaluate_correlators, format_evaluation
+import numpy as np
+from scipy import ndimage
+import sys
+
+HEIGHT = 1024
+WIDTH = 1280
+DOWNSAMPLES = (2, 4, 8)
+
+
+def make_stack(count):
+    """
+    Makes a base image with vertical stripes, a bit like catch channels, and copies of it that slowly drift.
+
+    """
+    random = np.random.RandomState(0)
+    base_image = ndimage.gaussian_filter(random.rand(HEIGHT, WIDTH), 3.0) * 20000.0
+    base_image += 2000.0 * (np.sin(np.arange(WIDTH) / 8.0) > 0.5)
+    drift = np.cumsum(random.randn(count, 2) * 0.3, axis=0)
+    stack = np.array([ndimage.shift(base_image, (dy, dx), order=1) + random.rand(HEIGHT, WIDTH) * 200.0
+                      for dx, dy in drift])
+    return base_image.astype(np.uint16), stack.astype(np.uint16)
+
+
+def main(count=32, upsample_factor=Constants.REGISTRATION_UPSAMPLE_FACTOR):
+    base_image, stack = make_stack(count)
+    windows = band_windows(base_image.shape)
+    reference = PhaseCorrelator(base_image, windows)
+    candidates = [PhaseCorrelator(base_image, windows, upsample_factor=upsample_factor, downsample=downsample)
+                  for downsample in DOWNSAMPLES]
+    print("%s frames of %sx%s, errors in pixels" % (count, WIDTH, HEIGHT))
+    for line in format_evaluation(evaluate_correlators(stack, reference, candidates)):
+        print(line)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
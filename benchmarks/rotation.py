@@ -0,0 +1,48 @@
+"""
+Compares the time it takes to find the rotation offset of a field of view with the full Hough transform and with the
+coarse-to-fine search, on synthetic skeletons the size of a typical ND2 frame.
+
+Usage: python -m benchmarks.rotation [repeats]
+
+"""
+from fylm.model.hough import find_line_angles
+import numpy as np
+import sys
+import time
+
+HEIGHT = 1024
+WIDTH = 1280
+# The sides of the central trench, in pixels from the left edge of the image
+TRENCH_SIDES = (200, 230, 1050, 1080)
+ANGLES = (0.0, 0.0123, -0.031, 0.2)
+
+
+def make_skeleton(angle):
+    skeleton = np.zeros((HEIGHT, WIDTH), dtype=np.bool)
+    rows = np.arange(100, HEIGHT - 100)
+    for column in TRENCH_SIDES:
+        skeleton[rows, np.round(column + (rows - HEIGHT / 2.0) * np.tan(angle)).astype(int)] = True
+    return skeleton
+
+
+def measure(name, skeletons, repeats, **kwargs):
+    offsets = []
+    start = time.time()
+    for _ in range(repeats):
+        offsets = [np.mean(find_line_angles(skeleton, **kwargs)) for skeleton in skeletons]
+    elapsed = (time.time() - start) / (repeats * len(skeletons))
+    print("%-40s %8.3f s/field of view   offsets: %s" % (name, elapsed,
+                                                         ", ".join("%.3f" % np.degrees(o) for o in offsets)))
+
+
+def main(repeats=1):
+    skeletons = [make_skeleton(angle) for angle in ANGLES]
+    print("%s skeletons of %sx%s, true offsets: %s" % (len(skeletons), WIDTH, HEIGHT,
+                                                      ", ".join("%.3f" % -np.degrees(a) for a in ANGLES)))
+    measure("full search", skeletons, repeats, coarse_step=0.0)
+    measure("coarse to fine", skeletons, repeats)
+    measure("coarse to fine, downsampled by 2", skeletons, repeats, downsample=2)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
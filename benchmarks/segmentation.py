@@ -0,0 +1,54 @@
+"""
+Compares finding the rotation offset with the exact (disk) and approximate (box) edge density, on synthetic frames the
+size of a typical ND2 frame, and counts how often the two give different offsets.
+
+Usage: python -m benchmarks.segmentation [frames]
+
+"""
+from fylm.service.rotation import RotationSet
+import numpy as np
+from scipy import ndimage
+import sys
+import time
+
+HEIGHT = 1024
+WIDTH = 1280
+# The ends of the catch channels on either side of the central trench, in pixels from the left edge of the image
+EDGE_BANDS = (300, 560, 690, 950)
+# Offsets that differ by more than this many degrees are counted as different
+TOLERANCE = 0.05
+
+
+def make_frame(angle_degrees, random):
+    image = np.full((HEIGHT, WIDTH), 1000.0)
+    for left in EDGE_BANDS:
+        image[60:-60, left:left + 30:4] = 3000.0
+        image[60:-60, left + 1:left + 30:4] = 3000.0
+    image = ndimage.rotate(image, angle_degrees, reshape=False, order=1, mode="nearest")
+    return (image + random.randn(HEIGHT, WIDTH) * 50.0).astype(np.uint16)
+
+
+def measure(frames, smoothing):
+    start = time.time()
+    offsets = np.array([RotationSet._determine_rotation_offset(frame, smoothing=smoothing) for frame in frames])
+    return (time.time() - start) / len(frames), offsets
+
+
+def main(count=20):
+    random = np.random.RandomState(0)
+    angles = random.uniform(-3.0, 3.0, count)
+    frames = [make_frame(angle, random) for angle in angles]
+    print("%s frames of %sx%s" % (count, WIDTH, HEIGHT))
+    disk_time, disk_offsets = measure(frames, "disk")
+    box_time, box_offsets = measure(frames, "box")
+    print("%-10s %8.3f s/field of view   mean error %.3f degrees" % ("disk", disk_time,
+                                                                      np.abs(disk_offsets + angles).mean()))
+    print("%-10s %8.3f s/field of view   mean error %.3f degrees" % ("box", box_time,
+                                                                      np.abs(box_offsets + angles).mean()))
+    differences = np.abs(disk_offsets - box_offsets)
+    print("Offsets identical: %s/%s, within %s degrees: %s/%s, largest difference: %.3f degrees" % (
+        np.sum(differences == 0.0), count, TOLERANCE, np.sum(differences <= TOLERANCE), count, differences.max()))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -18,17 +18,20 @@ from fylm.service.summary import Summary as SummaryService
 from fylm.model.summary import SummarySet
 from fylm.service.fluorescence import FluorescenceSet as FluorescenceService
 from fylm.model.fluorescence import FluorescenceSet
+from fylm.service.corrected import CorrectedStackSet as CorrectedStackSetService
+from fylm.model.corrected import CorrectedStackSet
+from fylm.service.preprocess import Preprocessor
 
 
 class Activity(object):
     def __init__(self, experiment):
         self._experiment = experiment
 
-    def _calculate_and_save_text(self, SetModel, Service):
+    def _calculate_and_save_text(self, SetModel, Service, jobs=1):
         set_model = SetModel(self._experiment)
         service = Service(self._experiment)
         service.find_current(set_model)
-        service.save_text(set_model)
+        service.save_text(set_model, jobs)
 
     def calculate_rotation_offset(self):
         self._calculate_and_save_text(RotationSet, RotationSetService)
@@ -36,8 +39,23 @@ class Activity(object):
     def extract_timestamps(self):
         self._calculate_and_save_text(TimestampSet, TimestampSetService)
 
+    def preprocess(self, skip=()):
+        """
+        Finds the rotation offsets, timestamps and registration offsets in a single pass through each ND2.
+
+        """
+        preprocessor = Preprocessor(self._experiment)
+        preprocessor.save(RotationSet(self._experiment), TimestampSet(self._experiment),
+                          RegistrationSet(self._experiment), skip)
+
     def calculate_registration(self):
-        self._calculate_and_save_text(RegistrationSet, RegistrationSetService)
+        self._calculate_and_save_text(RegistrationSet, RegistrationSetService, self._experiment.jobs)
+
+    def evaluate_registration(self, time_period, field_of_view):
+        RegistrationSetService(self._experiment).evaluate(time_period, field_of_view)
+
+    def store_corrected_images(self):
+        self._calculate_and_save_text(CorrectedStackSet, CorrectedStackSetService)
 
     def input_channel_locations(self):
         self._calculate_and_save_text(LocationSet, LocationSetService)
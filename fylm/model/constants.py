@@ -1,4 +1,53 @@
+import multiprocessing
+
+
 class Constants(object):
     FIFTEEN_DEGREES_IN_RADIANS = 0.262
     ACCEPTABLE_SKEW_THRESHOLD = 5.0
-    NUM_CATCH_CHANNELS = 28
\ No newline at end of file
+    NUM_CATCH_CHANNELS = 28
+    # The precision of the rotation search, in radians
+    ROTATION_ANGLE_STEP = 0.0001
+    # The rotation search first tries angles this far apart, in radians, and then refines around the best ones
+    ROTATION_COARSE_ANGLE_STEP = 0.002
+    # The rotation search can shrink the image by this factor to go faster. 1 uses the full image
+    ROTATION_DOWNSAMPLE = 1
+    # How the rotation search measures edge density: "disk" is exact, "box" is a much faster approximation
+    ROTATION_SMOOTHING = "disk"
+    # How kymograph lines are taken from each frame: "corrected" corrects the rows they come from and then reads them,
+    # "raw" interpolates only the pixels that are needed straight from the raw frame
+    KYMOGRAPH_SAMPLING = "raw"
+    # The default memory budget for corrected frames that are kept around for reuse
+    FRAME_CACHE_MEGABYTES = 1024
+    # The default number of image sets to decode ahead of the one being processed
+    PREFETCH_DEPTH = 4
+    # The default number of frames whose registration offsets are found together
+    REGISTRATION_BATCH_SIZE = 16
+    # The type used for corrected images, kymographs and movie frames. float64 uses twice the memory for no benefit,
+    # since the images come from a 16-bit camera
+    WORKING_DTYPE = "float32"
+    # Corrections that are within this many pixels of a whole-pixel shift are done by copying instead of interpolating
+    WHOLE_PIXEL_TOLERANCE = 0.01
+    # The most ND2 files to keep open for reuse when nothing is reading them
+    MAX_OPEN_ND2_FILES = 8
+    # How ND2s are read: "nd2reader" (parses every file), "mmap" (zero-copy views) or "indexed" (copies each frame).
+    # The last two use our own reader of the ND2 format, which hasn't been checked against nd2reader on a real ND2 yet
+    ND2_BACKEND = "nd2reader"
+    # Which library does the FFTs of registration: "numpy" (identical to phase_correlate) or "fftw" (faster)
+    FFT_BACKEND = "numpy"
+    # The number of threads each FFTW transform uses. When registering with several processes they share these
+    FFT_THREADS = multiprocessing.cpu_count()
+    # The parts of the image used for registration, as fractions of its width. They roughly correspond to the catch
+    # channels on either side of the central trench
+    REGISTRATION_BANDS = ((0.1, 0.3), (0.7, 0.9))
+    # Extra pixels around the catch channels when registering with windows taken from their locations
+    REGISTRATION_WINDOW_MARGIN = 32
+    # Registration offsets are found to within 1/REGISTRATION_UPSAMPLE_FACTOR of a pixel
+    REGISTRATION_UPSAMPLE_FACTOR = 20
+    # Coarse-to-fine registration averages blocks of this many pixels in each direction. 1 turns it off
+    REGISTRATION_DOWNSAMPLE = 1
+    # Register every Nth frame and interpolate the offsets in between. 1 registers every frame
+    REGISTRATION_KEYFRAME_INTERVAL = 1
+    # Frames between two keyframes are registered after all if the keyframes' offsets differ by more pixels than this
+    REGISTRATION_KEYFRAME_THRESHOLD = 0.25
+    # The default number of processes that calculate registration offsets at once
+    JOBS = 1
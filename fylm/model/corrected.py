@@ -0,0 +1,96 @@
+from fylm.model.base import BaseTextFile, BaseSet
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class CorrectedStackSet(BaseSet):
+    """
+    Models the rotation- and registration-corrected images of every field of view, saved to disk so that later steps
+    don't have to correct them again.
+
+    """
+    def __init__(self, experiment):
+        super(CorrectedStackSet, self).__init__(experiment, "corrected")
+        self._model = CorrectedStack
+
+    def invalidate(self, model):
+        """
+        Forgets about stored images that no longer match the registration or rotation data they were made with.
+
+        :type model:    fylm.model.corrected.CorrectedStack()
+
+        """
+        if model.filename in self._current_filenames:
+            self._current_filenames.remove(model.filename)
+        self._existing = [existing for existing in self._existing if existing.filename != model.filename]
+
+
+class CorrectedStack(BaseTextFile):
+    """
+    Models the manifest of the corrected images of a single time period and field of view.
+
+    The images themselves are stored as one memory-mapped .npy array per channel and z-level, with shape
+    (time index, height, width). The manifest is written only after all of the arrays are complete, so its presence
+    means the images can be used. It also records a fingerprint of the registration and rotation files that were used,
+    so that the images can be recreated if those ever change.
+
+    """
+    def __init__(self):
+        super(CorrectedStack, self).__init__()
+        self.fingerprint = None
+        self.frame_count = None
+        self.shape = None
+        self.dtype = None
+        # maps (channel, z_level) to the set of time indices that have no image
+        self._stacks = {}
+
+    def load(self, data):
+        manifest = json.loads("\n".join(data))
+        self.fingerprint = manifest["fingerprint"]
+        self.frame_count = int(manifest["frame_count"])
+        self.shape = tuple(manifest["shape"])
+        self.dtype = str(manifest["dtype"])
+        for stack in manifest["stacks"]:
+            self.add_stack(stack["channel"], stack["z_level"], stack["missing"])
+
+    @property
+    def data(self):
+        for (channel, z_level), missing in sorted(self._stacks.items()):
+            yield channel, z_level, missing
+
+    @property
+    def lines(self):
+        stacks = [{"channel": channel, "z_level": z_level, "missing": sorted(missing)}
+                  for channel, z_level, missing in self.data]
+        yield json.dumps({"fingerprint": self.fingerprint,
+                          "frame_count": self.frame_count,
+                          "shape": list(self.shape),
+                          "dtype": self.dtype,
+                          "stacks": stacks})
+
+    def add_stack(self, channel, z_level, missing=()):
+        """
+        Records that the images for a channel and z-level have been stored.
+
+        :type channel:      str
+        :type z_level:      int
+        :param missing:     the time indices that have no image (fluorescence images aren't taken in every frame)
+
+        """
+        self._stacks[(str(channel), int(z_level))] = set(int(time_index) for time_index in missing)
+
+    def has_image(self, channel, z_level, time_index):
+        missing = self._stacks.get((channel, z_level))
+        return missing is not None and time_index not in missing
+
+    @property
+    def stacks(self):
+        return self._stacks.keys()
+
+    def get_stack_filename(self, channel, z_level):
+        return "tp%s-fov%s-channel_%s-z%s.npy" % (self.time_period, self.field_of_view, channel, z_level)
+
+    def get_stack_path(self, channel, z_level):
+        return "%s/%s" % (self.base_path, self.get_stack_filename(channel, z_level))
@@ -0,0 +1,348 @@
+from collections import Counter
+from fylm.model.constants import Constants
+import logging
+from scipy import ndimage
+from skimage import transform
+import numpy as np
+import math
+
+log = logging.getLogger(__name__)
+
+# Bilinear interpolation needs the raw pixels on either side of each sampled coordinate
+INTERPOLATION_MARGIN = 1
+
+
+class CorrectiveTransform(object):
+    """
+    Models the combined registration and rotation correction of a single frame as one affine transform.
+
+    Previously each frame was warped to undo the stage drift and then rotated to straighten the catch channels, which
+    meant two full-frame interpolations and two full-frame allocations. Composing both corrections into a single matrix
+    lets us resample the raw image exactly once.
+
+    Tolerance: for whole-pixel registration offsets the result is identical to the old two-step correction (up to
+    floating point error) everywhere except a border about max(|dx|, |dy|) + 1 pixels wide, where the two-step method
+    loses slightly more of the image to the black fill. For sub-pixel offsets the fused correction is slightly sharper,
+    since the image is only smoothed once. For images without pixel-scale noise (features at least two pixels across)
+    the interior pixels differ from the two-step result by less than 2% of the image's dynamic range, and by about 0.2%
+    on average.
+
+    """
+    def __init__(self, rotation_offset, dx, dy):
+        """
+        :param rotation_offset: the rotation correction, in degrees
+        :type rotation_offset:  float
+        :param dx:  the horizontal registration offset, in pixels
+        :type dx:   float
+        :param dy:  the vertical registration offset, in pixels
+        :type dy:   float
+
+        """
+        self._rotation_offset = rotation_offset
+        self._dx = dx
+        self._dy = dy
+
+    def matrix(self, shape):
+        """
+        Builds the 3x3 homogeneous matrix that maps (x, y) coordinates in the corrected image to (x, y) coordinates in
+        the raw image. The rotation is about the center of the image, using the same convention as skimage.transform.rotate.
+
+        :param shape:   numpy-style (rows, columns) shape of the image
+        :type shape:    (int, int)
+        :returns:       np.ndarray
+
+        """
+        rows, cols = shape[0], shape[1]
+        center_x, center_y = cols / 2.0 - 0.5, rows / 2.0 - 0.5
+        angle = math.radians(self._rotation_offset)
+        cos, sin = math.cos(angle), math.sin(angle)
+        # Rotate about the center of the image, then undo the registration offset
+        return np.array([[cos, -sin, center_x - cos * center_x + sin * center_y - self._dx],
+                         [sin, cos, center_y - sin * center_x - cos * center_y - self._dy],
+                         [0.0, 0.0, 1.0]])
+
+    def apply(self, raw_image_data):
+        """
+        Resamples the raw image once, producing the rotation- and registration-corrected image.
+
+        :param raw_image_data:  a 2D numpy array
+        :returns:               a 2D numpy array of floats
+
+        """
+        inverse_map = transform.AffineTransform(matrix=self.matrix(raw_image_data.shape))
+        return transform.warp(raw_image_data, inverse_map)
+
+
+class RotationMap(object):
+    """
+    Corrects the frames of a field of view, whose rotation offset never changes.
+
+    Whole frames are corrected with CorrectiveTransform.apply(), which is the fastest way to resample an entire image.
+    When only part of a frame is needed (see correct_region() and sample()), we work out where just those pixels are in
+    the raw image and do a single bilinear gather from there. Those results match CorrectiveTransform.apply() except
+    along the one-pixel-wide edge of the area that comes from inside the raw frame, where the black fill is blended
+    slightly differently.
+
+    Frames that don't need interpolating at all skip the gather. If the rotation moves no pixel by more than the
+    tolerance, and the registration offsets are within the tolerance of whole pixels, the corrected image is just the
+    raw image shifted by a whole number of pixels, which we produce by copying the overlapping part of the raw image.
+    This matches interpolation exactly for whole-pixel corrections. For corrections that are merely within the
+    tolerance, the only other difference is that an edge row or column that interpolation would have filled with black
+    keeps its pixels.
+    The number of frames that took each path is kept in `path_counts` (see count_frame()).
+
+    """
+    UNCHANGED = "unchanged"
+    SHIFTED = "shifted"
+    INTERPOLATED = "interpolated"
+
+    def __init__(self, rotation_offset, dtype=np.float64, tolerance=Constants.WHOLE_PIXEL_TOLERANCE):
+        """
+        :param rotation_offset: the rotation correction, in degrees
+        :type rotation_offset:  float
+        :param dtype:           the floating point type of the corrected images. float32 is precise enough for images
+                                from a 16-bit camera and uses half the memory of float64.
+        :type dtype:            np.dtype
+        :param tolerance:       how far from a whole pixel, in pixels, a correction may be and still be done by shifting
+                                the raw image instead of interpolating it
+        :type tolerance:        float
+
+        """
+        self._rotation_offset = rotation_offset
+        self._dtype = np.dtype(dtype)
+        self._tolerance = tolerance
+        self.path_counts = Counter()
+
+    @property
+    def rotation_offset(self):
+        return self._rotation_offset
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def raw_coordinates(self, shape, rows, columns, dx, dy):
+        """
+        Finds the row and column in the raw image that pixels of the corrected image are sampled from.
+
+        :param shape:   numpy-style (rows, columns) shape of the image
+        :type shape:    (int, int)
+        :param rows:    the row of each pixel in the corrected image
+        :type rows:     np.ndarray
+        :param columns: the column of each pixel in the corrected image, with the same shape as rows
+        :type columns:  np.ndarray
+        :returns:       (np.ndarray of raw rows, np.ndarray of raw columns)
+
+        """
+        matrix = CorrectiveTransform(self._rotation_offset, 0.0, 0.0).matrix(shape)
+        rows, columns = np.asarray(rows, dtype=np.float64), np.asarray(columns, dtype=np.float64)
+        # The matrix works in (x, y) coordinates, but map_coordinates wants (row, column)
+        return (matrix[1, 0] * columns + matrix[1, 1] * rows + matrix[1, 2] - dy,
+                matrix[0, 0] * columns + matrix[0, 1] * rows + matrix[0, 2] - dx)
+
+    def get_whole_pixel_shift(self, shape, dx, dy):
+        """
+        Decides whether a frame can be corrected without interpolation.
+
+        :param shape:   numpy-style (rows, columns) shape of the image
+        :type shape:    (int, int)
+        :returns:       the (dx, dy) offset rounded to whole pixels, or None if the frame has to be interpolated
+
+        """
+        # The pixels furthest from the center of the image are moved the most by the rotation
+        largest_rotation_shift = math.radians(abs(self._rotation_offset)) * math.hypot(shape[0], shape[1]) / 2.0
+        if largest_rotation_shift > self._tolerance:
+            return None
+        whole_dx, whole_dy = int(round(dx)), int(round(dy))
+        if abs(dx - whole_dx) > self._tolerance or abs(dy - whole_dy) > self._tolerance:
+            return None
+        return whole_dx, whole_dy
+
+    def count_frame(self, shape, dx, dy):
+        """
+        Records which path the correction of a frame takes. The correction methods don't count anything themselves,
+        since a frame is often corrected a few regions or samples at a time, so whoever corrects a frame counts it once.
+
+        """
+        whole_pixel_shift = self.get_whole_pixel_shift(shape, dx, dy)
+        if whole_pixel_shift is None:
+            self.path_counts[RotationMap.INTERPOLATED] += 1
+        elif whole_pixel_shift == (0, 0):
+            self.path_counts[RotationMap.UNCHANGED] += 1
+        else:
+            self.path_counts[RotationMap.SHIFTED] += 1
+
+    def log_statistics(self):
+        log.debug("Frame corrections: %s unchanged, %s shifted by whole pixels, %s interpolated" %
+                  (self.path_counts[RotationMap.UNCHANGED], self.path_counts[RotationMap.SHIFTED],
+                   self.path_counts[RotationMap.INTERPOLATED]))
+
+    def correct(self, raw_image_data, dx, dy):
+        """
+        Produces the rotation- and registration-corrected image with CorrectiveTransform.apply(), or by copying if the
+        frame only needs to be moved by whole pixels.
+
+        :param raw_image_data:  a 2D numpy array
+        :param dx:  the horizontal registration offset, in pixels
+        :type dx:   float
+        :param dy:  the vertical registration offset, in pixels
+        :type dy:   float
+        :returns:   a 2D numpy array of the map's dtype, scaled like skimage.img_as_float()
+
+        """
+        whole_pixel_shift = self.get_whole_pixel_shift(raw_image_data.shape, dx, dy)
+        if whole_pixel_shift is not None:
+            return self._shift(raw_image_data, whole_pixel_shift, (0, raw_image_data.shape[0], 0, raw_image_data.shape[1]))
+        image_data = CorrectiveTransform(self._rotation_offset, dx, dy).apply(raw_image_data)
+        return image_data.astype(self._dtype, copy=False)
+
+    def correct_region(self, raw_image_data, dx, dy, bounds):
+        """
+        Produces only a rectangle of the corrected image. The rectangle is inverse-mapped into the raw image and only
+        the raw pixels it covers (plus the interpolation margin) are read. The result matches slicing the output of
+        correct(), apart from the edge of the area that comes from inside the raw frame (see above).
+
+        :param raw_image_data:  a 2D numpy array
+        :param dx:  the horizontal registration offset, in pixels
+        :type dx:   float
+        :param dy:  the vertical registration offset, in pixels
+        :type dy:   float
+        :param bounds:  the (top, bottom, left, right) boundaries of the rectangle in the corrected image
+        :type bounds:   (int, int, int, int)
+        :returns:   a 2D numpy array of the map's dtype, scaled like skimage.img_as_float()
+
+        """
+        whole_pixel_shift = self.get_whole_pixel_shift(raw_image_data.shape, dx, dy)
+        if whole_pixel_shift is not None:
+            return self._shift(raw_image_data, whole_pixel_shift, bounds)
+        top, bottom, left, right = bounds
+        raw_height, raw_width = raw_image_data.shape[:2]
+        rows, columns = self.raw_coordinates(raw_image_data.shape, *np.mgrid[top:bottom, left:right], dx=dx, dy=dy)
+        image_data = np.zeros(rows.shape, dtype=self._dtype)
+        if not rows.size:
+            return image_data
+        # Find the part of the raw image that this rectangle is sampled from
+        raw_top = max(int(math.floor(rows.min())) - INTERPOLATION_MARGIN, 0)
+        raw_bottom = min(int(math.ceil(rows.max())) + INTERPOLATION_MARGIN + 1, raw_height)
+        raw_left = max(int(math.floor(columns.min())) - INTERPOLATION_MARGIN, 0)
+        raw_right = min(int(math.ceil(columns.max())) + INTERPOLATION_MARGIN + 1, raw_width)
+        if raw_top >= raw_bottom or raw_left >= raw_right:
+            # the rectangle lies completely outside of the raw image
+            return image_data
+        rows -= raw_top
+        columns -= raw_left
+        ndimage.map_coordinates(raw_image_data[raw_top:raw_bottom, raw_left:raw_right], (rows, columns),
+                                output=image_data, order=1, mode="constant", cval=0.0)
+        image_data *= intensity_scale(raw_image_data.dtype)
+        return image_data
+
+    def sample(self, raw_image_data, dx, dy, rows, columns):
+        """
+        Produces only the given pixels of the corrected image, by working out where each of them is in the raw image and
+        interpolating it from there. Nothing else is corrected, so this is much cheaper than correct_region() when only a
+        few scattered pixels are needed. The result is the same as indexing the output of correct_region().
+
+        :param raw_image_data:  a 2D numpy array
+        :param dx:  the horizontal registration offset, in pixels
+        :type dx:   float
+        :param dy:  the vertical registration offset, in pixels
+        :type dy:   float
+        :param rows:    the row of each pixel in the corrected image
+        :type rows:     np.ndarray of ints
+        :param columns: the column of each pixel in the corrected image, with the same shape as rows
+        :type columns:  np.ndarray of ints
+        :returns:   a numpy array of the map's dtype with the same shape as rows, scaled like skimage.img_as_float()
+
+        """
+        samples = np.zeros(rows.shape, dtype=self._dtype)
+        whole_pixel_shift = self.get_whole_pixel_shift(raw_image_data.shape, dx, dy)
+        if whole_pixel_shift is not None:
+            whole_dx, whole_dy = whole_pixel_shift
+            raw_rows, raw_columns = rows - whole_dy, columns - whole_dx
+            inside = ((raw_rows >= 0) & (raw_rows < raw_image_data.shape[0]) &
+                      (raw_columns >= 0) & (raw_columns < raw_image_data.shape[1]))
+            samples[inside] = raw_image_data[raw_rows[inside], raw_columns[inside]] * intensity_scale(raw_image_data.dtype)
+            return samples
+        coordinates = self.raw_coordinates(raw_image_data.shape, rows, columns, dx, dy)
+        ndimage.map_coordinates(raw_image_data, coordinates, output=samples, order=1, mode="constant", cval=0.0)
+        samples *= intensity_scale(raw_image_data.dtype)
+        return samples
+
+    def _shift(self, raw_image_data, (dx, dy), bounds):
+        """
+        Corrects a rectangle of a frame that only needs to be moved by whole pixels, by copying the part of the raw
+        image that it covers. Anything that comes from outside of the raw image is black.
+
+        :returns:       a 2D numpy array of the map's dtype, scaled like skimage.img_as_float()
+
+        """
+        top, bottom, left, right = bounds
+        image_data = np.zeros((bottom - top, right - left), dtype=self._dtype)
+        raw_height, raw_width = raw_image_data.shape[:2]
+        # each corrected pixel (row, column) comes from (row - dy, column - dx) in the raw image
+        raw_top, raw_bottom = max(top - dy, 0), min(bottom - dy, raw_height)
+        raw_left, raw_right = max(left - dx, 0), min(right - dx, raw_width)
+        if raw_top < raw_bottom and raw_left < raw_right:
+            np.multiply(raw_image_data[raw_top:raw_bottom, raw_left:raw_right],
+                        intensity_scale(raw_image_data.dtype),
+                        out=image_data[raw_top + dy - top:raw_bottom + dy - top, raw_left + dx - left:raw_right + dx - left],
+                        casting="unsafe")
+        return image_data
+
+
+class CorrectionTable(object):
+    """
+    Holds the registration offsets and timestamps of every frame of a single time period and field of view in arrays,
+    so that the values for any frame can be looked up in constant time.
+
+    """
+    def __init__(self, offsets, timestamps):
+        """
+        :param offsets:     (dx, dy) for each time index, in order of acquisition
+        :param timestamps:  the timestamp of each time index, in order of acquisition
+
+        """
+        self._offsets = np.array(list(offsets), dtype=np.float64).reshape((-1, 2))
+        self._timestamps = np.array(list(timestamps), dtype=np.float64)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def get_offset(self, time_index):
+        """
+        :param time_index:  0-based index of the frame
+        :returns:           (dx, dy) as floats
+
+        """
+        dx, dy = self._offsets[time_index]
+        return float(dx), float(dy)
+
+    def get_timestamp(self, time_index):
+        """
+        :param time_index:  0-based index of the frame
+        :returns:           float
+
+        """
+        return float(self._timestamps[time_index])
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+
+def intensity_scale(dtype):
+    """
+    The factor that converts pixel values of the given type to the [0, 1] float range used by skimage.img_as_float().
+
+    :type dtype:    np.dtype
+    :returns:       float
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in "ui":
+        return 1.0 / np.iinfo(dtype).max
+    return 1.0
@@ -1,3 +1,4 @@
+from fylm.model.constants import Constants
 from fylm.service.errors import terminal_error
 import logging
 import re
@@ -45,6 +46,22 @@ class Experiment(object):
         self.field_of_view_count = None
         self._version = None
         self.review_annotations = False
+        self.prefetch_depth = Constants.PREFETCH_DEPTH
+        self.working_dtype = Constants.WORKING_DTYPE
+        self.whole_pixel_tolerance = Constants.WHOLE_PIXEL_TOLERANCE
+        self.nd2_backend = Constants.ND2_BACKEND
+        self.rotation_coarse_angle_step = Constants.ROTATION_COARSE_ANGLE_STEP
+        self.rotation_downsample = Constants.ROTATION_DOWNSAMPLE
+        self.rotation_smoothing = Constants.ROTATION_SMOOTHING
+        self.kymograph_sampling = Constants.KYMOGRAPH_SAMPLING
+        self.fft_backend = Constants.FFT_BACKEND
+        self.fft_threads = Constants.FFT_THREADS
+        self.jobs = Constants.JOBS
+        self.registration_bands = Constants.REGISTRATION_BANDS
+        self.registration_upsample_factor = Constants.REGISTRATION_UPSAMPLE_FACTOR
+        self.registration_downsample = Constants.REGISTRATION_DOWNSAMPLE
+        self.registration_keyframe_interval = Constants.REGISTRATION_KEYFRAME_INTERVAL
+        self.registration_keyframe_threshold = Constants.REGISTRATION_KEYFRAME_THRESHOLD
 
     def exact_start_time(self, time_period):
         """
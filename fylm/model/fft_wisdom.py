@@ -0,0 +1,33 @@
+from fylm.model.base import BaseTextFile
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class FFTWisdom(BaseTextFile):
+    """
+    Models FFTW's wisdom: what it measured about the fastest way to do each transform it has planned. Planning the
+    transforms of registration takes a while, so we save the wisdom with the experiment and load it on later runs,
+    which lets FFTW skip planning.
+
+    """
+    def __init__(self):
+        super(FFTWisdom, self).__init__()
+        # one string per floating point precision, as given by pyfftw.export_wisdom()
+        self.wisdom = ()
+
+    def load(self, data):
+        self.wisdom = tuple(str(wisdom) for wisdom in json.loads("\n".join(data)))
+
+    @property
+    def data(self):
+        return self.wisdom
+
+    @property
+    def lines(self):
+        yield json.dumps(list(self.wisdom))
+
+    @property
+    def filename(self):
+        return "fftw-wisdom.txt"
@@ -0,0 +1,80 @@
+from fylm.model.constants import Constants
+import logging
+import numpy as np
+from skimage import transform
+
+log = logging.getLogger(__name__)
+
+# Coarse angles whose strongest line is at least this fraction of the strongest line overall are searched at full
+# resolution. Peaks are only reported above half of the strongest line, so this leaves some margin for the coarse grid
+# missing the exact angle of a line.
+CANDIDATE_FRACTION = 0.4
+# How many coarse steps on either side of each candidate angle are searched at full resolution
+REFINEMENT_RADIUS = 2
+# How many angles apart two lines have to be for transform.hough_line_peaks() to tell them apart (its default)
+PEAK_MIN_ANGLE = 10
+
+
+def find_line_angles(skeleton, max_angle=Constants.FIFTEEN_DEGREES_IN_RADIANS, step=Constants.ROTATION_ANGLE_STEP,
+                     coarse_step=Constants.ROTATION_COARSE_ANGLE_STEP, downsample=1):
+    """
+    Finds the angles of the most prominent lines in a binary image with the Hough transform, with 0.0 being completely
+    vertical.
+
+    The cost of the Hough transform is proportional to the number of angles it tries, and we want to know the angles to
+    within 0.0001 radians over a range of 30 degrees, which is over 5000 angles. Instead of trying all of them, we first
+    try every `coarse_step` radians, and then only try every `step` radians around the angles where the coarse search
+    found strong lines. Everywhere else the Hough space is left empty, so the peaks are found exactly as if every angle
+    had been tried, as long as the coarse search didn't miss any lines.
+
+    :param skeleton:    a binary image of one pixel wide lines
+    :type skeleton:     2D np.ndarray
+    :param max_angle:   angles from -max_angle to max_angle are searched, in radians
+    :type max_angle:    float
+    :param step:        the precision of the angles, in radians
+    :type step:         float
+    :param coarse_step: the spacing of the angles of the coarse search, in radians. If it's no larger than `step`,
+                        every angle is tried
+    :type coarse_step:  float
+    :param downsample:  shrink the image by this factor before searching, which is faster but less accurate
+    :type downsample:   int
+    :returns:           list of float
+
+    """
+    if downsample > 1:
+        skeleton = _downsample(skeleton, downsample)
+    angles = np.arange(-max_angle, max_angle, step)
+    stride = int(round(coarse_step / step))
+    if stride <= 1:
+        hough = transform.hough_line(skeleton, angles)
+    else:
+        # The coarse angles are a subset of the fine ones, so that their neighbourhoods line up with the fine grid
+        coarse_hough, _, distances = transform.hough_line(skeleton, angles[::stride])
+        strongest_lines = coarse_hough.max(axis=0)
+        if not strongest_lines.any():
+            return []
+        searched = np.zeros(len(angles), dtype=np.bool)
+        for candidate in np.flatnonzero(strongest_lines >= CANDIDATE_FRACTION * strongest_lines.max()):
+            searched[max(0, (candidate - REFINEMENT_RADIUS) * stride):(candidate + REFINEMENT_RADIUS) * stride + 1] = True
+        fine_hough, _, _ = transform.hough_line(skeleton, angles[searched])
+        # Finding the peaks takes longer than the Hough transform itself, so we only look at the part of Hough space
+        # that has anything in it. The empty margins keep the neighbourhoods of the peaks the same as they would be in
+        # the whole of Hough space.
+        searched_columns = np.flatnonzero(searched)
+        start = max(0, searched_columns[0] - PEAK_MIN_ANGLE)
+        stop = min(len(angles), searched_columns[-1] + PEAK_MIN_ANGLE + 1)
+        accumulator = np.zeros((len(distances), stop - start), dtype=fine_hough.dtype)
+        accumulator[:, searched[start:stop]] = fine_hough
+        log.debug("Searched %s of %s angles" % (len(angles[::stride]) + len(searched_columns), len(angles)))
+        hough = accumulator, angles[start:stop], distances
+    return [angle for _, angle, dist in zip(*transform.hough_line_peaks(*hough, min_angle=PEAK_MIN_ANGLE))]
+
+
+def _downsample(skeleton, factor):
+    """
+    Shrinks a binary image, keeping a pixel wherever any of the pixels it replaces were set.
+
+    """
+    rows, columns = skeleton.shape[0] // factor, skeleton.shape[1] // factor
+    blocks = skeleton[:rows * factor, :columns * factor].reshape(rows, factor, columns, factor)
+    return blocks.any(axis=(1, 3))
@@ -1,30 +1,151 @@
-from skimage import transform
+from fylm.model.correction import CorrectiveTransform, RotationMap
 import logging
 
 log = logging.getLogger(__name__)
 
 
 class ImageSet(object):
-    def __init__(self, nd2_image_set, rotation_offset, (dx, dy), time_index, timestamp):
+    def __init__(self, nd2_image_set, rotation_offset, (dx, dy), time_index, timestamp, rotation_map=None,
+                 frame_cache=None, cache_key=None):
+        """
+        :param frame_cache:     a cache of corrected images shared with other readers
+        :type frame_cache:      fylm.service.cache.FrameCache()
+        :param cache_key:       the (time_period, field_of_view) that this image set belongs to
+        :type cache_key:        (int, int)
+
+        """
         self._nd2_image_set = nd2_image_set
         self._rotation_offset = rotation_offset
+        self._rotation_map = rotation_map
+        self._frame_cache = frame_cache
+        self._cache_key = cache_key
         self._dx = dx
         self._dy = dy
         self._time_index = time_index
         self._timestamp = timestamp
+        # whether this image set has been counted in the rotation map's path counts yet
+        self._counted = False
 
     def get_image(self, channel="", z_level=1):
+        image_data = self._get_cached_image(channel, z_level)
+        if image_data is not None:
+            return image_data
         for image in self._nd2_image_set:
             if image.channel == channel and image.z_level == z_level:
-                return self._correct_image(image)
+                image_data = self._correct_image(image)
+                if self._frame_cache is not None and self._cache_key is not None:
+                    image_data = self._frame_cache.put(self._get_frame_key(channel, z_level), image_data)
+                return image_data
         return None
 
+    def _get_cached_image(self, channel, z_level):
+        if self._frame_cache is None or self._cache_key is None:
+            return None
+        return self._frame_cache.get(self._get_frame_key(channel, z_level))
+
+    def _get_frame_key(self, channel, z_level):
+        time_period, field_of_view = self._cache_key
+        return self._frame_cache.key(time_period, field_of_view, self._time_index, channel, z_level,
+                                     self._rotation_offset, self._dx, self._dy, self.rotation_map.dtype)
+
+    def get_image_slices(self, image_slices, channel="", z_level=1, y_margin=0):
+        """
+        Corrects only the parts of an image covered by the given image slices, and loads the corrected data into each
+        slice. This is much faster than correcting the entire image when we only need the catch channels.
+
+        :type image_slices:     list of fylm.model.image_slice.ImageSlice()
+        :param y_margin:        number of pixels above and below each channel to add to the slice
+        :type y_margin:         int
+        :returns:               bool, whether an image existed for the given channel and z-level
+
+        """
+        image_data = self._get_cached_image(channel, z_level)
+        if image_data is not None:
+            # the whole image has already been corrected, so we can just cut out the slices
+            for image_slice in image_slices:
+                image_slice.set_image(image_data, y_margin)
+            return True
+        for image in self._nd2_image_set:
+            if image.channel == channel and image.z_level == z_level:
+                raw_image_data = image.data
+                self._count_frame(raw_image_data)
+                for image_slice in image_slices:
+                    bounds = image_slice.get_bounds(raw_image_data.shape, y_margin)
+                    image_data = self.rotation_map.correct_region(raw_image_data, self._dx, self._dy, bounds)
+                    image_slice.set_image_data(image_data, y_margin)
+                return True
+        return False
+
+    def get_image_regions(self, regions, out, channel="", z_level=1):
+        """
+        Corrects only the given parts of an image, leaving the rest of it alone.
+
+        :param regions:     (top, bottom, left, right) of each part of the image that's needed
+        :type regions:      list of tuple
+        :param out:         an array the size of the image that the corrected regions are written to. Only the regions
+                            are written, so it can be reused for every image of a field of view.
+        :type out:          np.ndarray
+        :returns:           np.ndarray, or None if there's no image for the given channel and z-level
+
+        """
+        image_data = self._get_cached_image(channel, z_level)
+        if image_data is not None:
+            return image_data
+        for image in self._nd2_image_set:
+            if image.channel == channel and image.z_level == z_level:
+                raw_image_data = image.data
+                self._count_frame(raw_image_data)
+                for top, bottom, left, right in regions:
+                    out[top:bottom, left:right] = self.rotation_map.correct_region(raw_image_data, self._dx, self._dy,
+                                                                                   (top, bottom, left, right))
+                return out
+        return None
+
+    def get_samples(self, rows, columns, channel="", z_level=1):
+        """
+        Gets individual pixels of the corrected image without correcting the image. Each one is interpolated straight
+        from the raw image (see RotationMap.sample()).
+
+        :param rows:        the row of each pixel
+        :type rows:         np.ndarray of ints
+        :param columns:     the column of each pixel, with the same shape as rows
+        :type columns:      np.ndarray of ints
+        :returns:           np.ndarray with the same shape as rows, or None if there's no image for the given channel and
+                            z-level
+
+        """
+        image_data = self._get_cached_image(channel, z_level)
+        if image_data is not None:
+            return image_data[rows, columns]
+        for image in self._nd2_image_set:
+            if image.channel == channel and image.z_level == z_level:
+                self._count_frame(image.data)
+                return self.rotation_map.sample(image.data, self._dx, self._dy, rows, columns)
+        return None
+
+    @property
+    def rotation_map(self):
+        if self._rotation_map is None:
+            self._rotation_map = RotationMap(self._rotation_offset)
+        return self._rotation_map
+
+    def _count_frame(self, raw_image_data):
+        """
+        Counts the correction path of this image set once, no matter how many of its images, regions or samples are
+        corrected. Every image of the set has the same registration offsets, so they all take the same path.
+
+        """
+        if not self._counted:
+            self.rotation_map.count_frame(raw_image_data.shape, self._dx, self._dy)
+            self._counted = True
+
     def _correct_image(self, image):
         """
         Registers and rotates the image and returns the raw image data.
 
         """
-        return Image(image.data, self._rotation_offset, self._dx, self._dy, self._timestamp).data
+        self._count_frame(image.data)
+        return Image(image.data, self._rotation_offset, self._dx, self._dy, self._timestamp, self.rotation_map).data
 
     @property
     def timestamp(self):
@@ -39,19 +160,101 @@ class ImageSet(object):
             yield self._correct_image(image)
 
 
+class StoredImageSet(object):
+    """
+    Provides the same interface as ImageSet, but for images that were corrected ahead of time and stored on disk.
+    Images are views into memory-mapped arrays, so nothing is decoded, corrected or copied.
+
+    """
+    def __init__(self, stacks, stack_model, time_index, timestamp):
+        """
+        :param stacks:          (channel, z_level) -> memory-mapped array of images
+        :type stacks:           dict
+        :type stack_model:      fylm.model.corrected.CorrectedStack()
+
+        """
+        self._stacks = stacks
+        self._stack_model = stack_model
+        self._time_index = time_index
+        self._timestamp = timestamp
+
+    def get_image(self, channel="", z_level=1):
+        if not self._stack_model.has_image(channel, z_level, self._time_index):
+            return None
+        return self._stacks[(channel, z_level)][self._time_index]
+
+    def get_image_slices(self, image_slices, channel="", z_level=1, y_margin=0):
+        image_data = self.get_image(channel, z_level)
+        if image_data is None:
+            return False
+        for image_slice in image_slices:
+            image_slice.set_image(image_data, y_margin)
+        return True
+
+    def get_image_regions(self, regions, out, channel="", z_level=1):
+        # the stored images are already corrected, so there's nothing to do
+        return self.get_image(channel, z_level)
+
+    def get_samples(self, rows, columns, channel="", z_level=1):
+        image_data = self.get_image(channel, z_level)
+        if image_data is None:
+            return None
+        return image_data[rows, columns]
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def time_index(self):
+        return self._time_index
+
+    def __iter__(self):
+        for channel, z_level in sorted(self._stacks.keys()):
+            image_data = self.get_image(channel, z_level)
+            if image_data is not None:
+                yield image_data
+
+
+class CorrectedImage(object):
+    """
+    An image that was already rotation- and registration-corrected, such as one that came out of the frame cache.
+
+    """
+    def __init__(self, image_data, timestamp):
+        self._image_data = image_data
+        self._timestamp = timestamp
+
+    @property
+    def data(self):
+        return self._image_data
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+
 class Image(object):
-    def __init__(self, raw_image_data, rotation_offset, dx, dy, timestamp):
+    def __init__(self, raw_image_data, rotation_offset, dx, dy, timestamp, rotation_map=None):
+        """
+        :param rotation_map:    the rotation map of this field of view, if one is available
+        :type rotation_map:     fylm.model.correction.RotationMap()
+
+        """
         self._raw_image_data = raw_image_data
         self._rotation_offset = rotation_offset
-        self._corrective_transform = transform.AffineTransform(translation=(-dx, -dy))
+        self._dx = dx
+        self._dy = dy
+        self._corrective_transform = CorrectiveTransform(rotation_offset, dx, dy)
+        self._rotation_map = rotation_map
         self._timestamp = timestamp
 
     @property
     def data(self):
         """
-        Returns rotation- and registration-corrected image.
+        Returns rotation- and registration-corrected image. Both corrections are applied in a single interpolation.
 
         """
-        image = transform.warp(self._raw_image_data, self._corrective_transform)
-        image_data = transform.rotate(image, self._rotation_offset)
-        return image_data
\ No newline at end of file
+        if self._rotation_map is not None:
+            return self._rotation_map.correct(self._raw_image_data, self._dx, self._dy)
+        return self._corrective_transform.apply(self._raw_image_data)
\ No newline at end of file
@@ -37,20 +37,43 @@ class ImageSlice(object):
         :type y_margin:         int
 
         """
-        self._y_margin = y_margin
-        parent_height = image_data.shape[0]
-        parent_width = image_data.shape[1]
+        top, bottom, left, right = self.get_bounds(image_data.shape, y_margin)
+        self.set_image_data(image_data[top:bottom, left:right], y_margin)
 
-        y_slice_coords = max(self._top_left.y - y_margin, 0), min(self._top_left.y + self._height + y_margin, parent_height)
-        x_slice_coords = max(self._top_left.x, 0), min(self._top_left.x + self.width, parent_width)
-        y_diff = y_slice_coords[1] - y_slice_coords[0]
-        image_data_slice = image_data[y_slice_coords[0]:y_slice_coords[1] + y_diff, x_slice_coords[0]:x_slice_coords[1]]
+    def set_image_data(self, image_data_slice, y_margin=0):
+        """
+        Sets image data that has already been cut out of the parent image using the bounds from get_bounds().
 
+        :param image_data_slice:    2D numpy array
+        :param y_margin:            number of pixels above and below the channel that were added to the slice
+        :type y_margin:             int
+
+        """
+        self._y_margin = y_margin
         if self._fliplr:
             self._image_data = np.fliplr(image_data_slice)
         else:
             self._image_data = image_data_slice
 
+    def get_bounds(self, parent_shape, y_margin=0):
+        """
+        Determines which rows and columns of the parent image make up the slice.
+
+        :param parent_shape:    numpy-style (rows, columns) shape of the parent image
+        :param y_margin:        number of pixels above and below the channel to add to the slice
+        :type y_margin:         int
+        :returns:               (top, bottom, left, right) as ints, suitable for slicing the parent image
+
+        """
+        parent_height = parent_shape[0]
+        parent_width = parent_shape[1]
+
+        y_slice_coords = max(self._top_left.y - y_margin, 0), min(self._top_left.y + self._height + y_margin, parent_height)
+        x_slice_coords = max(self._top_left.x, 0), min(self._top_left.x + self.width, parent_width)
+        y_diff = y_slice_coords[1] - y_slice_coords[0]
+        return (int(y_slice_coords[0]), int(min(y_slice_coords[1] + y_diff, parent_height)),
+                int(x_slice_coords[0]), int(x_slice_coords[1]))
+
     def get_parent_coordinates(self, local_coordinates):
         """
         Takes an x,y coordinate in the image slice and determines where that coodinate is in the parent image.
@@ -60,15 +60,31 @@ class Kymograph(BaseImage):
         self._channel = None
         self._image_slice = None
 
-    def allocate_memory(self, frame_count):
+    def allocate_memory(self, frame_count, dtype=np.float64):
         """
         Creates an empty matrix - this is faster and easier than appending rows to an existing matrix every time more
         data comes in.
 
         :param frame_count:         the number of images in the image stack (corresponds to kymograph height)
+        :param dtype:               the type of the kymograph's pixels
+        :type dtype:                np.dtype
+        :returns:                   int, the number of bytes allocated
 
         """
-        self._image_data = np.zeros((frame_count, self.width))
+        self._image_data = np.zeros((frame_count, int(self.width)), dtype=dtype)
+        return self._image_data.nbytes
+
+    def use_memory(self, image_data):
+        """
+        Stores the kymograph in an array that was allocated elsewhere, such as a part of the array that a
+        KymographExtractor fills in for every kymograph of a field of view at once.
+
+        :param image_data:  2D numpy array with one row per image and one column per pixel of the channel
+        :returns:           int, the number of bytes used
+
+        """
+        self._image_data = image_data
+        return image_data.nbytes
 
     def free_memory(self):
         """
@@ -81,6 +97,10 @@ class Kymograph(BaseImage):
     def set_image(self, image):
         self._image_slice.set_image(image)
 
+    @property
+    def image_slice(self):
+        return self._image_slice
+
     @property
     def width(self):
         """
@@ -130,4 +150,125 @@ class Kymograph(BaseImage):
 
     @property
     def filename(self):
-        return "tp%s-fov%s-channel%s.png" % (self.time_period, self.field_of_view, self.channel_number)
\ No newline at end of file
+        return "tp%s-fov%s-channel%s.png" % (self.time_period, self.field_of_view, self.channel_number)
+
+
+class KymographExtractor(object):
+    """
+    Adds a line to every kymograph of a field of view from each image at once.
+
+    Each line of a kymograph is the average of the three rows through the middle of its catch channel (see
+    ImageSlice.average_around_center()). Rather than cutting each channel out of the image, flipping it if it points to
+    the left and averaging it, one kymograph at a time, we work out where all of those pixels are in the image ahead of
+    time. Then each image only takes one gather and one mean, and the lines are written to one array that holds every
+    kymograph.
+
+    Since we know exactly which pixels of the corrected image we need, we don't have to correct the image at all: the
+    rotation and registration corrections can instead be used to find those pixels in the raw image and interpolate just
+    them (see RotationMap.sample() and add_samples()).
+
+    """
+    def __init__(self, kymograph_models, shape):
+        """
+        :param kymograph_models:    kymographs whose locations have been set
+        :type kymograph_models:     list of fylm.model.kymograph.Kymograph()
+        :param shape:               numpy-style (rows, columns) shape of the images
+        :type shape:                tuple
+
+        """
+        self._kymographs = kymograph_models
+        self._starts = []
+        self._widths = []
+        self._regions = []
+        sample_rows = []
+        sample_columns = []
+        line_columns = []
+        start = 0
+        for kymograph_model in kymograph_models:
+            top, bottom, left, right = kymograph_model.image_slice.get_bounds(shape)
+            center_row = top + (bottom - top) // 2
+            rows = np.clip(np.arange(center_row - 1, center_row + 2), 0, shape[0] - 1)
+            columns = np.arange(left, right)
+            if kymograph_model.image_slice.fliplr:
+                columns = columns[::-1]
+            # Every pixel we need, with one row for each of the three rows through the channel
+            sample_rows.append(np.repeat(rows[:, np.newaxis], len(columns), axis=1))
+            sample_columns.append(np.tile(columns, (3, 1)))
+            line_columns.append(np.arange(start, start + len(columns)))
+            self._regions.append((max(center_row - 1, 0), min(center_row + 2, shape[0]), left, right))
+            self._starts.append(start)
+            # The channel's coordinates are floats, so this can be a pixel wider than int(kymograph_model.width)
+            self._widths.append(len(columns))
+            start += len(columns)
+        self._line_width = start
+        self._rows = np.hstack(sample_rows) if sample_rows else np.zeros((3, 0), dtype=np.intp)
+        self._columns = np.hstack(sample_columns) if sample_columns else np.zeros((3, 0), dtype=np.intp)
+        self._indices = np.ravel_multi_index((self._rows, self._columns), shape)
+        self._line_columns = np.concatenate(line_columns) if line_columns else np.zeros(0, dtype=np.intp)
+        self._lines = None
+
+    @property
+    def regions(self):
+        """
+        The parts of the image that lines are taken from, which are the only parts that need to be corrected.
+
+        :returns:   list of (top, bottom, left, right)
+
+        """
+        return self._regions
+
+    @property
+    def rows(self):
+        """
+        The row of every pixel that lines are taken from, with one row of this array for each of the three rows through
+        the channels.
+
+        :returns:   np.ndarray with shape (3, pixels)
+
+        """
+        return self._rows
+
+    @property
+    def columns(self):
+        """
+        The column of every pixel that lines are taken from, in the same order as the rows.
+
+        :returns:   np.ndarray with shape (3, pixels)
+
+        """
+        return self._columns
+
+    def allocate_memory(self, frame_count, dtype=np.float64):
+        """
+        Creates one array for all of the kymographs, and gives each kymograph its own columns of it.
+
+        :param frame_count:     the number of images in the image stack (corresponds to kymograph height)
+        :param dtype:           the type of the kymographs' pixels
+        :type dtype:            np.dtype
+        :returns:               int, the number of bytes allocated
+
+        """
+        self._lines = np.zeros((frame_count, self._line_width), dtype=dtype)
+        for kymograph_model, start, width in zip(self._kymographs, self._starts, self._widths):
+            kymograph_model.use_memory(self._lines[:, start:start + width])
+        return self._lines.nbytes
+
+    def add_lines(self, time_index, image_data):
+        """
+        Takes a line for every kymograph from an image.
+
+        :param image_data:  a 2D numpy array. Only the regions need to have been corrected
+        :type time_index:   int
+
+        """
+        self.add_samples(time_index, image_data.take(self._indices))
+
+    def add_samples(self, time_index, samples):
+        """
+        Adds a line to every kymograph from the values of the pixels at rows and columns.
+
+        :param samples:     np.ndarray with the same shape as rows
+        :type time_index:   int
+
+        """
+        self._lines[time_index, self._line_columns] = samples.mean(axis=0)
\ No newline at end of file
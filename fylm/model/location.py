@@ -148,6 +148,20 @@ class Location(BaseTextFile):
             if not locations == "skipped":
                 yield channel_number, locations
 
+    @property
+    def channel_bounds(self):
+        """
+        The rectangle that each catch channel occupies, for the channels that weren't skipped.
+
+        :returns:   generator of (left, top, right, bottom) in pixels, in the rotation-corrected image
+
+        """
+        for channel_number, locations in self._ordered_channels:
+            if locations == "skipped":
+                continue
+            notch, tube = locations
+            yield min(notch.x, tube.x), min(notch.y, tube.y), max(notch.x, tube.x), max(notch.y, tube.y)
+
     def get_channel_data(self, channel_number):
         return self._channels[channel_number]
 
@@ -25,6 +25,7 @@ class MovieSet(BaseSet):
         super(MovieSet, self).__init__(experiment, "movie")
         self._regex = re.compile(r"""tp\d+-fov\d+-channel\d+.avi""")
         self._field_of_view = field_of_view
+        self._dtype = experiment.working_dtype
         self._location_set_model = LocationSet(experiment)
         LocationService(experiment).load_existing_models(self._location_set_model)
         kymograph_set = KymographSet(experiment)
@@ -52,6 +53,7 @@ class MovieSet(BaseSet):
                         model.field_of_view = location_model.field_of_view
                         model.catch_channel_number = channel_number
                         model.annotation = annotation
+                        model.dtype = self._dtype
                         yield model
 
 
@@ -71,6 +73,7 @@ class Movie(BaseMovie):
         self.__slots = defaultdict(dict)
         self._triangles = {}
         self.annotation = None
+        self.dtype = np.float64
 
     @property
     def filename(self):
@@ -104,7 +107,7 @@ class Movie(BaseMovie):
 
         """
         # Create a black square to use as a blank canvas to add image slices to
-        image = np.zeros((self._frame_height, self._frame_width))
+        image = np.zeros((self._frame_height, self._frame_width), dtype=self.dtype)
         # Go through each slot (one per channel/z-level combination) and assign image data to it
         for n, slot in enumerate(self._slots):
             top, bottom = self._get_slot_bounds(n)
@@ -155,7 +158,18 @@ class Movie(BaseMovie):
         # doesn't have image data for the first frame. This occurs for fluorescent channels sometimes since we only take
         # those images every four minutes instead of every two, in order to minimize the amount of blue light that the cells
         # are exposed to (there's evidence that it's phototoxic).
-        self.__slots[channel_name][z_level] = np.zeros((self._slot_height, self._slot_width, 3))
+        # The slots hold grayscale image data, the frame is only converted to RGB once it's been assembled.
+        self.__slots[channel_name][z_level] = np.zeros((self._slot_height, self._slot_width), dtype=self.dtype)
+
+    @property
+    def slot_bytes(self):
+        """
+        The memory used by the image data of all slots.
+
+        :return:    int
+
+        """
+        return sum(slot.nbytes for slot in self._slots)
 
     def _get_slot_bounds(self, position):
         """
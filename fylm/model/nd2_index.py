@@ -0,0 +1,137 @@
+from fylm.model.base import BaseTextFile
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+class Nd2Index(BaseTextFile):
+    """
+    Models the index of a single ND2 file: its metadata and where every image is stored inside it.
+
+    Parsing an ND2 means scanning its header and chunk map, which takes minutes for our largest experiments. The index
+    lets us skip that on every run after the first. It's only valid for the exact file it was made from, so it records
+    the size and modification time of the ND2 and is rebuilt if either changes.
+
+    ND2s store all of the channels of a (time index, field of view, z-level) together as one "image group": an eight
+    byte timestamp followed by 16-bit pixels, with the channels interleaved. We record where the data of each image
+    group starts and how long it is, which is enough to find any frame.
+
+    """
+    # The size in bytes of the timestamp at the start of each image group
+    TIMESTAMP_SIZE = 8
+    PIXEL_SIZE = 2
+
+    def __init__(self):
+        super(Nd2Index, self).__init__()
+        self.nd2_filename = None
+        self.nd2_size = None
+        self.nd2_mtime = None
+        self.start_unix_timestamp = None
+        self.field_of_view_count = None
+        self.time_index_count = None
+        self.z_level_count = None
+        self.channel_names = []
+        self.height = None
+        self.width = None
+        # (offset, length) of the data of each image group, or None if it was never acquired
+        self.image_groups = []
+
+    def load(self, data):
+        index = json.loads("\n".join(data))
+        self.nd2_filename = index["nd2_filename"]
+        self.nd2_size = int(index["nd2_size"])
+        self.nd2_mtime = float(index["nd2_mtime"])
+        self.start_unix_timestamp = float(index["start_unix_timestamp"])
+        self.field_of_view_count = int(index["field_of_view_count"])
+        self.time_index_count = int(index["time_index_count"])
+        self.z_level_count = int(index["z_level_count"])
+        self.channel_names = [str(channel_name) for channel_name in index["channel_names"]]
+        self.height = int(index["height"])
+        self.width = int(index["width"])
+        self.image_groups = [tuple(image_group) if image_group is not None else None
+                             for image_group in index["image_groups"]]
+
+    @property
+    def data(self):
+        for image_group_number, image_group in enumerate(self.image_groups):
+            yield image_group_number, image_group
+
+    @property
+    def lines(self):
+        yield json.dumps({"nd2_filename": self.nd2_filename,
+                          "nd2_size": self.nd2_size,
+                          "nd2_mtime": self.nd2_mtime,
+                          "start_unix_timestamp": self.start_unix_timestamp,
+                          "field_of_view_count": self.field_of_view_count,
+                          "time_index_count": self.time_index_count,
+                          "z_level_count": self.z_level_count,
+                          "channel_names": self.channel_names,
+                          "height": self.height,
+                          "width": self.width,
+                          "image_groups": self.image_groups})
+
+    @property
+    def filename(self):
+        return "%s.txt" % os.path.splitext(os.path.basename(self.nd2_filename))[0]
+
+    def is_current(self, nd2_size, nd2_mtime):
+        """
+        Whether the index was made from a file with this size and modification time.
+
+        """
+        return self.nd2_size == nd2_size and self.nd2_mtime == nd2_mtime
+
+    @property
+    def has_fluorescent_channels(self):
+        return any(channel_name != "" for channel_name in self.channel_names)
+
+    def get_image_group_number(self, time_index, field_of_view, z_level):
+        """
+        Image groups are stored in order of time index, then field of view, then z-level.
+
+        :returns:   int
+
+        """
+        return (time_index * self.field_of_view_count * self.z_level_count +
+                field_of_view * self.z_level_count + z_level)
+
+    def get_image_group(self, time_index, field_of_view, z_level):
+        """
+        :returns:   (offset, length) of the image group's data in the ND2, or None if it doesn't exist
+
+        """
+        image_group_number = self.get_image_group_number(time_index, field_of_view, z_level)
+        if not 0 <= image_group_number < len(self.image_groups):
+            return None
+        return self.image_groups[image_group_number]
+
+    def get_channel_count(self, image_group):
+        """
+        The number of channels stored in an image group, which isn't necessarily the number of channels in the file.
+
+        :param image_group:     (offset, length)
+        :returns:               int
+
+        """
+        _, length = image_group
+        return (length - Nd2Index.TIMESTAMP_SIZE) // (self.height * self.width * Nd2Index.PIXEL_SIZE)
+
+    def get_frame_offset(self, time_index, field_of_view, channel_name, z_level):
+        """
+        Finds the first pixel of a frame. The rest follow every `stride` bytes.
+
+        :returns:   (offset, stride) in bytes, or None if the frame doesn't exist
+
+        """
+        image_group = self.get_image_group(time_index, field_of_view, z_level)
+        if image_group is None or channel_name not in self.channel_names:
+            return None
+        channel_count = self.get_channel_count(image_group)
+        channel_offset = self.channel_names.index(channel_name)
+        if channel_offset >= channel_count:
+            return None
+        offset, _ = image_group
+        return (offset + Nd2Index.TIMESTAMP_SIZE + channel_offset * Nd2Index.PIXEL_SIZE,
+                channel_count * Nd2Index.PIXEL_SIZE)
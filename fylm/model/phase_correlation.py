@@ -0,0 +1,535 @@
+from fylm.model.constants import Constants
+from fylm.model.correction import CorrectiveTransform
+from itertools import izip
+import logging
+import math
+import numpy as np
+from scipy import fftpack
+import time
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+log = logging.getLogger(__name__)
+
+
+def band_windows(shape, bands=Constants.REGISTRATION_BANDS):
+    """
+    Makes full-height registration windows out of column bands.
+
+    :param shape:   numpy-style (rows, columns) shape of the image
+    :type shape:    (int, int)
+    :param bands:   the left and right edge of each band, as fractions of the width of the image
+    :type bands:    tuple of (float, float)
+    :returns:       list of (row slice, column slice)
+
+    """
+    width = shape[1]
+    return [(slice(None), slice(int(width * left), int(width * right))) for left, right in bands]
+
+
+def location_windows(shape, channel_bounds, rotation_offset=0.0, margin=Constants.REGISTRATION_WINDOW_MARGIN):
+    """
+    Makes registration windows that only contain the catch channels: one around the channels on the left side of the
+    central trench, and one around those on the right. These are usually much smaller than the full-height bands, and
+    leave out the trench and the rest of the device, where debris would throw registration off.
+
+    The windows are grown a little so that their sizes are products of small primes, which FFTs are fastest for.
+
+    :param shape:           numpy-style (rows, columns) shape of the image
+    :type shape:            (int, int)
+    :param channel_bounds:  the (left, top, right, bottom) of each catch channel in the rotation-corrected image, as
+                            given by fylm.model.location.Location.channel_bounds
+    :type channel_bounds:   iterable of (float, float, float, float)
+    :param rotation_offset: the rotation correction of the field of view, in degrees. Registration works on raw images,
+                            so the channels are mapped back to where they are before rotation.
+    :type rotation_offset:  float
+    :param margin:          extra pixels around the channels, so that they stay inside the windows as the stage drifts
+    :type margin:           int
+    :returns:               list of (row slice, column slice), empty if there are no channels
+
+    """
+    rows, columns = shape[:2]
+    matrix = CorrectiveTransform(rotation_offset, 0.0, 0.0).matrix(shape)
+    # the corners of the channels on each side of the trench, in the raw image
+    corners = {"left": [], "right": []}
+    for left, top, right, bottom in channel_bounds:
+        side = "left" if (left + right) / 2.0 < columns / 2.0 else "right"
+        corners[side].append(matrix.dot([[left, right, left, right], [top, top, bottom, bottom], [1.0, 1.0, 1.0, 1.0]]))
+    windows = []
+    for side in ("left", "right"):
+        if corners[side]:
+            xs, ys, _ = np.hstack(corners[side])
+            windows.append((_fast_slice(ys.min() - margin, ys.max() + margin, rows),
+                            _fast_slice(xs.min() - margin, xs.max() + margin, columns)))
+    return windows
+
+
+def _fast_slice(start, stop, limit):
+    """
+    Turns the range start to stop into a slice within 0 to limit whose length is a product of small primes, growing it
+    about its center if possible and shrinking it if not.
+
+    :returns:   slice
+
+    """
+    start, stop = max(0, int(np.floor(start))), min(limit, int(np.ceil(stop)))
+    length = fftpack.next_fast_len(max(1, stop - start))
+    if length > limit:
+        length = limit
+        while fftpack.next_fast_len(length) != length:
+            length -= 1
+    start = min(max(0, start - (length - (stop - start)) // 2), limit - length)
+    return slice(start, start + length)
+
+
+class NumpyTransform(object):
+    """
+    Does the stacked 2D FFTs of phase correlation with NumPy. Sections are transformed at their own size, so results
+    are identical to phase_correlate.
+
+    """
+    name = "numpy"
+
+    @staticmethod
+    def forward(sections):
+        """
+        :param sections:    the same part of each frame
+        :type sections:     3D np.ndarray (frames, rows, columns)
+        :returns:           3D complex np.ndarray
+
+        """
+        return np.fft.fftn(np.array(sections, dtype=np.complex128), axes=(-2, -1))
+
+    @staticmethod
+    def inverse(frequencies):
+        """
+        :type frequencies:  3D complex np.ndarray (frames, rows, columns)
+        :returns:           3D complex np.ndarray
+
+        """
+        return np.fft.ifftn(frequencies, axes=(-2, -1))
+
+
+class FFTWTransform(object):
+    """
+    Does the stacked 2D FFTs of phase correlation with FFTW, through pyfftw.
+
+    FFTW measures the fastest way to do a transform of a given shape before doing it (planning), and then reuses that
+    plan. Registration only ever transforms a couple of section shapes, so each shape is planned once, and FFTW's
+    record of what it measured (its wisdom) can be saved so that later runs don't have to plan at all. Plans are always
+    for a full batch of sections: the base image, single frames and the last, short batch of a field of view are
+    zero-filled up to the batch size rather than being planned separately for their own frame count. Sections whose
+    sizes aren't products of small primes are padded up to the next size that is, with the mean of the section to avoid
+    creating a sharp edge. Padding means results differ very slightly from the NumPy backend for those sizes; for
+    sections that don't need padding they only differ by floating point rounding.
+
+    Results are only valid until the next transform of sections of the same shape.
+
+    """
+    name = "fftw"
+
+    def __init__(self, threads=Constants.FFT_THREADS, planner_effort="FFTW_MEASURE",
+                 batch_size=Constants.REGISTRATION_BATCH_SIZE):
+        """
+        :param threads:         the number of threads each transform uses
+        :type threads:          int
+        :param batch_size:      the number of sections each plan transforms at once. Larger stacks are transformed a
+                                batch at a time
+        :type batch_size:       int
+        :param planner_effort:  how hard FFTW tries to find the fastest plan. See pyfftw.FFTW
+        :type planner_effort:   str
+        :raises:                ImportError if pyfftw isn't installed
+
+        """
+        if pyfftw is None:
+            raise ImportError("The FFTW backend needs pyfftw, which isn't installed.")
+        self._threads = max(1, int(threads))
+        self._planner_effort = planner_effort
+        self._batch_size = max(1, int(batch_size))
+        self._plans = {}
+
+    @property
+    def threads(self):
+        return self._threads
+
+    @staticmethod
+    def padded_shape(shape):
+        """
+        :param shape:   (frames, rows, columns) of a stack of sections
+        :returns:       the same shape, with rows and columns increased to sizes that FFTW transforms quickly
+
+        """
+        return (shape[0],) + tuple(fftpack.next_fast_len(int(length)) for length in shape[1:])
+
+    def forward(self, sections):
+        """
+        :param sections:    the same part of each frame
+        :type sections:     3D np.ndarray (frames, rows, columns)
+        :returns:           3D complex np.ndarray, possibly larger than the sections
+
+        """
+        if len(sections) > self._batch_size:
+            return self._in_batches(self.forward, sections)
+        forward, _ = self._get_plans(self.padded_shape(sections.shape)[1:])
+        frames, rows, columns = sections.shape
+        forward.input_array[frames:] = 0.0
+        if forward.input_array.shape[1:] != sections.shape[1:]:
+            forward.input_array[:frames] = sections.mean(axis=(1, 2))[:, np.newaxis, np.newaxis]
+        forward.input_array[:frames, :rows, :columns] = sections
+        return forward()[:frames]
+
+    def inverse(self, frequencies):
+        """
+        :type frequencies:  3D complex np.ndarray (frames, rows, columns), as returned by forward()
+        :returns:           3D complex np.ndarray
+
+        """
+        if len(frequencies) > self._batch_size:
+            return self._in_batches(self.inverse, frequencies)
+        _, inverse = self._get_plans(frequencies.shape[1:])
+        frames = len(frequencies)
+        inverse.input_array[:frames] = frequencies
+        inverse.input_array[frames:] = 0.0
+        return inverse()[:frames]
+
+    def _in_batches(self, transform, stack):
+        """
+        Does a transform of a stack larger than the batch size, one batch at a time.
+
+        :type transform:    callable
+        :type stack:        3D np.ndarray (frames, rows, columns)
+        :returns:           3D complex np.ndarray
+
+        """
+        # each result is a view of the plan's output array, so it has to be copied before the next batch
+        return np.concatenate([transform(stack[start:start + self._batch_size]).copy()
+                               for start in xrange(0, len(stack), self._batch_size)])
+
+    @staticmethod
+    def import_wisdom(wisdom):
+        """
+        Gives FFTW what it measured on an earlier run, so it doesn't have to plan those transforms again.
+
+        :param wisdom:  as returned by export_wisdom()
+        :type wisdom:   tuple of str
+
+        """
+        pyfftw.import_wisdom(wisdom)
+
+    @staticmethod
+    def export_wisdom():
+        """
+        :returns:   tuple of str
+
+        """
+        return tuple(pyfftw.export_wisdom())
+
+    def _get_plans(self, shape):
+        """
+        Plans the forward and inverse transforms of a batch of sections of a given shape, or gets them from the cache.
+
+        :param shape:   (rows, columns) of each section
+        :type shape:    tuple of int
+        :returns:       (pyfftw.FFTW(), pyfftw.FFTW())
+
+        """
+        if shape not in self._plans:
+            log.debug("Planning FFTs of %s sections of shape %s" % (self._batch_size, shape))
+            plans = []
+            for direction in ("FFTW_FORWARD", "FFTW_BACKWARD"):
+                input_array = pyfftw.empty_aligned((self._batch_size,) + shape, dtype=np.complex128)
+                output_array = pyfftw.empty_aligned((self._batch_size,) + shape, dtype=np.complex128)
+                plans.append(pyfftw.FFTW(input_array, output_array, axes=(-2, -1), direction=direction,
+                                         flags=(self._planner_effort,), threads=self._threads))
+            self._plans[shape] = tuple(plans)
+        return self._plans[shape]
+
+
+def get_transform(name, threads=Constants.FFT_THREADS):
+    """
+    :param name:    "numpy" or "fftw"
+    :type name:     str
+    :returns:       fylm.model.phase_correlation.NumpyTransform() or fylm.model.phase_correlation.FFTWTransform()
+
+    """
+    if name == FFTWTransform.name:
+        return FFTWTransform(threads)
+    return NumpyTransform()
+
+
+class PhaseCorrelator(object):
+    """
+    Finds the translational offset between a fixed base image and any number of other images, using the subpixel phase
+    correlation of Guizar-Sicairos et al. (the same algorithm as scikit-image's phase_correlate, with identical results
+    when the NumPy backend does the FFTs).
+
+    The offset is found separately for each window (part of the image) and averaged. Every image of a field of view is
+    registered against the same base image, so we compute the FFTs of the base image's windows once and keep them,
+    instead of recomputing them for every frame. Frames are registered in batches: the FFTs of a batch are done as
+    one stacked transform per window. The matrix-multiply DFT kernels used for the subpixel refinement only depend on
+    the whole-pixel estimate of the offset, which rarely changes from one frame to the next, so those are cached too.
+
+    For speed at the cost of some accuracy, the windows can be downsampled (coarse-to-fine registration). Each block of
+    `downsample` x `downsample` pixels is averaged into one, the peak of the cross correlation is found on that coarse
+    grid, and then only the area around the peak is upsampled, by `downsample` times the upsample factor, so that
+    offsets are still found to within 1/upsample_factor of a full-resolution pixel. The FFTs are `downsample` squared
+    times smaller. Use evaluate_correlators() to see how much accuracy that costs on real data.
+
+    """
+    def __init__(self, base_image, windows, upsample_factor=Constants.REGISTRATION_UPSAMPLE_FACTOR, transform=None,
+                 downsample=1):
+        """
+        :param base_image:      the image that every other image is aligned to
+        :type base_image:       2D np.ndarray
+        :param windows:         the parts of the image to correlate
+        :type windows:          list of (row slice, column slice)
+        :param upsample_factor: offsets are found to within 1/upsample_factor of a pixel
+        :type upsample_factor:  int
+        :param transform:       does the FFTs. Defaults to NumPy
+        :type transform:        fylm.model.phase_correlation.NumpyTransform() or
+                                fylm.model.phase_correlation.FFTWTransform()
+        :param downsample:      how many pixels in each direction to average into one before correlating. 1 means
+                                full resolution, which gives the same results as phase_correlate
+        :type downsample:       int
+
+        """
+        self._windows = windows
+        self._upsample_factor = upsample_factor
+        self._downsample = max(1, int(downsample))
+        # How much the cross correlation is upsampled around its peak, in the coordinates of the correlated sections
+        self._refinement_factor = self._upsample_factor * self._downsample
+        self._transform = transform if transform is not None else NumpyTransform()
+        self._base_frequencies = [self._transform.forward(self._get_sections(base_image[np.newaxis], window))[0].copy()
+                                  for window in windows]
+        self._kernels = {}
+
+    @property
+    def windows(self):
+        return self._windows
+
+    @property
+    def upsample_factor(self):
+        return self._upsample_factor
+
+    @property
+    def downsample(self):
+        return self._downsample
+
+    @property
+    def transform(self):
+        return self._transform
+
+    def register(self, image):
+        """
+        Finds the offset of a single image.
+
+        :type image:    2D np.ndarray
+        :returns:       (dx, dy) in pixels
+
+        """
+        return self.register_stack(image[np.newaxis])[0]
+
+    def register_stack(self, stack):
+        """
+        Finds the offsets of a stack of images.
+
+        :type stack:    3D np.ndarray (frames, rows, columns)
+        :returns:       list of (dx, dy) in pixels
+
+        """
+        shifts = np.zeros((len(stack), 2))
+        for window, base_frequencies in zip(self._windows, self._base_frequencies):
+            frequencies = self._transform.forward(self._get_sections(stack, window))
+            image_products = base_frequencies * frequencies.conj()
+            cross_correlations = self._transform.inverse(image_products)
+            for frame, (image_product, cross_correlation) in enumerate(zip(image_products, cross_correlations)):
+                shifts[frame] += self._find_peak(image_product, cross_correlation)
+        if self._downsample > 1:
+            shifts *= self._downsample
+        # phase correlation gives y, x rather than x, y, so we reverse them
+        return [(dx / len(self._windows), dy / len(self._windows)) for dy, dx in shifts]
+
+    def register_images(self, images, batch_size=Constants.REGISTRATION_BATCH_SIZE):
+        """
+        Finds the offset of every image in an iterable, a batch at a time.
+
+        :type images:       iterable of 2D np.ndarray
+        :type batch_size:   int
+        :returns:           generator of (dx, dy) in pixels
+
+        """
+        batch = None
+        count = 0
+        for image in images:
+            if batch is None:
+                batch = np.empty((batch_size,) + image.shape, dtype=image.dtype)
+            batch[count] = image
+            count += 1
+            if count == batch_size:
+                for offset in self.register_stack(batch):
+                    yield offset
+                count = 0
+        if count:
+            for offset in self.register_stack(batch[:count]):
+                yield offset
+
+    def register_keyframes(self, get_image, frame_count, interval, threshold,
+                           batch_size=Constants.REGISTRATION_BATCH_SIZE):
+        """
+        Finds offsets for a sequence of images by only registering every `interval`th image (the keyframes) and
+        interpolating the rest. Stage drift is normally slow and smooth, so that's accurate enough, except where the
+        drift changes quickly: if two neighbouring keyframes are more than `threshold` pixels apart, every image between
+        them is registered instead. The first and last images are always keyframes.
+
+        :param get_image:   takes the index of an image and returns the image
+        :type get_image:    callable
+        :type frame_count:  int
+        :param interval:    the number of images from one keyframe to the next
+        :type interval:     int
+        :param threshold:   the most the offset can change between neighbouring keyframes, in pixels, for the images
+                            between them to be interpolated
+        :type threshold:    float
+        :returns:           list of (dx, dy, whether the offset was interpolated), in order
+
+        """
+        if not frame_count:
+            return []
+        keyframes = sorted(set(range(0, frame_count, max(1, interval))) | {frame_count - 1})
+        offsets = dict(izip(keyframes, self.register_images((get_image(i) for i in keyframes), batch_size)))
+        interpolated = set()
+        exact = []
+        for start, stop in izip(keyframes, keyframes[1:]):
+            (start_dx, start_dy), (stop_dx, stop_dy) = offsets[start], offsets[stop]
+            if math.hypot(stop_dx - start_dx, stop_dy - start_dy) > threshold:
+                exact.extend(range(start + 1, stop))
+                continue
+            for index in range(start + 1, stop):
+                fraction = float(index - start) / (stop - start)
+                offsets[index] = (start_dx + fraction * (stop_dx - start_dx),
+                                  start_dy + fraction * (stop_dy - start_dy))
+                interpolated.add(index)
+        offsets.update(izip(exact, self.register_images((get_image(i) for i in exact), batch_size)))
+        log.debug("Registered %s keyframes and %s other images, and interpolated %s images" %
+                  (len(keyframes), len(exact), len(interpolated)))
+        return [(dx, dy, index in interpolated) for index, (dx, dy) in sorted(offsets.items())]
+
+    def _get_sections(self, stack, window):
+        """
+        Takes the same window out of each image, and downsamples it if we're doing coarse-to-fine registration.
+
+        :type stack:    3D np.ndarray (frames, rows, columns)
+        :returns:       3D np.ndarray
+
+        """
+        sections = stack[(slice(None),) + window]
+        if self._downsample == 1:
+            return sections
+        frames, rows, columns = sections.shape
+        rows, columns = rows // self._downsample, columns // self._downsample
+        sections = sections[:, :rows * self._downsample, :columns * self._downsample]
+        return sections.reshape(frames, rows, self._downsample, columns, self._downsample).mean(axis=(2, 4))
+
+    def _find_peak(self, image_product, cross_correlation):
+        """
+        Locates the peak of the cross correlation of one window to the nearest pixel, then refines it by upsampling the
+        cross correlation around that point.
+
+        :returns:   np.ndarray (dy, dx)
+
+        """
+        shape = image_product.shape
+        maxima = np.unravel_index(np.argmax(np.abs(cross_correlation)), shape)
+        midpoints = np.array([np.fix(axis_size / 2) for axis_size in shape])
+        shifts = np.array(maxima, dtype=np.float64)
+        shifts[shifts > midpoints] -= np.array(shape)[shifts > midpoints]
+        if self._refinement_factor > 1:
+            shifts = self._refine_peak(image_product, shifts)
+        # A shift along an axis that's only one pixel long has no effect
+        shifts[np.array(shape) == 1] = 0
+        return shifts
+
+    def _refine_peak(self, image_product, shifts):
+        """
+        Upsamples the cross correlation in the neighbourhood of its whole-pixel peak to find the peak more precisely.
+
+        :returns:   np.ndarray (dy, dx)
+
+        """
+        shape = image_product.shape
+        shifts = np.round(shifts * self._refinement_factor) / self._refinement_factor
+        upsampled_region_size = np.ceil(self._refinement_factor * 1.5)
+        # The center of the upsampled region
+        dftshift = np.fix(upsampled_region_size / 2.0)
+        upsample_factor = np.array(self._refinement_factor, dtype=np.float64)
+        sample_region_offset = dftshift - shifts * upsample_factor
+        row_kernel, column_kernel = self._get_kernels(shape, upsampled_region_size, sample_region_offset)
+        cross_correlation = row_kernel.dot(image_product.conj()).dot(column_kernel).conj()
+        cross_correlation /= image_product.size * upsample_factor ** 2
+        maxima = np.array(np.unravel_index(np.argmax(np.abs(cross_correlation)), cross_correlation.shape),
+                          dtype=np.float64)
+        maxima -= dftshift
+        return shifts + maxima / upsample_factor
+
+    def _get_kernels(self, shape, upsampled_region_size, sample_region_offset):
+        """
+        Builds the matrices that compute the DFT of a region of the upsampled cross correlation by matrix
+        multiplication, or gets them from the cache.
+
+        """
+        key = shape, upsampled_region_size, tuple(sample_region_offset)
+        if key not in self._kernels:
+            upsample_factor = float(self._refinement_factor)
+            region_size = int(upsampled_region_size)
+            column_kernel = np.exp(
+                (-1j * 2 * np.pi / (shape[1] * upsample_factor)) *
+                (np.fft.ifftshift(np.arange(shape[1]))[:, None] - np.floor(shape[1] / 2)).dot(
+                    np.arange(region_size)[None, :] - sample_region_offset[1]))
+            row_kernel = np.exp(
+                (-1j * 2 * np.pi / (shape[0] * upsample_factor)) *
+                (np.arange(region_size)[:, None] - sample_region_offset[0]).dot(
+                    np.fft.ifftshift(np.arange(shape[0]))[None, :] - np.floor(shape[0] / 2)))
+            self._kernels[key] = row_kernel, column_kernel
+        return self._kernels[key]
+
+
+def evaluate_correlators(stack, reference, candidates):
+    """
+    Registers a stack of images with a reference correlator and with each of the candidates, and measures how far the
+    candidates' offsets are from the reference's and how much faster they are.
+
+    :type stack:        3D np.ndarray (frames, rows, columns)
+    :type reference:    fylm.model.phase_correlation.PhaseCorrelator()
+    :type candidates:   list of fylm.model.phase_correlation.PhaseCorrelator()
+    :returns:           list of (correlator, seconds, speedup, errors), with the reference first. errors is a 1D array
+                        of the distance in pixels between each frame's offset and the reference offset.
+
+    """
+    def timed_registration(correlator):
+        start = time.time()
+        offsets = np.array(list(correlator.register_images(stack)))
+        return time.time() - start, offsets
+
+    reference_seconds, reference_offsets = timed_registration(reference)
+    results = [(reference, reference_seconds, 1.0, np.zeros(len(stack)))]
+    for correlator in candidates:
+        seconds, offsets = timed_registration(correlator)
+        errors = np.hypot(*(offsets - reference_offsets).T)
+        results.append((correlator, seconds, reference_seconds / seconds, errors))
+    return results
+
+
+def format_evaluation(results):
+    """
+    Describes the results of evaluate_correlators() as a table.
+
+    :returns:   generator of str
+
+    """
+    yield "%10s %10s %10s %8s %10s %10s %10s" % ("downsample", "upsample", "frames/s", "speedup", "median err",
+                                                 "95% err", "max err")
+    for correlator, seconds, speedup, errors in results:
+        yield "%10s %10s %10.2f %7.1fx %10.3f %10.3f %10.3f" % (correlator.downsample, correlator.upsample_factor,
+                                                                len(errors) / seconds, speedup, np.median(errors),
+                                                                np.percentile(errors, 95), errors.max())
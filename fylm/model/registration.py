@@ -19,12 +19,18 @@ class Registration(BaseTextFile):
     """
     Models the output file that contains the translational adjustments needed for all images in a stack.
 
+    Offsets that were interpolated between keyframes rather than measured are marked with " interpolated" at the end of
+    their line.
+
     """
+    INTERPOLATED = "interpolated"
+
     def __init__(self):
         super(Registration, self).__init__()
         self.time_period = None
         self.field_of_view = None
         self._offsets = {}
+        self._interpolated = set()
         self._line_regex = re.compile(r"""^(?P<index>\d+) (?P<dx>-?\d+\.\d+) (?P<dy>-?\d+\.\d+)""")
 
     def load(self, data):
@@ -35,6 +41,8 @@ class Registration(BaseTextFile):
                 log.error("Could not parse line: '%s' because of: %s" % (line, e))
             else:
                 self._offsets[index] = dx, dy
+                if line.rstrip().endswith(" " + Registration.INTERPOLATED):
+                    self._interpolated.add(index)
 
     def _parse_line(self, line):
         match = self._line_regex.match(line)
@@ -53,9 +61,27 @@ class Registration(BaseTextFile):
     @property
     def lines(self):
         for index, dx, dy in self._ordered_data:
-            yield "%s %s %s" % (index, dx, dy)
+            if index in self._interpolated:
+                yield "%s %s %s %s" % (index, dx, dy, Registration.INTERPOLATED)
+            else:
+                yield "%s %s %s" % (index, dx, dy)
+
+    @property
+    def interpolated(self):
+        """
+        The indices of the offsets that were interpolated rather than measured.
+
+        :returns:   list of int
+
+        """
+        return sorted(self._interpolated)
 
-    def add(self, dx, dy):
+    def add(self, dx, dy, interpolated=False):
         index = 1 if not self._offsets.keys() else max(self._offsets.keys()) + 1
-        log.debug("%s dx: %s dy: %s" % (index, dx, dy))
+        log.debug("%s dx: %s dy: %s%s" % (index, dx, dy, " (interpolated)" if interpolated else ""))
+        if interpolated:
+            # Measured offsets are multiples of a fraction of a pixel, but interpolated ones can be arbitrarily small,
+            # and tiny floats are written in exponent notation, which we can't parse
+            dx, dy = round(dx, 3), round(dy, 3)
+            self._interpolated.add(index)
         self._offsets[index] = float(dx), float(dy)
\ No newline at end of file
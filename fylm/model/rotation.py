@@ -21,6 +21,13 @@ class RotationSet(BaseSet):
         model = self._get_current(field_of_view)
         return model.data
 
+    def get_model(self, field_of_view):
+        """
+        Returns the model for a given field of view, or None if its rotation offset hasn't been found yet.
+
+        """
+        return self._get_current(field_of_view)
+
     def _get_current(self, field_of_view):
         """
         Returns the model for a given field of view.
@@ -2,10 +2,43 @@ from abc import abstractmethod
 from fylm.service.reader import Reader
 from fylm.service.utilities import FileInteractor
 import logging
+import multiprocessing
 import os
+import signal
 
 log = logging.getLogger(__name__)
 
+# How long to wait for a worker process to finish a model. We never expect to hit this, but waiting with a timeout is
+# what lets Ctrl-C interrupt the wait
+WORKER_TIMEOUT_SECONDS = 7 * 24 * 3600
+
+# The service that does the work in each worker process of BaseSetService.save_text()
+_worker_service = None
+
+
+def _start_worker(service, jobs):
+    """
+    Runs once in each worker process. Ctrl-C is handled by the parent process, which stops the workers itself.
+
+    """
+    global _worker_service
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_service = service
+    _worker_service.start_worker(jobs)
+
+
+def _save_model(model):
+    """
+    Calculates and writes a single model in a worker process.
+
+    :returns:   whether any work was done
+
+    """
+    if _worker_service.save_action(model) is False:
+        return False
+    FileInteractor(model).write_text()
+    return True
+
 
 class BaseService(object):
     """
@@ -30,30 +63,71 @@ class BaseSetService(BaseService):
     def save_action(self, model):
         """
         Calculates values and sets them on the model, so that when it is passed to the file writer,
-        the correct data gets written to disk.
+        the correct data gets written to disk. If the values can't be calculated yet, this returns False
+        and nothing is written.
 
         :type model:    fylm.model.base.BaseFile()
 
         """
         raise NotImplemented
 
-    def save_text(self, model_set):
+    def save_text(self, model_set, jobs=1):
         """
         Takes a model set, calculates any values that need to be calculated, and writes them to disk.
 
         :type model_set:    fylm.mode.base.BaseSet()
+        :param jobs:        the number of models to calculate at once, each in its own process. Only services whose
+                            models are independent of each other can use more than one.
+        :type jobs:         int
 
         """
         did_work = False
         remaining = list(model_set.remaining)
-        for model in remaining:
-            did_work = True
-            writer = FileInteractor(model)
-            self.save_action(model)
-            writer.write_text()
+        if jobs > 1 and len(remaining) > 1:
+            did_work = self._save_text_in_parallel(remaining, jobs)
+        else:
+            for model in remaining:
+                writer = FileInteractor(model)
+                if self.save_action(model) is False:
+                    continue
+                did_work = True
+                writer.write_text()
         if not did_work:
             log.info("All %s have been calculated." % self._name)
 
+    def _save_text_in_parallel(self, models, jobs):
+        """
+        Calculates and writes models in a pool of worker processes. Each worker writes its own files, atomically, so if
+        we're interrupted the only files that exist are complete ones.
+
+        :returns:   whether any work was done
+
+        """
+        jobs = min(jobs, len(models))
+        log.info("Calculating %s %s with %s processes" % (len(models), self._name, jobs))
+        pool = multiprocessing.Pool(jobs, _start_worker, (self, jobs))
+        did_work = False
+        try:
+            results = pool.imap_unordered(_save_model, models)
+            for _ in models:
+                did_work = results.next(WORKER_TIMEOUT_SECONDS) or did_work
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return did_work
+
+    def start_worker(self, jobs):
+        """
+        Prepares a copy of the service to work in a worker process, alongside `jobs` others.
+
+        :type jobs:     int
+
+        """
+        pass
+
     def load_existing_models(self, model_set):
         """
         Loads every existing model from disk and puts it into the model set.
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+from fylm.model.constants import Constants
+import logging
+import numpy as np
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class FrameCache(object):
+    """
+    A process-wide, least-recently-used cache of corrected images.
+
+    Several steps (and the interactive tools) look at the same frames over and over again. Decoding and correcting
+    a frame is expensive, so we keep recently corrected frames around until we run out of our memory budget, at which
+    point the frames that haven't been used for the longest time are thrown away.
+
+    Frames are keyed by where they come from and how they were corrected (see key()), so that a frame corrected with
+    offsets that have since been recalculated is never handed out. Cached frames are made read-only since they are
+    shared by everyone who asks for them.
+
+    """
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes:   the most memory that cached frames may use. Zero disables the cache.
+        :type max_bytes:    int
+
+        """
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_bytes = int(max_bytes)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        with self._lock:
+            self._max_bytes = int(value)
+            self._evict()
+
+    @property
+    def size(self):
+        """
+        The number of bytes currently used by cached frames.
+
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._frames)
+
+    @staticmethod
+    def key(time_period, field_of_view, time_index, channel, z_level, rotation_offset, dx, dy, dtype):
+        """
+        Builds the key of a corrected frame.
+
+        :param rotation_offset:     the rotation correction, in degrees
+        :param dx:                  the horizontal registration offset, in pixels
+        :param dy:                  the vertical registration offset, in pixels
+        :param dtype:               the type of the corrected image's pixels
+        :returns:                   tuple
+
+        """
+        return (time_period, field_of_view, time_index, channel, z_level, float(rotation_offset), float(dx), float(dy),
+                np.dtype(dtype).name)
+
+    def get(self, key):
+        """
+        Looks up a corrected image, marking it as recently used.
+
+        :param key:     see key()
+        :type key:      tuple
+        :returns:       np.ndarray() or None if the image isn't cached
+
+        """
+        with self._lock:
+            image_data = self._frames.pop(key, None)
+            if image_data is None:
+                self.misses += 1
+                return None
+            self._frames[key] = image_data
+            self.hits += 1
+            return image_data
+
+    def put(self, key, image_data):
+        """
+        Adds a corrected image to the cache, evicting the least recently used images if we're over our budget.
+
+        :param key:         see key()
+        :type key:          tuple
+        :param image_data:  a 2D numpy array
+        :returns:           the image data, which is read-only if it was cached
+
+        """
+        if image_data.nbytes > self._max_bytes:
+            # This would evict everything else, or the cache is disabled
+            return image_data
+        image_data.flags.writeable = False
+        with self._lock:
+            old_image_data = self._frames.pop(key, None)
+            if old_image_data is not None:
+                self._size -= old_image_data.nbytes
+            self._frames[key] = image_data
+            self._size += image_data.nbytes
+            self._evict()
+        return image_data
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._size = 0
+
+    def log_statistics(self):
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total else 0.0
+        log.debug("Frame cache: %s hits, %s misses (%.1f%% hit rate), %s evictions, %s frames using %.1f MB" %
+                  (self.hits, self.misses, hit_rate, self.evictions, len(self._frames), self._size / 1048576.0))
+
+    def _evict(self):
+        """
+        Throws away the least recently used images until we're within our memory budget. Must hold the lock.
+
+        """
+        while self._frames and self._size > self._max_bytes:
+            _, image_data = self._frames.popitem(last=False)
+            self._size -= image_data.nbytes
+            self.evictions += 1
+
+
+# There's one cache for the whole process so that every step can benefit from work done by the others
+frame_cache = FrameCache(Constants.FRAME_CACHE_MEGABYTES * 1048576)
@@ -0,0 +1,97 @@
+from fylm.service.base import BaseSetService
+from fylm.service.corrected_store import CorrectedStore
+from fylm.service.image_reader import ImageReader
+from fylm.service.reader import Reader
+from fylm.service.utilities import timer
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class CorrectedStackSet(BaseSetService):
+    """
+    Saves the rotation- and registration-corrected images of each time period and field of view to disk.
+
+    Once rotation and registration are final, the corrected images never change, so there's no reason for the
+    kymograph, fluorescence and movie steps to correct them again on every run. The images are stored as
+    memory-mapped arrays, which ImageReader reads from automatically when they exist.
+
+    """
+    def __init__(self, experiment):
+        super(CorrectedStackSet, self).__init__()
+        self._experiment = experiment
+        self._store = CorrectedStore(experiment)
+        self._name = "corrected images"
+        # 32-bit floats are plenty for images that came from a 16-bit camera and they halve the space on disk
+        self._dtype = np.float32
+
+    def find_current(self, model_set):
+        """
+        Finds stored images, but ignores any that were made with registration or rotation data that has since changed.
+
+        :type model_set:    fylm.model.corrected.CorrectedStackSet()
+
+        """
+        super(CorrectedStackSet, self).find_current(model_set)
+        reader = Reader()
+        for model in list(model_set.existing):
+            if not reader.read(model, expect_missing_file=True) or \
+                    model.fingerprint != self._store.fingerprint(model.time_period, model.field_of_view):
+                log.info("Corrected images for %s are out of date and will be recreated." % model.filename)
+                model_set.invalidate(model)
+
+    @timer
+    def save_action(self, stack_model):
+        """
+        Corrects every image of a single time period and field of view and writes them to disk.
+
+        :type stack_model:  fylm.model.corrected.CorrectedStack()
+        :returns:           False if the images can't be corrected yet
+
+        """
+        fingerprint = self._store.fingerprint(stack_model.time_period, stack_model.field_of_view)
+        if fingerprint is None:
+            log.warn("Can't store corrected images for %s until rotation and registration are done." % stack_model.filename)
+            return False
+        log.info("Storing corrected images for time period %s, field of view %s" % (stack_model.time_period,
+                                                                                   stack_model.field_of_view))
+        with ImageReader(self._experiment, use_corrected_store=False) as image_reader:
+            image_reader.field_of_view = stack_model.field_of_view
+            image_reader.time_period = stack_model.time_period
+            try:
+                frame_count = len(image_reader)
+                channel_names = image_reader.channel_names
+                z_level_count = image_reader.nd2.z_level_count
+            except IOError:
+                log.warn("Can't store corrected images for %s as the ND2 is not available." % stack_model.filename)
+                return False
+
+            stacks = {}
+            stored_time_indices = {}
+            for image_set in image_reader:
+                for channel in channel_names:
+                    for z_level in xrange(z_level_count):
+                        image = image_set.get_image(channel, z_level)
+                        if image is None:
+                            # fluorescence images aren't taken in every frame
+                            continue
+                        if (channel, z_level) not in stacks:
+                            stacks[(channel, z_level)] = np.lib.format.open_memmap(stack_model.get_stack_path(channel, z_level),
+                                                                                 mode="w+", dtype=self._dtype,
+                                                                                 shape=(frame_count,) + image.shape)
+                            stored_time_indices[(channel, z_level)] = set()
+                            stack_model.shape = image.shape
+                        stacks[(channel, z_level)][image_set.time_index] = image
+                        stored_time_indices[(channel, z_level)].add(image_set.time_index)
+
+        if not stacks:
+            log.warn("No images were found for %s" % stack_model.filename)
+            return False
+        for (channel, z_level), stack in stacks.items():
+            stack.flush()
+            missing = set(range(frame_count)) - stored_time_indices[(channel, z_level)]
+            stack_model.add_stack(channel, z_level, missing)
+        stack_model.fingerprint = fingerprint
+        stack_model.frame_count = frame_count
+        stack_model.dtype = np.dtype(self._dtype).name
@@ -0,0 +1,80 @@
+from fylm.model.corrected import CorrectedStack
+from fylm.model.registration import Registration
+from fylm.model.rotation import Rotation
+from fylm.service.reader import Reader
+import hashlib
+import logging
+import numpy as np
+import os
+
+log = logging.getLogger(__name__)
+
+
+class CorrectedStore(object):
+    """
+    Gives access to the corrected images that were saved to disk by fylm.service.corrected.CorrectedStackSet.
+
+    The images are memory-mapped, so reading them doesn't copy anything until the data is actually used.
+
+    """
+    def __init__(self, experiment):
+        self._experiment = experiment
+        self._base_path = experiment.data_dir + "/corrected"
+        self._os = os
+
+    def fingerprint(self, time_period, field_of_view):
+        """
+        Summarizes the registration and rotation files that the corrected images depend on. If either file changes,
+        so does the fingerprint.
+
+        :returns:   str, or None if either file doesn't exist yet
+
+        """
+        registration = Registration()
+        registration.base_path = self._experiment.data_dir + "/registration"
+        registration.time_period = time_period
+        registration.field_of_view = field_of_view
+        rotation = Rotation()
+        rotation.base_path = self._experiment.data_dir + "/rotation"
+        rotation.field_of_view = field_of_view
+        digest = hashlib.md5()
+        for model in (registration, rotation):
+            try:
+                with open(model.path) as f:
+                    digest.update(f.read(-1))
+            except IOError:
+                return None
+        return digest.hexdigest()
+
+    def get_model(self, time_period, field_of_view):
+        """
+        Loads the manifest for a time period and field of view, if the corrected images exist and are up to date.
+
+        :returns:   fylm.model.corrected.CorrectedStack() or None
+
+        """
+        model = CorrectedStack()
+        model.base_path = self._base_path
+        model.time_period = time_period
+        model.field_of_view = field_of_view
+        if not self._os.path.isfile(model.path):
+            return None
+        if not Reader().read(model, expect_missing_file=True):
+            return None
+        if model.fingerprint != self.fingerprint(time_period, field_of_view):
+            log.info("Stored corrected images for time period %s, field of view %s are out of date." % (time_period,
+                                                                                                     field_of_view))
+            return None
+        return model
+
+    @staticmethod
+    def open_stacks(model):
+        """
+        Memory-maps every stored channel and z-level.
+
+        :type model:    fylm.model.corrected.CorrectedStack()
+        :returns:       dict of (channel, z_level) -> np.memmap() with shape (time index, height, width)
+
+        """
+        return {(channel, z_level): np.load(model.get_stack_path(channel, z_level), mmap_mode="r")
+                for channel, z_level in model.stacks}
@@ -1,5 +1,8 @@
+from fylm.model.constants import Constants
 from fylm.model.experiment import Experiment as ExperimentModel
 from fylm.service.errors import terminal_error
+from fylm.service.nd2_index import Nd2IndexService
+from fylm.service.nd2_pool import nd2_pool
 import logging
 import json
 import os
@@ -14,10 +17,16 @@ class Experiment(object):
     def __init__(self):
         self._os = os
 
-    def get_experiment(self, experiment_start_date, base_dir, version, review):
+    def get_experiment(self, experiment_start_date, base_dir, version, review, nd2_backend=Constants.ND2_BACKEND):
+        """
+        :param nd2_backend:     how to read ND2s. See Nd2IndexService.open()
+        :type nd2_backend:      str
+
+        """
         experiment = ExperimentModel()
         experiment.version = version
         experiment.review_annotations = review
+        experiment.nd2_backend = nd2_backend
 
         # set start date
         experiment.start_date = experiment_start_date
@@ -32,6 +41,10 @@ class Experiment(object):
         log.debug("Experiment base directory: %s" % experiment.base_dir)
 
         self._build_directories(experiment)
+        if nd2_backend != "nd2reader":
+            # Open ND2s with the experiment's backend from now on, so each file only has to be parsed once, when it's
+            # indexed. Otherwise the pool keeps opening them with nd2reader.
+            nd2_pool.opener = Nd2IndexService(experiment).open
         self._find_time_periods(experiment)
         self._get_nd2_attributes(experiment)
         return experiment
@@ -67,7 +80,9 @@ class Experiment(object):
         """
         # first make all the top-level directories
         subdirs = ["annotation",
+                   "corrected",
                    "fluorescence",
+                   "index",
                    "kymograph",
                    "location",
                    "puncta",
@@ -115,28 +130,25 @@ class Experiment(object):
         found_an_nd2 = False
         for n, nd2_filename in enumerate(experiment.nd2s):
             try:
-                nd2 = nd2reader.Nd2(nd2_filename)
+                timestamp, field_of_view_count, has_fluorescent_channels = self._read_nd2_attributes(experiment,
+                                                                                                     nd2_filename)
             except IOError:
                 pass
             else:
                 # We need to know the absolute time that an experiment began so we can figure out the gap between
                 # different files (as that could be any amount of time).
-                timestamp = self._utc_timestamp(nd2.absolute_start)
                 time_period = n + 1
                 experiment.set_time_period_start_time(time_period, timestamp)
                 experiment_log['start_unix_timestamps'][str(time_period)] = timestamp
 
-                experiment.field_of_view_count = nd2.field_of_view_count
-                experiment_log['field_of_view_count'] = nd2.field_of_view_count
-                experiment_log['has_fluorescent_channels'] = False
-                for channel in nd2.channels:
-                    if channel.name != "":
-                        log.info("Experiment has fluorescent channels.")
-                        experiment.has_fluorescent_channels = True
-                        experiment_log['has_fluorescent_channels'] = True
-                        break
+                experiment.field_of_view_count = field_of_view_count
+                experiment_log['field_of_view_count'] = field_of_view_count
+                if has_fluorescent_channels:
+                    log.info("Experiment has fluorescent channels.")
+                    experiment.has_fluorescent_channels = True
                 else:
                     log.info("Experiment does not have fluorescent channels.")
+                experiment_log['has_fluorescent_channels'] = has_fluorescent_channels
                 self._save_experiment_log(experiment, experiment_log)
                 found_an_nd2 = True
 
@@ -149,5 +161,28 @@ class Experiment(object):
             for time_period, timestamp in experiment_log['start_unix_timestamps'].items():
                 experiment.set_time_period_start_time(time_period, timestamp)
 
+    def _read_nd2_attributes(self, experiment, nd2_filename):
+        """
+        Reads when an ND2 began, how many fields of view it has and whether it has fluorescent channels. The mmap and
+        indexed backends take these from the ND2's index, creating it if need be, so the ND2 itself only gets parsed
+        the very first time. Otherwise, or if the ND2 can't be indexed, they come from nd2reader.
+
+        :type experiment:       model.experiment.Experiment()
+        :type nd2_filename:     str
+        :returns:               (unix timestamp, int, bool)
+        :raises:                IOError if the ND2 doesn't exist
+
+        """
+        if experiment.nd2_backend != "nd2reader":
+            try:
+                index = Nd2IndexService(experiment).get_index(nd2_filename)
+            except ValueError as e:
+                log.warn("Could not index %s, reading it with nd2reader instead: %s" % (nd2_filename, e))
+            else:
+                return index.start_unix_timestamp, index.field_of_view_count, index.has_fluorescent_channels
+        nd2 = nd2reader.Nd2(nd2_filename)
+        has_fluorescent_channels = any(channel.name != "" for channel in nd2.channels)
+        return self._utc_timestamp(nd2.absolute_start), nd2.field_of_view_count, has_fluorescent_channels
+
     def _utc_timestamp(self, date):
-        return time.mktime(tuple(date.utctimetuple())) - time.mktime((1970, 1, 1, 0, 0, 0, 0, 0, 0))
\ No newline at end of file
+        return time.mktime(tuple(date.utctimetuple())) - time.mktime((1970, 1, 1, 0, 0, 0, 0, 0, 0))
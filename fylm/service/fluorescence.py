@@ -54,32 +54,31 @@ class FluorescenceSet(BaseSetService):
         except IndexError:
             pass
         else:
-            # image_set gives us access to every image for every filter channel for a single time index
-            for image_set in image_reader:
-                # channel_names are alphabetized
-                for channel_name in image_reader.channel_names:
-                    if channel_name == "":
-                        # we skip the brightfield image since it never shows fluorescence
-                        continue
-                    # we grab the fluorescent image with the in-focus image. There are no out-of-focus fluorescent images
-                    # in our experiments, but we still need to designate this
-                    image = image_set.get_image(channel_name, z_level=1)
-                    if image is None:
-                        # We don't have fluorescent data for this time index. This happens because we don't take fluorescent
-                        # images at the same frequency as bright field, to lower the amount of blue light that the cells
-                        # are exposed to.
-                        continue
-                    # extract the pixels just covering our catch channel
-                    image_slice.set_image(image)
-                    # quantify the fluorescence data
-                    try:
-                        mean, stddev, median, area, centroid = self._measure_fluorescence(fl_model.time_period, image_set.time_index, image_slice, channel_annotation)
-                    # store the data in the model so it can be saved to disk later
-                    except (IndexError, ValueError, TypeError, ZeroDivisionError):
-                        # We won't be able to get data unless the cell poles are defined, so here we silently ignore that.
-                        pass
-                    else:
-                        fl_model.add(image_set.time_index, channel_name, mean, stddev, median, area, centroid)
+            with image_reader:
+                # image_set gives us access to every image for every filter channel for a single time index
+                for image_set in image_reader:
+                    # channel_names are alphabetized
+                    for channel_name in image_reader.channel_names:
+                        if channel_name == "":
+                            # we skip the brightfield image since it never shows fluorescence
+                            continue
+                        # we grab the fluorescent image with the in-focus image. There are no out-of-focus fluorescent images
+                        # in our experiments, but we still need to designate this
+                        # this extracts (and corrects) only the pixels covering our catch channel
+                        if not image_set.get_image_slices([image_slice], channel_name, z_level=1):
+                            # We don't have fluorescent data for this time index. This happens because we don't take fluorescent
+                            # images at the same frequency as bright field, to lower the amount of blue light that the cells
+                            # are exposed to.
+                            continue
+                        # quantify the fluorescence data
+                        try:
+                            mean, stddev, median, area, centroid = self._measure_fluorescence(fl_model.time_period, image_set.time_index, image_slice, channel_annotation)
+                        # store the data in the model so it can be saved to disk later
+                        except (IndexError, ValueError, TypeError, ZeroDivisionError):
+                            # We won't be able to get data unless the cell poles are defined, so here we silently ignore that.
+                            pass
+                        else:
+                            fl_model.add(image_set.time_index, channel_name, mean, stddev, median, area, centroid)
 
     def _measure_fluorescence(self, time_period, time_index, image_slice, channel_annotation):
         mask = np.zeros((image_slice.height * 2, image_slice.width))
@@ -1,10 +1,14 @@
 from fylm.model.registration import RegistrationSet
 from fylm.model.rotation import RotationSet
 from fylm.model.timestamp import TimestampSet
-from fylm.model.image import ImageSet as FylmImageSet, Image
+from fylm.model.image import ImageSet as FylmImageSet, Image, CorrectedImage, StoredImageSet
+from fylm.model.correction import RotationMap, CorrectionTable
+from fylm.service.cache import frame_cache
+from fylm.service.corrected_store import CorrectedStore
+from fylm.service.nd2_pool import nd2_pool
+from fylm.service.prefetch import Prefetcher
 from itertools import izip
 import logging
-from nd2reader import Nd2
 from fylm.service.base import BaseSetService
 
 log = logging.getLogger(__name__)
@@ -18,9 +22,27 @@ class ImageReader(object):
 
     The registration and rotation can be optionally deactivated in case they misbehave, and the start point can also be set.
 
+    If the corrected images for a time period and field of view have been saved to disk (and are still up to date), they
+    are read from there instead of the ND2. Otherwise, the next few image sets are decoded on a background thread while
+    the current one is being corrected and used.
+
+    How the ND2 is read depends on the experiment's ND2 backend (see Nd2IndexService.open()). With the "mmap"
+    backend, raw frames are views into the memory-mapped file, so a full pass over a field of view doesn't allocate any
+    raw image arrays at all.
+
+    The ND2 is borrowed from the shared pool until close() is called, so use the reader in a with statement (or close it)
+    once you're done with it.
+
     """
-    def __init__(self, experiment, register_images=True, rotate_images=True):
+    def __init__(self, experiment, register_images=True, rotate_images=True, use_corrected_store=True, prefetch_depth=None):
+        """
+        :param prefetch_depth:  how many image sets to decode ahead of time (zero disables prefetching). Defaults to the
+                                experiment's setting.
+        :type prefetch_depth:   int
+
+        """
         self._experiment = experiment
+        self._prefetch_depth = experiment.prefetch_depth if prefetch_depth is None else prefetch_depth
         self._field_of_view = None
         self._register_images = register_images
         self._rotate_images = rotate_images
@@ -29,14 +51,36 @@ class ImageReader(object):
         self._timestamp_set = TimestampSet(experiment)
         self._time_period = None
         self._nd2 = None
+        self._nd2_filename = None
+        # The rotation offset is constant for a field of view, so we keep the rotation map of the current one
+        self._rotation_map = None
+        self._rotation_map_field_of_view = None
+        # Registration offsets and timestamps for each (time period, field of view), for fast random access
+        self._correction_tables = {}
+        self._corrected_store = CorrectedStore(experiment) if use_corrected_store else None
+        self._stored_stacks = {}
 
         set_service = BaseSetService()
         for model_set in (self._registration_set, self._rotation_set, self._timestamp_set):
             set_service.load_existing_models(model_set)
 
     def __len__(self):
+        stack_model, _ = self._get_stored_stacks()
+        if stack_model is not None:
+            return stack_model.frame_count
         return self.nd2.time_index_count
 
+    @property
+    def shape(self):
+        """
+        The numpy-style (rows, columns) shape of the images of the current time period and field of view.
+
+        """
+        stack_model, _ = self._get_stored_stacks()
+        if stack_model is not None:
+            return tuple(stack_model.shape)
+        return self.nd2.height, self.nd2.width
+
     @property
     def time_period(self):
         return self._time_period
@@ -44,21 +88,108 @@ class ImageReader(object):
     @time_period.setter
     def time_period(self, value):
         self._time_period = int(value)
-        self._nd2 = None
+        self.close()
 
     @property
     def nd2(self):
         if self._nd2 is None:
             filename = self._experiment.get_nd2_from_time_period(self._time_period)
-            self._nd2 = Nd2(filename)
+            self._nd2 = nd2_pool.acquire(filename)
+            self._nd2_filename = filename
         return self._nd2
 
+    def close(self):
+        """
+        Gives the ND2 back to the pool. It will be acquired again if it's needed.
+
+        """
+        if self._nd2 is not None:
+            nd2_pool.release(self._nd2_filename)
+            self._nd2 = None
+            self._nd2_filename = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def get_image(self, index, channel="", z_level=1):
-        rotation_offset = self._rotation_set.existing[index].offset
-        dx, dy = next(self._registration_set.get_data(self.field_of_view, self.time_period))
-        timestamp = next(self._timestamp_set.get_data(self.field_of_view, self.time_period))
-        raw_image = self.nd2.get_image(index, self.field_of_view, channel, z_level)
-        return Image(raw_image.data, rotation_offset, dx, dy, timestamp)
+        """
+        Gets a single corrected image from anywhere in the current time period and field of view.
+
+        :param index:   0-based time index of the image
+        :type index:    int
+        :returns:       fylm.model.image.CorrectedImage()
+
+        """
+        rotation_offset = self._rotation_set.get_data(self.field_of_view)
+        correction_table = self._get_correction_table()
+        dx, dy = correction_table.get_offset(index)
+        timestamp = correction_table.get_timestamp(index)
+        stack_model, stacks = self._get_stored_stacks()
+        if stack_model is not None:
+            return CorrectedImage(StoredImageSet(stacks, stack_model, index, timestamp).get_image(channel, z_level),
+                                  timestamp)
+        rotation_map = self._get_rotation_map(rotation_offset)
+        cache_key = frame_cache.key(self.time_period, self.field_of_view, index, channel, z_level, rotation_offset, dx, dy,
+                                    rotation_map.dtype)
+        image_data = frame_cache.get(cache_key)
+        if image_data is None:
+            # we've never seen this image, or it was evicted from the cache
+            raw_image = self.nd2.get_image(index, self.field_of_view, channel, z_level)
+            rotation_map.count_frame(raw_image.data.shape, dx, dy)
+            image = Image(raw_image.data, rotation_offset, dx, dy, timestamp, rotation_map)
+            image_data = frame_cache.put(cache_key, image.data)
+        return CorrectedImage(image_data, timestamp)
+
+    def _get_correction_table(self):
+        """
+        Loads the registration offsets and timestamps of the current time period and field of view into arrays the
+        first time they're needed.
+
+        :returns:   fylm.model.correction.CorrectionTable()
+
+        """
+        key = self.time_period, self.field_of_view
+        if key not in self._correction_tables:
+            offsets = self._registration_set.get_data(self.field_of_view, self.time_period)
+            timestamps = (timestamp for _, timestamp in self._timestamp_set.get_data(self.field_of_view, self.time_period))
+            self._correction_tables[key] = CorrectionTable(offsets, timestamps)
+        return self._correction_tables[key]
+
+    def _get_rotation_map(self, rotation_offset):
+        """
+        Returns the rotation map for the current field of view. Only the most recent field of view's map is kept.
+
+        :type rotation_offset:  float
+        :returns:   fylm.model.correction.RotationMap()
+
+        """
+        rotation_map = self._rotation_map
+        if (rotation_map is None or self._rotation_map_field_of_view != self.field_of_view or
+                rotation_map.rotation_offset != rotation_offset):
+            rotation_map = RotationMap(rotation_offset, self._experiment.working_dtype,
+                                       self._experiment.whole_pixel_tolerance)
+            self._rotation_map = rotation_map
+            self._rotation_map_field_of_view = self.field_of_view
+        return rotation_map
+
+    def _get_stored_stacks(self):
+        """
+        Finds the corrected images that were saved to disk for the current time period and field of view.
+
+        :returns:   (fylm.model.corrected.CorrectedStack(), dict of memory-mapped arrays), or (None, None)
+
+        """
+        if self._corrected_store is None:
+            return None, None
+        key = self.time_period, self.field_of_view
+        if key not in self._stored_stacks:
+            stack_model = self._corrected_store.get_model(self.time_period, self.field_of_view)
+            stacks = self._corrected_store.open_stacks(stack_model) if stack_model is not None else None
+            self._stored_stacks[key] = stack_model, stacks
+        return self._stored_stacks[key]
 
     @property
     def channel_names(self):
@@ -77,10 +208,36 @@ class ImageReader(object):
         Provides image sets for a single time_period.
 
         """
+        stack_model, stacks = self._get_stored_stacks()
+        if stack_model is not None:
+            log.debug("Reading stored corrected images for time period %s, field of view %s" % (self.time_period,
+                                                                                              self.field_of_view))
+            for time_index, timestamp in self._timestamp_set.get_data(self.field_of_view, self.time_period):
+                yield StoredImageSet(stacks, stack_model, time_index - 1, timestamp)
+            return
         rotation_offset = self._rotation_set.get_data(self.field_of_view)
+        rotation_map = self._get_rotation_map(rotation_offset)
         registration_data = self._registration_set.get_data(self.field_of_view, self.time_period)
         timestamp_data = self._timestamp_set.get_data(self.field_of_view, self.time_period)
-        for nd2_image_set, registration_offset, (time_index, timestamp) in izip(self.nd2.image_sets(self.field_of_view),
+        nd2_image_sets = Prefetcher(self.nd2.image_sets(self.field_of_view), self._prefetch_depth, self._decode)
+        for nd2_image_set, registration_offset, (time_index, timestamp) in izip(nd2_image_sets,
                                                                                 registration_data,
                                                                                 timestamp_data):
-            yield FylmImageSet(nd2_image_set, rotation_offset, registration_offset, time_index - 1, timestamp)
\ No newline at end of file
+            yield FylmImageSet(nd2_image_set, rotation_offset, registration_offset, time_index - 1, timestamp,
+                               rotation_map, frame_cache, (self.time_period, self.field_of_view))
+        frame_cache.log_statistics()
+        rotation_map.log_statistics()
+
+    @staticmethod
+    def _decode(nd2_image_set):
+        """
+        Reads all of the image data in an image set. This runs on the prefetching thread.
+
+        :returns:   list of nd2reader.model.Image()
+
+        """
+        images = [image for image in nd2_image_set]
+        for image in images:
+            # make sure the pixels are actually in memory before handing the images over
+            image.data
+        return images
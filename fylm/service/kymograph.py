@@ -1,3 +1,4 @@
+from fylm.model.kymograph import KymographExtractor
 from fylm.model.location import LocationSet
 from fylm.service.base import BaseSetService
 from fylm.service.experiment import Experiment as ExperimentService
@@ -51,37 +52,33 @@ class KymographSet(BaseSetService):
         did_work = False
         log.info("Making kymographs for field of view %s:" % location_model.field_of_view)
         for time_period in self._experiment.time_periods:
-            image_reader = ImageReader(self._experiment)
-            image_reader.field_of_view = location_model.field_of_view
-            image_reader.time_period = time_period
-            # Now that we know the width and height of the kymographs, we can allocate memory for the images
-            try:
-                did_work = self.allocate_kymographs(available_kymographs, image_reader)
-            except IOError:
-                # kymographs for this time period have already been created and this image has been put in storage
-                log.warn("Not making kymographs for time period %s as the ND2 is not available anymore." % time_period)
-                continue
-
-            # only iterate over this time_period's images if there is at least one channel it
-            for kymograph_model in available_kymographs:
-                if kymograph_model.time_period == time_period:
-                    # at least one catch channel has data
-                    break
-            else:
-                # skip this time_period
-                continue
-
-            if not self._experiment.review_annotations:
-                for time_index, image_set in enumerate(image_reader):
-                    log.debug("Adding lines for kymographs from time index %s" % time_index)
-                    image = image_set.get_image(channel="", z_level=0)
-
-                    for kymograph_model in available_kymographs:
-                        if kymograph_model.time_period == time_period:
-                            kymograph_model.set_image(image)
-                            kymograph_model.add_line(time_index)
-                for kymograph_model in available_kymographs:
-                    if kymograph_model.time_period == time_period:
+            with ImageReader(self._experiment) as image_reader:
+                image_reader.field_of_view = location_model.field_of_view
+                image_reader.time_period = time_period
+                time_period_kymographs = [kymograph_model for kymograph_model in available_kymographs
+                                          if kymograph_model.time_period == time_period]
+                try:
+                    frame_count = len(image_reader)
+                    shape = image_reader.shape
+                except IOError:
+                    # kymographs for this time period have already been created and this image has been put in storage
+                    log.warn("Not making kymographs for time period %s as the ND2 is not available anymore." % time_period)
+                    continue
+                did_work = did_work or bool(available_kymographs)
+
+                # only iterate over this time_period's images if there is at least one channel it
+                if not time_period_kymographs:
+                    continue
+
+                if not self._experiment.review_annotations:
+                    # Now that we know the width and height of the kymographs, we can allocate memory for the images
+                    extractor = KymographExtractor(time_period_kymographs, shape)
+                    self.allocate_kymographs(extractor, frame_count, self._experiment.working_dtype)
+                    if self._experiment.kymograph_sampling == "raw":
+                        self.sample_lines(extractor, image_reader)
+                    else:
+                        self.correct_lines(extractor, image_reader, shape)
+                    for kymograph_model in time_period_kymographs:
                         log.debug("Saving kymograph %s" % kymograph_model.channel_number)
                         # we stretch the image contrast to give it a better spread over the available space
                         # this prevents some information loss and makes the image more distinct
@@ -91,11 +88,44 @@ class KymographSet(BaseSetService):
                         skimage.io.imsave(kymograph_model.path, rescaled_image)
                         kymograph_model.free_memory()
 
-            if did_work:
-                # log the completion of this time period's extraction
-                ExperimentService().add_time_period_to_log(self._experiment, time_period)
+                if did_work:
+                    # log the completion of this time period's extraction
+                    ExperimentService().add_time_period_to_log(self._experiment, time_period)
         return did_work
 
+    @staticmethod
+    def sample_lines(extractor, image_reader):
+        """
+        Adds lines to the kymographs by interpolating just the pixels they need straight from the raw images, so no part
+        of any image gets corrected.
+
+        :type extractor:        fylm.model.kymograph.KymographExtractor()
+        :type image_reader:     fylm.service.image_reader.ImageReader()
+
+        """
+        for time_index, image_set in enumerate(image_reader):
+            log.debug("Adding lines for kymographs from time index %s" % time_index)
+            samples = image_set.get_samples(extractor.rows, extractor.columns, channel="", z_level=0)
+            if samples is not None:
+                extractor.add_samples(time_index, samples)
+
+    def correct_lines(self, extractor, image_reader, shape):
+        """
+        Adds lines to the kymographs by correcting the rows of each image that they come from.
+
+        :type extractor:        fylm.model.kymograph.KymographExtractor()
+        :type image_reader:     fylm.service.image_reader.ImageReader()
+        :param shape:           numpy-style (rows, columns) shape of the images
+
+        """
+        # only the rows we take lines from get corrected, not the entire image
+        corrected_image = np.zeros(shape, dtype=self._experiment.working_dtype)
+        for time_index, image_set in enumerate(image_reader):
+            log.debug("Adding lines for kymographs from time index %s" % time_index)
+            image_data = image_set.get_image_regions(extractor.regions, corrected_image, channel="", z_level=0)
+            if image_data is not None:
+                extractor.add_lines(time_index, image_data)
+
     @staticmethod
     def set_kymograph_locations(location_model, kymograph_model_set):
         for kymograph_model in kymograph_model_set.remaining:
@@ -112,10 +142,17 @@ class KymographSet(BaseSetService):
                     yield kymograph_model
 
     @staticmethod
-    def allocate_kymographs(available_kymographs, image_reader):
-        did_work = False
-        for kymograph_model in available_kymographs:
-            did_work = True
-            # create a numpy array with as many rows as images (and as wide as the individual channel)
-            kymograph_model.allocate_memory(len(image_reader))
-        return did_work
\ No newline at end of file
+    def allocate_kymographs(extractor, frame_count, dtype=np.float64):
+        """
+        Creates the arrays that the kymographs of a time period and field of view are written to.
+
+        :type extractor:        fylm.model.kymograph.KymographExtractor()
+        :param frame_count:     the number of images in the time period
+
+        """
+        # one numpy array with as many rows as images, and as wide as all of the channels put together
+        allocated_bytes = extractor.allocate_memory(frame_count, dtype)
+        saved_bytes = allocated_bytes * np.dtype(np.float64).itemsize / np.dtype(dtype).itemsize - allocated_bytes
+        log.info("Allocated %.1f MB for kymographs as %s (%.1f MB less than float64)" % (allocated_bytes / 1048576.0,
+                                                                                        np.dtype(dtype).name,
+                                                                                        saved_bytes / 1048576.0))
@@ -17,6 +17,8 @@ class LocationSet(BaseSetService):
         self._image_reader.field_of_view = model.field_of_view
         self._image_reader.time_period = 1
         image = self._image_reader.get_image(0, channel="", z_level=1)
+        # the channel finders can wait on the user for a long time, so we don't hold on to the ND2
+        self._image_reader.close()
         acf = ApproximateChannelFinder(image.data, model.field_of_view)
         top_left_x, top_left_y, bottom_right_x, bottom_right_y = acf.results
         model.set_header(top_left_x, top_left_y, bottom_right_x, bottom_right_y)
@@ -99,33 +99,38 @@ class MovieSet(BaseSetService):
             return False
 
         # Make ImageReader only show us the relevant images
-        image_reader = ImageReader(self._experiment)
-        image_reader.field_of_view = field_of_view
-        image_reader.time_period = time_period
-        channels = self._get_channels(image_reader)
-        z_levels = image_reader.nd2.z_level_count
-
-        # Iterate over the images, extract the movie frames, and save them to disk
-        for n, image_set in enumerate(image_reader):
-            for movie in fov_movies:
-                self._update_image_data(movie, image_set, channels, z_levels)
-                for channel in channels:
-                    image = image_set.get_image(channel, 1)
-                    if image is not None:
-                        movie.image_slice.set_image(image, y_margin=int(movie.image_slice.height / 2))
-                        image_filename = "tp%s-fov%s-catch%s-channel_%s-%06d.png" % (time_period,
-                                                                                     field_of_view,
-                                                                                     movie.catch_channel_number,
-                                                                                     channel,
-                                                                                     int(image_set.timestamp))
-                        self._write_movie_frame(movie.image_slice.image_data, movie.base_path, image_filename)
-                try:
-                    cell_bounds = movie.annotation.get_cell_bounds(time_period, n)
-                    self._make_cell_bounds_image(cell_bounds, movie.image_slice.image_data, time_period, field_of_view, movie.catch_channel_number, int(image_set.timestamp), movie.base_path)
-                except:
-                    # haha worst program ever, skipping this so we can make movies that aren't annotated yet
-                    # since we might want to get those to help annotate weird kymographs
-                    pass
+        with ImageReader(self._experiment) as image_reader:
+            image_reader.field_of_view = field_of_view
+            image_reader.time_period = time_period
+            channels = self._get_channels(image_reader)
+            z_levels = image_reader.nd2.z_level_count
+
+            # Iterate over the images, extract the movie frames, and save them to disk
+            for n, image_set in enumerate(image_reader):
+                for movie in fov_movies:
+                    self._update_image_data(movie, image_set, channels, z_levels)
+                    for channel in channels:
+                        if image_set.get_image_slices([movie.image_slice], channel, 1,
+                                                      y_margin=int(movie.image_slice.height / 2)):
+                            image_filename = "tp%s-fov%s-catch%s-channel_%s-%06d.png" % (time_period,
+                                                                                         field_of_view,
+                                                                                         movie.catch_channel_number,
+                                                                                         channel,
+                                                                                         int(image_set.timestamp))
+                            self._write_movie_frame(movie.image_slice.image_data, movie.base_path, image_filename)
+                    try:
+                        cell_bounds = movie.annotation.get_cell_bounds(time_period, n)
+                        self._make_cell_bounds_image(cell_bounds, movie.image_slice.image_data, time_period, field_of_view, movie.catch_channel_number, int(image_set.timestamp), movie.base_path)
+                    except:
+                        # haha worst program ever, skipping this so we can make movies that aren't annotated yet
+                        # since we might want to get those to help annotate weird kymographs
+                        pass
+
+        slot_bytes = sum(movie.slot_bytes for movie in fov_movies)
+        # Slots used to be allocated as float64 RGB images
+        saved_bytes = slot_bytes * 3 * np.dtype(np.float64).itemsize / np.dtype(self._experiment.working_dtype).itemsize - slot_bytes
+        log.info("Movie slots for field of view %s use %.1f MB as %s (%.1f MB less than float64 RGB)" % (
+            field_of_view, slot_bytes / 1048576.0, np.dtype(self._experiment.working_dtype).name, saved_bytes / 1048576.0))
 
         # We've finished making the frames of the movie.
         # Now we use mencoder to combine them into a single .avi file
@@ -250,7 +255,5 @@ class MovieSet(BaseSetService):
         """
         for channel in channels:
             for z_level in xrange(z_levels):
-                image = image_set.get_image(channel, z_level)
-                if image is not None:
-                    movie.image_slice.set_image(image)
+                if image_set.get_image_slices([movie.image_slice], channel, z_level):
                     movie.update_image(channel, z_level)
\ No newline at end of file
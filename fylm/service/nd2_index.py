@@ -0,0 +1,356 @@
+from fylm.model.nd2_index import Nd2Index
+from fylm.service.reader import Reader
+from fylm.service.utilities import FileInteractor
+import logging
+import mmap
+import nd2reader
+import numpy as np
+import os
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+FILEMAP_SIGNATURE = "ND2 FILEMAP SIGNATURE NAME 0001!"
+CHUNK_MAP_SIGNATURE = "ND2 CHUNK MAP SIGNATURE 0000001!"
+IMAGE_DATA_LABEL = "ImageDataSeq|"
+# Every chunk starts with a magic number, the length of its name and the length of its data
+CHUNK_HEADER = struct.Struct("<IIQ")
+CHUNK_MAP_ENTRY = struct.Struct("<QQ")
+
+
+class Nd2IndexService(object):
+    """
+    Creates and loads the index of each ND2, so that the files only have to be parsed once.
+
+    """
+    def __init__(self, experiment):
+        self._experiment = experiment
+        self._base_path = experiment.data_dir + "/index"
+        self._os = os
+
+    def get_index(self, nd2_filename):
+        """
+        Loads the index of an ND2, creating it first if it doesn't exist or the ND2 has changed since it was made.
+
+        :type nd2_filename:     str
+        :returns:               fylm.model.nd2_index.Nd2Index()
+        :raises:                IOError if the ND2 doesn't exist, ValueError if its chunk map can't be parsed
+
+        """
+        try:
+            stat = self._os.stat(nd2_filename)
+        except OSError as e:
+            raise IOError(str(e))
+        index = Nd2Index()
+        index.base_path = self._base_path
+        index.nd2_filename = nd2_filename
+        if Reader().read(index, expect_missing_file=True) and index.is_current(stat.st_size, stat.st_mtime):
+            index.nd2_filename = nd2_filename
+            return index
+        log.info("Indexing %s. This only needs to be done once." % nd2_filename)
+        index = self._create_index(nd2_filename, stat)
+        index.base_path = self._base_path
+        FileInteractor(index).write_text()
+        return index
+
+    def open(self, nd2_filename):
+        """
+        Opens an ND2 for reading with the experiment's ND2 backend:
+
+            mmap:       memory-maps the file and returns frames as views into it, without copying anything
+            indexed:    reads each frame into a new array, using the index to find it
+            nd2reader:  parses the file with nd2reader, without using the index at all
+
+        ND2s that can't be indexed are opened with nd2reader, whatever the backend.
+
+        :type nd2_filename:     str
+        :returns:               fylm.service.nd2_index.MappedNd2(), fylm.service.nd2_index.IndexedNd2() or nd2reader.Nd2()
+        :raises:                IOError if the ND2 doesn't exist
+
+        """
+        backend = self._experiment.nd2_backend
+        if backend == "nd2reader":
+            return nd2reader.Nd2(nd2_filename)
+        try:
+            index = self.get_index(nd2_filename)
+        except ValueError as e:
+            log.warn("Could not index %s, reading it with nd2reader instead: %s" % (nd2_filename, e))
+            return nd2reader.Nd2(nd2_filename)
+        if backend == "mmap":
+            return MappedNd2(nd2_filename, index)
+        return IndexedNd2(nd2_filename, index)
+
+    def _create_index(self, nd2_filename, stat):
+        """
+        Does the one full parse of the ND2 to get its metadata, and scans its chunk map for the image data.
+
+        :returns:   fylm.model.nd2_index.Nd2Index()
+
+        """
+        nd2 = nd2reader.Nd2(nd2_filename)
+        index = Nd2Index()
+        index.nd2_filename = nd2_filename
+        index.nd2_size = stat.st_size
+        index.nd2_mtime = stat.st_mtime
+        index.start_unix_timestamp = self._utc_timestamp(nd2.absolute_start)
+        index.field_of_view_count = nd2.field_of_view_count
+        index.time_index_count = nd2.time_index_count
+        index.z_level_count = nd2.z_level_count
+        index.channel_names = [channel.name for channel in nd2.channels]
+        index.height = nd2.height
+        index.width = nd2.width
+        index.image_groups = self.read_image_groups(nd2_filename)
+        return index
+
+    @staticmethod
+    def read_image_groups(nd2_filename):
+        """
+        Finds where the data of every image group is stored, using the chunk map at the end of the ND2.
+
+        :type nd2_filename:     str
+        :returns:               list of (offset, length), or None for image groups that don't exist, in order of image
+                                group number
+        :raises:                ValueError if the chunk map can't be parsed
+
+        """
+        try:
+            return Nd2IndexService._read_image_groups(nd2_filename)
+        except struct.error as e:
+            raise ValueError("Malformed chunk map: %s" % e)
+
+    @staticmethod
+    def _read_image_groups(nd2_filename):
+        with open(nd2_filename, "rb") as f:
+            # The last eight bytes of the file point to the chunk map
+            f.seek(-8, 2)
+            chunk_map_location = struct.unpack("<Q", f.read(8))[0]
+            f.seek(chunk_map_location)
+            raw_chunk_map = f.read(-1)
+            image_group_locations = {}
+            label_start = raw_chunk_map.index(FILEMAP_SIGNATURE) + len(FILEMAP_SIGNATURE)
+            while True:
+                data_start = raw_chunk_map.index("!", label_start) + 1
+                label = raw_chunk_map[label_start:data_start]
+                location, _ = CHUNK_MAP_ENTRY.unpack(raw_chunk_map[data_start:data_start + CHUNK_MAP_ENTRY.size])
+                label_start = data_start + CHUNK_MAP_ENTRY.size
+                if label == CHUNK_MAP_SIGNATURE:
+                    break
+                if label.startswith(IMAGE_DATA_LABEL):
+                    # labels look like "ImageDataSeq|12!"
+                    image_group_locations[int(label[len(IMAGE_DATA_LABEL):-1])] = location
+
+            image_groups = [None] * (max(image_group_locations) + 1 if image_group_locations else 0)
+            for image_group_number, location in sorted(image_group_locations.items()):
+                f.seek(location)
+                _, name_length, data_length = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+                image_groups[image_group_number] = (location + CHUNK_HEADER.size + name_length, data_length)
+        return image_groups
+
+    @staticmethod
+    def _utc_timestamp(date):
+        return time.mktime(tuple(date.utctimetuple())) - time.mktime((1970, 1, 1, 0, 0, 0, 0, 0, 0))
+
+
+class IndexedNd2(object):
+    """
+    Reads images from an ND2 using its index, without parsing the file. Provides the same interface as nd2reader.Nd2
+    for everything that we use.
+
+    """
+    def __init__(self, nd2_filename, index):
+        """
+        :type nd2_filename:     str
+        :type index:            fylm.model.nd2_index.Nd2Index()
+
+        """
+        self._index = index
+        self._file = open(nd2_filename, "rb")
+        # The prefetching thread and the main thread can read from the same handle
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def channels(self):
+        return [IndexedChannel(channel_name) for channel_name in self._index.channel_names]
+
+    @property
+    def channel_names(self):
+        return list(self._index.channel_names)
+
+    @property
+    def field_of_view_count(self):
+        return self._index.field_of_view_count
+
+    @property
+    def time_index_count(self):
+        return self._index.time_index_count
+
+    @property
+    def z_level_count(self):
+        return self._index.z_level_count
+
+    @property
+    def height(self):
+        return self._index.height
+
+    @property
+    def width(self):
+        return self._index.width
+
+    def get_image(self, time_index, field_of_view, channel_name, z_level):
+        """
+        Reads a single frame.
+
+        :returns:   fylm.service.nd2_index.IndexedImage(), or None if the frame wasn't acquired
+
+        """
+        image_group = self._index.get_image_group(time_index, field_of_view, z_level)
+        if self._index.get_frame_offset(time_index, field_of_view, channel_name, z_level) is None:
+            return None
+        timestamp, image_data = self._read_frame(image_group, self._index.get_channel_count(image_group),
+                                                 self._index.channel_names.index(channel_name))
+        if not image_data.any():
+            # frames that were never acquired are stored as zeros
+            return None
+        return IndexedImage(image_data, timestamp, field_of_view, channel_name, z_level)
+
+    def _read_frame(self, (offset, length), channel_count, channel_offset):
+        """
+        Reads an image group from the file and copies one channel out of it.
+
+        :returns:   (timestamp in seconds, 2D numpy array)
+
+        """
+        with self._lock:
+            self._file.seek(offset)
+            raw_image_group = self._file.read(length)
+        timestamp = struct.unpack("<d", raw_image_group[:Nd2Index.TIMESTAMP_SIZE])[0] / 1000.0
+        pixels = np.frombuffer(raw_image_group, dtype="<u2", offset=Nd2Index.TIMESTAMP_SIZE,
+                               count=self.height * self.width * channel_count)
+        return timestamp, pixels[channel_offset::channel_count].reshape((self.height, self.width)).copy()
+
+    def read_timestamps(self, channel_name="", z_level=0):
+        """
+        Reads when every field of view was acquired at one channel and z-level, while reading as few pixels as
+        possible. Each image group starts with its timestamp, and we read them in the order they're stored, so this is
+        a single pass through the file. nd2reader.Nd2 has no equivalent, so this is only used with the mmap and
+        indexed backends.
+
+        Frames that weren't acquired are left out, exactly like get_image() and image_sets() do. Those are stored as
+        zeros, so we read the first row of each frame too. That's almost always enough to tell that it has an image,
+        and the rest of the frame is only read when the first row is all zeros.
+
+        :returns:   dict of field of view to a list of timestamps in seconds, in order of time index
+
+        """
+        timestamps = {field_of_view: [] for field_of_view in xrange(self.field_of_view_count)}
+        if channel_name not in self._index.channel_names:
+            return timestamps
+        channel_offset = self._index.channel_names.index(channel_name)
+        for time_index in xrange(self.time_index_count):
+            for field_of_view in xrange(self.field_of_view_count):
+                if self._index.get_frame_offset(time_index, field_of_view, channel_name, z_level) is None:
+                    continue
+                image_group = self._index.get_image_group(time_index, field_of_view, z_level)
+                channel_count = self._index.get_channel_count(image_group)
+                timestamp, first_row = self._read_first_row(image_group, channel_count, channel_offset)
+                if not first_row.any() and not self._read_frame(image_group, channel_count, channel_offset)[1].any():
+                    # frames that were never acquired are stored as zeros
+                    continue
+                timestamps[field_of_view].append(timestamp)
+        return timestamps
+
+    def _read_first_row(self, (offset, length), channel_count, channel_offset):
+        """
+        Reads the timestamp of an image group and the first row of one of its channels.
+
+        :returns:   (timestamp in seconds, 1D numpy array)
+
+        """
+        with self._lock:
+            self._file.seek(offset)
+            raw_start = self._file.read(Nd2Index.TIMESTAMP_SIZE + self.width * channel_count * Nd2Index.PIXEL_SIZE)
+        timestamp = struct.unpack("<d", raw_start[:Nd2Index.TIMESTAMP_SIZE])[0] / 1000.0
+        pixels = np.frombuffer(raw_start, dtype="<u2", offset=Nd2Index.TIMESTAMP_SIZE, count=self.width * channel_count)
+        return timestamp, pixels[channel_offset::channel_count]
+
+    def image_sets(self, field_of_view, time_indices=None, channels=None, z_levels=None):
+        """
+        Yields every image of a field of view, grouped by time index.
+
+        :returns:   list of fylm.service.nd2_index.IndexedImage()
+
+        """
+        time_indices = xrange(self.time_index_count) if time_indices is None else time_indices
+        channels = self.channel_names if channels is None else channels
+        z_levels = xrange(self.z_level_count) if z_levels is None else z_levels
+        for time_index in time_indices:
+            image_set = []
+            for channel_name in channels:
+                for z_level in z_levels:
+                    image = self.get_image(time_index, field_of_view, channel_name, z_level)
+                    if image is not None:
+                        image_set.append(image)
+            yield image_set
+
+    def close(self):
+        self._file.close()
+
+
+class MappedNd2(IndexedNd2):
+    """
+    Reads images from a memory-mapped ND2. Frames are read-only views into the file, so reading them doesn't allocate
+    or copy anything; the operating system pages the pixels in when they're used, and can drop them again when memory
+    is needed elsewhere.
+
+    """
+    def __init__(self, nd2_filename, index):
+        super(MappedNd2, self).__init__(nd2_filename, index)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_frame(self, (offset, length), channel_count, channel_offset):
+        """
+        Finds one channel of an image group in the memory-mapped file.
+
+        :returns:   (timestamp in seconds, read-only 2D numpy array that shares memory with the file)
+
+        """
+        timestamp = struct.unpack_from("<d", self._map, offset)[0] / 1000.0
+        pixels = np.frombuffer(self._map, dtype="<u2", offset=offset + Nd2Index.TIMESTAMP_SIZE,
+                               count=self.height * self.width * channel_count)
+        return timestamp, pixels[channel_offset::channel_count].reshape((self.height, self.width))
+
+    def _read_first_row(self, (offset, length), channel_count, channel_offset):
+        timestamp = struct.unpack_from("<d", self._map, offset)[0] / 1000.0
+        pixels = np.frombuffer(self._map, dtype="<u2", offset=offset + Nd2Index.TIMESTAMP_SIZE,
+                               count=self.width * channel_count)
+        return timestamp, pixels[channel_offset::channel_count]
+
+    def close(self):
+        # Frames that are still in use keep the map alive, so we let it be unmapped once they're all gone rather than
+        # pulling the memory out from under them
+        self._map = None
+        super(MappedNd2, self).close()
+
+
+class IndexedChannel(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class IndexedImage(object):
+    """
+    A single frame, with the same attributes as nd2reader's images.
+
+    """
+    def __init__(self, data, timestamp, field_of_view, channel, z_level):
+        self.data = data
+        self.timestamp = timestamp
+        self.field_of_view = field_of_view
+        self.channel = channel
+        self.z_level = z_level
@@ -0,0 +1,163 @@
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from fylm.model.constants import Constants
+import logging
+import nd2reader
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Nd2Pool(object):
+    """
+    A process-wide pool of open ND2 files, shared by every service that reads them.
+
+    Opening an ND2 parses its header and label map, which takes a while for a multi-gigabyte file. Previously every
+    service (and every registration model, twice) opened its own copy of the same file. Now each file is opened once and
+    handed out to whoever asks for it.
+
+    Handles are reference counted: callers acquire() a handle and release() it when they're done, or use open() as a
+    context manager. Handles that nobody is using stay open so they can be reused, until more than `max_open_files` are
+    open, at which point the least recently used idle handles are closed. Handles that are in use are never closed, so
+    the limit can be exceeded temporarily if more files than that are in use at once.
+
+    """
+    def __init__(self, max_open_files, opener=nd2reader.Nd2):
+        """
+        :param max_open_files:  the most files to keep open when they're not being used
+        :type max_open_files:   int
+        :param opener:          creates a handle from a filename
+        :type opener:           callable
+
+        """
+        self._max_open_files = int(max_open_files)
+        self._opener = opener
+        self._handles = OrderedDict()
+        self._references = Counter()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    @property
+    def opener(self):
+        return self._opener
+
+    @opener.setter
+    def opener(self, value):
+        """
+        Changes how files are opened from now on. Handles that are already open are kept.
+
+        """
+        with self._lock:
+            self._opener = value
+
+    @property
+    def max_open_files(self):
+        return self._max_open_files
+
+    @max_open_files.setter
+    def max_open_files(self, value):
+        with self._lock:
+            self._max_open_files = int(value)
+            self._close_idle()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def acquire(self, filename):
+        """
+        Gets the handle for an ND2, opening the file if it isn't open already. Every call must be matched by a call to
+        release().
+
+        :type filename:     str
+        :returns:           nd2reader.Nd2()
+        :raises:            IOError if the file can't be opened
+
+        """
+        with self._lock:
+            nd2 = self._handles.pop(filename, None)
+            if nd2 is None:
+                log.debug("Opening %s" % filename)
+                nd2 = self._opener(filename)
+                self.opened += 1
+            else:
+                self.reused += 1
+            self._handles[filename] = nd2
+            self._references[filename] += 1
+            self._close_idle()
+            return nd2
+
+    def release(self, filename):
+        """
+        Gives back a handle that was acquired. It stays open for reuse until we're over the open file limit.
+
+        :type filename:     str
+
+        """
+        with self._lock:
+            self._references[filename] -= 1
+            if self._references[filename] <= 0:
+                del self._references[filename]
+            self._close_idle()
+
+    @contextmanager
+    def open(self, filename):
+        """
+        Acquires the handle for an ND2 for the duration of a with statement.
+
+        :type filename:     str
+
+        """
+        nd2 = self.acquire(filename)
+        try:
+            yield nd2
+        finally:
+            self.release(filename)
+
+    def clear(self):
+        """
+        Closes every handle that isn't in use.
+
+        """
+        with self._lock:
+            for filename in list(self._handles.keys()):
+                if not self._references[filename]:
+                    self._close(self._handles.pop(filename))
+
+    def reset(self):
+        """
+        Closes every handle, whether or not it's in use, and forgets about them. Only for processes that were forked
+        from one that had files open, since the handles they inherited share their file positions with the parent.
+
+        """
+        with self._lock:
+            for nd2 in self._handles.values():
+                self._close(nd2)
+            self._handles.clear()
+            self._references.clear()
+
+    def log_statistics(self):
+        log.debug("ND2 pool: %s files opened, %s handles reused, %s open now" % (self.opened, self.reused,
+                                                                               len(self._handles)))
+
+    def _close_idle(self):
+        """
+        Closes the least recently used handles that aren't in use until we're within the open file limit. Must hold
+        the lock.
+
+        """
+        for filename in list(self._handles.keys()):
+            if len(self._handles) <= self._max_open_files:
+                break
+            if not self._references[filename]:
+                self._close(self._handles.pop(filename))
+
+    @staticmethod
+    def _close(nd2):
+        close = getattr(nd2, "close", None)
+        if close is not None:
+            close()
+
+
+# There's one pool for the whole process so that each ND2 is only parsed once per run
+nd2_pool = Nd2Pool(Constants.MAX_OPEN_ND2_FILES)
@@ -0,0 +1,94 @@
+from Queue import Queue, Full
+import logging
+import six
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher(object):
+    """
+    Runs an iterator on a worker thread so that the next few items are being read while the current one is processed.
+
+    Reading images from an ND2 is mostly waiting on the disk, while correcting and analyzing them is mostly computation,
+    so doing both at once saves a lot of time. At most `depth` items are held in the queue; when it's full the worker
+    waits for the consumer to catch up, so memory use stays bounded no matter how slow the consumer is.
+
+    """
+    _done = object()
+
+    def __init__(self, iterable, depth, prepare=None):
+        """
+        :param iterable:    the items to fetch
+        :param depth:       the number of items to read ahead. Zero disables prefetching entirely.
+        :type depth:        int
+        :param prepare:     a function run on the worker thread for each item, whose result is yielded instead
+                            (e.g. to force image data to be decoded)
+        :type prepare:      callable
+
+        """
+        self._iterable = iterable
+        self._depth = int(depth)
+        self._prepare = prepare if prepare is not None else (lambda item: item)
+
+    def __iter__(self):
+        if self._depth < 1:
+            for item in self._iterable:
+                yield self._prepare(item)
+            return
+
+        queue = Queue(maxsize=self._depth)
+        stop = threading.Event()
+        worker = threading.Thread(target=self._work, args=(queue, stop))
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                item = queue.get()
+                if item is Prefetcher._done:
+                    break
+                if isinstance(item, _Failure):
+                    six.reraise(*item.exc_info)
+                yield item
+        finally:
+            # If the consumer stopped early, make sure the worker isn't left waiting on a full queue forever
+            stop.set()
+            while not queue.empty():
+                queue.get_nowait()
+            worker.join()
+
+    def _work(self, queue, stop):
+        try:
+            for item in self._iterable:
+                if not self._put(queue, stop, self._prepare(item)):
+                    return
+        except Exception:
+            self._put(queue, stop, _Failure(sys.exc_info()))
+            return
+        self._put(queue, stop, Prefetcher._done)
+
+    @staticmethod
+    def _put(queue, stop, item):
+        """
+        Waits for room in the queue, unless the consumer has gone away.
+
+        :returns:   bool, whether the item was queued
+
+        """
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+
+class _Failure(object):
+    """
+    Carries an exception from the worker thread to the consumer, so it can be raised there.
+
+    """
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
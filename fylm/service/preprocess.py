@@ -0,0 +1,230 @@
+from collections import defaultdict
+from fylm.model.constants import Constants
+from fylm.service.base import BaseService
+from fylm.service.nd2_pool import nd2_pool
+from fylm.service.registration import RegistrationSet as RegistrationSetService
+from fylm.service.rotation import RotationSet as RotationSetService
+from fylm.service.timestamp import TimestampSet as TimestampSetService
+from fylm.service.utilities import FileInteractor, timer
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class Preprocessor(BaseService):
+    """
+    Finds the rotation offsets, timestamps and registration offsets of an experiment together, reading each ND2 once.
+
+    Doing them one after the other reads every ND2 at least three times, and reads each one in the order of its fields
+    of view rather than the order the images are stored in. Here we go through each ND2 once, in order of time index
+    and then field of view, which is how the images are laid out in the file, and hand each image to whichever
+    calculations need it. The files that are written are the same as the ones the individual services write.
+
+    """
+    def __init__(self, experiment):
+        super(Preprocessor, self).__init__()
+        self._experiment = experiment
+        self._rotation_service = RotationSetService(experiment)
+        self._timestamp_service = TimestampSetService(experiment)
+        self._registration_service = RegistrationSetService(experiment)
+
+    def save(self, rotation_set, timestamp_set, registration_set, skip=()):
+        """
+        Calculates and writes everything that hasn't been done yet.
+
+        If the experiment is using more than one process, registration is left out of the sweep and done afterwards by
+        RegistrationSet.save_text(), since spreading it over several processes is faster than reading the file once.
+
+        :type rotation_set:         fylm.model.rotation.RotationSet()
+        :type timestamp_set:        fylm.model.timestamp.TimestampSet()
+        :type registration_set:     fylm.model.registration.RegistrationSet()
+        :param skip:                any of "rotation", "timestamp" and "registration", which won't be calculated
+        :type skip:                 tuple of str
+
+        """
+        self._rotation_service.find_current(rotation_set)
+        self._timestamp_service.find_current(timestamp_set)
+        self._registration_service.find_current(registration_set)
+        register_in_parallel = self._experiment.jobs > 1 and "registration" not in skip
+        if register_in_parallel:
+            skip = tuple(skip) + ("registration",)
+        remaining = defaultdict(list)
+        for name, model_set in (("rotation", rotation_set),
+                                ("timestamp", timestamp_set),
+                                ("registration", registration_set)):
+            if name not in skip:
+                for model in model_set.remaining:
+                    remaining[model.time_period].append((name, model))
+
+        did_work = False
+        for time_period in self._experiment.time_periods:
+            if remaining[time_period]:
+                self.sweep(time_period, remaining[time_period])
+                did_work = True
+        if register_in_parallel:
+            self._registration_service.save_text(registration_set, self._experiment.jobs)
+        elif not did_work:
+            log.info("All rotation corrections, timestamps and registration offsets have been calculated.")
+
+    @timer
+    def sweep(self, time_period, models):
+        """
+        Reads one ND2 from start to finish, calculating every model of the time period along the way.
+
+        :param models:  (name of the calculation, model)
+        :type models:   list of (str, fylm.model.base.BaseTextFile())
+
+        """
+        log.info("Preprocessing time period %s: %s" % (time_period, ", ".join(sorted(model.filename
+                                                                                     for _, model in models))))
+        with nd2_pool.open(self._experiment.get_nd2_from_time_period(time_period)) as nd2:
+            calculators = []
+            keyframe_models = []
+            timestamp_models = []
+            for name, model in models:
+                if name == "rotation":
+                    calculators.append(RotationCalculator(self._rotation_service, model))
+                elif name == "timestamp":
+                    timestamp_offset = self._timestamp_service.get_timestamp_offset(time_period)
+                    if hasattr(nd2, "read_timestamps"):
+                        # with the mmap and indexed backends, we only need to read the first row of each image
+                        timestamp_models.append((model, timestamp_offset))
+                    else:
+                        calculators.append(TimestampCalculator(model, timestamp_offset))
+                elif self._experiment.registration_keyframe_interval > 1:
+                    # keyframe registration decides which images it needs as it goes, so it can't be part of the sweep
+                    keyframe_models.append(model)
+                else:
+                    calculators.append(RegistrationCalculator(
+                        self._registration_service.get_correlator(model.field_of_view), model))
+
+            if timestamp_models:
+                timestamps = nd2.read_timestamps()
+                for model, timestamp_offset in timestamp_models:
+                    for timestamp in timestamps.get(model.field_of_view, []):
+                        model.add(timestamp + timestamp_offset)
+                    FileInteractor(model).write_text()
+
+            # Work out which calculations want which images, so that we only read the images that someone needs
+            wanted = defaultdict(list)
+            for calculator in calculators:
+                wanted[calculator.field_of_view, calculator.z_level].append(calculator)
+
+            for time_index in xrange(nd2.time_index_count):
+                for field_of_view, z_level in sorted(wanted.keys()):
+                    interested = [calculator for calculator in wanted[field_of_view, z_level]
+                                  if calculator.wants(time_index)]
+                    if interested:
+                        image = nd2.get_image(time_index, field_of_view, "", z_level)
+                        for calculator in interested:
+                            calculator.add(image)
+
+        for calculator in calculators:
+            calculator.finish()
+            FileInteractor(calculator.model).write_text()
+        for model in keyframe_models:
+            self._registration_service.save_action(model)
+            FileInteractor(model).write_text()
+        self._registration_service.save_wisdom()
+
+
+class RotationCalculator(object):
+    """
+    Finds the rotation offset of a field of view from its first in-focus image.
+
+    """
+    z_level = 1
+
+    def __init__(self, rotation_service, rotation_model):
+        """
+        :type rotation_service:     fylm.service.rotation.RotationSet()
+        :type rotation_model:       fylm.model.rotation.Rotation()
+
+        """
+        self._rotation_service = rotation_service
+        self.model = rotation_model
+        self.field_of_view = rotation_model.field_of_view
+
+    @staticmethod
+    def wants(time_index):
+        return time_index == 0
+
+    def add(self, image):
+        self.model.offset = self._rotation_service.find_offset(image.data)
+
+    def finish(self):
+        pass
+
+
+class TimestampCalculator(object):
+    """
+    Collects the timestamp of every bright field image of a field of view, for ND2s that are read with nd2reader and
+    so can only give us timestamps along with images.
+
+    """
+    z_level = 0
+
+    def __init__(self, timestamps_model, timestamp_offset):
+        """
+        :type timestamps_model:     fylm.model.timestamp.Timestamps()
+        :param timestamp_offset:    seconds between the start of the first ND2 and the start of this one
+        :type timestamp_offset:     float
+
+        """
+        self.model = timestamps_model
+        self.field_of_view = timestamps_model.field_of_view
+        self._timestamp_offset = timestamp_offset
+
+    @staticmethod
+    def wants(time_index):
+        return True
+
+    def add(self, image):
+        if image is not None:
+            self.model.add(image.timestamp + self._timestamp_offset)
+
+    def finish(self):
+        pass
+
+
+class RegistrationCalculator(object):
+    """
+    Registers every bright field image of a field of view, in batches.
+
+    The images of the other fields of view are read in between, so we hold on to a batch's worth of images until
+    there are enough to register them together. With the mmap ND2 backend these are views into the file, so they
+    don't take up any memory of their own.
+
+    """
+    z_level = 0
+
+    def __init__(self, correlator, registration_model, batch_size=Constants.REGISTRATION_BATCH_SIZE):
+        """
+        :type correlator:           fylm.model.phase_correlation.PhaseCorrelator()
+        :type registration_model:   fylm.model.registration.Registration()
+
+        """
+        self._correlator = correlator
+        self.model = registration_model
+        self.field_of_view = registration_model.field_of_view
+        self._batch_size = batch_size
+        self._batch = []
+
+    @staticmethod
+    def wants(time_index):
+        return True
+
+    def add(self, image):
+        self._batch.append(image.data)
+        if len(self._batch) == self._batch_size:
+            self._register_batch()
+
+    def finish(self):
+        if self._batch:
+            self._register_batch()
+
+    def _register_batch(self):
+        for dx, dy in self._correlator.register_stack(np.array(self._batch)):
+            self.model.add(dx, dy)
+        self._batch = []
@@ -1,12 +1,22 @@
+from fylm.model.constants import Constants
+from fylm.model.fft_wisdom import FFTWisdom
+from fylm.model.location import LocationSet
+from fylm.model.phase_correlation import FFTWTransform, PhaseCorrelator, band_windows, evaluate_correlators, \
+    format_evaluation, get_transform, location_windows
+from fylm.model.rotation import RotationSet
 from fylm.service.base import BaseSetService
-from fylm.service.utilities import timer
-import nd2reader
+from fylm.service.nd2_pool import nd2_pool
+from fylm.service.reader import Reader
+from fylm.service.utilities import FileInteractor, timer
 import logging
-from skimage.feature.phase_correlate import phase_correlate
+import numpy as np
 
 
 log = logging.getLogger(__name__)
 
+# How many frames registration settings are evaluated on
+EVALUATION_FRAME_COUNT = 100
+
 
 class RegistrationSet(BaseSetService):
     """
@@ -17,61 +27,152 @@ class RegistrationSet(BaseSetService):
         super(RegistrationSet, self).__init__()
         self._experiment = experiment
         self._name = "registration offsets"
+        self._correlators = {}
+        self._location_set = None
+        self._rotation_set = None
+        self._transform = get_transform(experiment.fft_backend, experiment.fft_threads)
+        self._wisdom = FFTWisdom()
+        self._wisdom.base_path = experiment.data_dir
+        if self._transform.name == FFTWTransform.name:
+            self._load_wisdom()
 
     @timer
     def save_action(self, registration_model):
         """
-        Calculates the rotation offset for a single field of view and time_period.
+        Calculates the registration offsets for a single field of view and time_period.
 
         :type registration_model:   fylm.model.registration.Registration()
 
         """
         log.info("Creating registration file %s" % registration_model.filename)
-        # This is a pretty naive loop - the same file will get opened 8-12 times
-        # There are obvious ways to optimize this but that can be done later if it matters
-        # It probably doesn't matter though and I like simple things
-        base_nd2_filename = self._experiment.get_nd2_from_time_period(1)
         nd2_filename = self._experiment.get_nd2_from_time_period(registration_model.time_period)
-        base_nd2 = nd2reader.Nd2(base_nd2_filename)
-        nd2 = nd2reader.Nd2(nd2_filename)
-        # gets the first out-of-focus image from the first time_period in the stack
-        base_image = base_nd2.get_image(0, registration_model.field_of_view, "", 0)
-        for i in range(nd2.time_index_count):
-            image = nd2.get_image(i, registration_model.field_of_view, "", 0)
-            dx, dy = self._determine_registration_offset(base_image.data, image.data)
-            registration_model.add(dx, dy)
-
-    @staticmethod
-    def _determine_registration_offset(base_image, uncorrected_image):
-        """
-        Finds the translational offset required to align this image with all others in the stack.
-        Returns dx, dy adjustments in pixels *but does not change the image!*
-
-        :param base_image:   a 2D numpy array that the other image should be aligned to
-        :param uncorrected_image:   a 2D numpy array
-        :returns:   float, float
-
-        """
-        # Get the dimensions of the images that we're aligning
-        base_height, base_width = base_image.shape
-        uncorrected_height, uncorrected_width = uncorrected_image.shape
-
-        # We take the area that roughly corresponds to the catch channels. This has two benefits: one, it
-        # speeds up the registration significantly (as it scales linearly with image size), and two, if
-        # a large amount of debris/yeast/bacteria/whatever shows up in the central trench, the registration
-        # algorithm goes bonkers if it's considering that portion of the image.
-        # Thus we separately find the registration for the left side and right side, and average them.
-        left_base_section = base_image[:, base_width * 0.1: base_width * 0.3]
-        left_uncorrected = uncorrected_image[:, uncorrected_width * 0.1: uncorrected_width * 0.3]
-        right_base_section = base_image[:, base_width * 0.7: base_width * 0.9]
-        right_uncorrected = uncorrected_image[:, uncorrected_width * 0.7: uncorrected_width * 0.9]
-
-        # phase_correlate returns y, x instead of x, y, which is not the convention in scikit-image, so we reverse them
-        # it also returns some error bars and other stuff we don't need, so we just take the first two items
-        left_dy, left_dx = phase_correlate(left_base_section, left_uncorrected, upsample_factor=20)[:2]
-        right_dy, right_dx = phase_correlate(right_base_section, right_uncorrected, upsample_factor=20)[:2]
-        #
-        # # return the average of the left and right phase correlation corrections
-        return (left_dx + right_dx) / 2.0, (left_dy + right_dy) / 2.0
-        # dy, dx = phase_correlate(base_image[100:, :], uncorrected_image[100:, :], upsample_factor=20)[:2]
-        # return dy, dx
\ No newline at end of file
+        correlator = self.get_correlator(registration_model.field_of_view)
+        with nd2_pool.open(nd2_filename) as nd2:
+            if self._experiment.registration_keyframe_interval > 1:
+                offsets = correlator.register_keyframes(
+                    lambda i: nd2.get_image(i, registration_model.field_of_view, "", 0).data, nd2.time_index_count,
+                    self._experiment.registration_keyframe_interval, self._experiment.registration_keyframe_threshold)
+                for dx, dy, interpolated in offsets:
+                    registration_model.add(dx, dy, interpolated)
+            else:
+                images = (nd2.get_image(i, registration_model.field_of_view, "", 0).data
+                          for i in range(nd2.time_index_count))
+                for dx, dy in correlator.register_images(images):
+                    registration_model.add(dx, dy)
+        self.save_wisdom()
+
+    def start_worker(self, jobs):
+        """
+        Registration models are independent, so they can be calculated in parallel. Each worker process gets its own
+        share of the FFT threads, and its own ND2 handles.
+
+        """
+        nd2_pool.reset()
+        self._correlators = {}
+        self._transform = get_transform(self._experiment.fft_backend, max(1, self._experiment.fft_threads // jobs))
+
+    def get_correlator(self, field_of_view):
+        """
+        Every time period of a field of view is aligned to the same base image, so we only prepare it once.
+
+        :type field_of_view:    int
+        :returns:               fylm.model.phase_correlation.PhaseCorrelator()
+
+        """
+        if field_of_view not in self._correlators:
+            self._correlators[field_of_view] = self._make_correlator(field_of_view,
+                                                                     self._experiment.registration_upsample_factor,
+                                                                     self._experiment.registration_downsample)
+        return self._correlators[field_of_view]
+
+    def _get_base_image(self, field_of_view):
+        """
+        Gets the first out-of-focus image from the first time_period in the stack, which everything is aligned to.
+
+        :returns:   2D np.ndarray
+
+        """
+        with nd2_pool.open(self._experiment.get_nd2_from_time_period(1)) as base_nd2:
+            return base_nd2.get_image(0, field_of_view, "", 0).data
+
+    def _make_correlator(self, field_of_view, upsample_factor, downsample):
+        """
+        :returns:   fylm.model.phase_correlation.PhaseCorrelator()
+
+        """
+        base_image = self._get_base_image(field_of_view)
+        return PhaseCorrelator(base_image, self._get_windows(field_of_view, base_image.shape),
+                               upsample_factor=upsample_factor, transform=self._transform, downsample=downsample)
+
+    def _get_windows(self, field_of_view, shape):
+        """
+        Decides which parts of the images to correlate.
+
+        We take the areas that roughly correspond to the catch channels. This has two benefits: one, it
+        speeds up the registration significantly (as it scales linearly with image size), and two, if
+        a large amount of debris/yeast/bacteria/whatever shows up in the central trench, the registration
+        algorithm goes bonkers if it's considering that portion of the image.
+        Thus we separately find the registration for the left side and right side, and average them.
+
+        If the channels have been located already we use the areas around them, otherwise we use a band of columns on
+        either side of the central trench.
+
+        :returns:   list of (row slice, column slice)
+
+        """
+        if self._location_set is None:
+            self._location_set = LocationSet(self._experiment)
+            self._rotation_set = RotationSet(self._experiment)
+            self.load_existing_models(self._location_set)
+            self.load_existing_models(self._rotation_set)
+        location = self._location_set.get_model(field_of_view)
+        if location is not None and self._rotation_set.get_model(field_of_view) is not None:
+            windows = location_windows(shape, location.channel_bounds, self._rotation_set.get_data(field_of_view))
+            if windows:
+                log.debug("Registering field of view %s with windows around the catch channels: %s" %
+                          (field_of_view, windows))
+                return windows
+        return band_windows(shape, self._experiment.registration_bands)
+
+    def evaluate(self, time_period, field_of_view, downsamples=(2, 4, 8), frame_count=EVALUATION_FRAME_COUNT):
+        """
+        Compares coarse-to-fine registration with the reference (full resolution, upsampled 20 times) on real images,
+        so that we can choose the fastest setting that is still accurate enough. Nothing is saved.
+
+        :param downsamples:     the coarse-to-fine settings to try
+        :type downsamples:      tuple of int
+        :param frame_count:     how many images from the start of the time period to register
+        :type frame_count:      int
+
+        """
+        with nd2_pool.open(self._experiment.get_nd2_from_time_period(time_period)) as nd2:
+            stack = np.array([nd2.get_image(i, field_of_view, "", 0).data
+                              for i in range(min(frame_count, nd2.time_index_count))])
+        reference = self._make_correlator(field_of_view, Constants.REGISTRATION_UPSAMPLE_FACTOR, 1)
+        candidates = [self._make_correlator(field_of_view, self._experiment.registration_upsample_factor, downsample)
+                      for downsample in downsamples]
+        log.info("Registration accuracy for time period %s, field of view %s (%s frames, errors in pixels):" %
+                 (time_period, field_of_view, len(stack)))
+        for line in format_evaluation(evaluate_correlators(stack, reference, candidates)):
+            log.info(line)
+
+    def _load_wisdom(self):
+        """
+        Loads the FFTW wisdom saved by earlier runs, if there is any.
+
+        """
+        if Reader().read(self._wisdom, expect_missing_file=True):
+            log.debug("Loaded FFTW wisdom from %s" % self._wisdom.path)
+            self._transform.import_wisdom(self._wisdom.wisdom)
+
+    def save_wisdom(self):
+        """
+        Saves what FFTW has learned so far, if we're using FFTW and it learned anything new.
+
+        """
+        if self._transform.name != FFTWTransform.name:
+            return
+        wisdom = self._transform.export_wisdom()
+        if wisdom != self._wisdom.wisdom:
+            self._wisdom.wisdom = wisdom
+            FileInteractor(self._wisdom).write_text()
@@ -1,10 +1,9 @@
-from skimage import transform
+from fylm.model.hough import find_line_angles
 from fylm.service.utilities import ImageUtilities, timer
 from fylm.service.base import BaseSetService
+from fylm.service.nd2_pool import nd2_pool
 from skimage.morphology import skeletonize
 from fylm.model.constants import Constants
-import nd2reader
-import numpy as np
 import math
 import logging
 
@@ -31,38 +30,52 @@ class RotationSet(BaseSetService):
 
         """
         log.info("Creating rotation file %s" % rotation_model.filename)
-        # This is a pretty naive loop - the same file will get opened 8-12 times
-        # There are obvious ways to optimize this but that can be done later if it matters
-        # It probably doesn't matter though and I like simple things
         nd2_filename = self._experiment.get_nd2_from_time_period(rotation_model.time_period)
-        nd2 = nd2reader.Nd2(nd2_filename)
-        # gets the first in-focus image from the first timpoint in the stack
-        # TODO: Update nd2reader to figure out which one is in focus or to be able to set it
-        image = nd2.get_image(0, rotation_model.field_of_view, "", 1)
-        offset = self._determine_rotation_offset(image.data)
-        rotation_model.offset = offset
+        with nd2_pool.open(nd2_filename) as nd2:
+            # gets the first in-focus image from the first timpoint in the stack
+            # TODO: Update nd2reader to figure out which one is in focus or to be able to set it
+            image = nd2.get_image(0, rotation_model.field_of_view, "", 1)
+        rotation_model.offset = self.find_offset(image.data)
 
-    @staticmethod
-    def _determine_rotation_offset(image):
+    def find_offset(self, image):
         """
-        Finds rotational skew so that the sides of the central trench are (nearly) perfectly vertical.
+        Finds the rotation offset of an image with the experiment's settings.
 
         :param image:   raw image data in a 2D (i.e. grayscale) numpy array
         :type image:    np.array()
+        :returns:       float
+
+        """
+        return self._determine_rotation_offset(image, self._experiment.rotation_coarse_angle_step,
+                                               self._experiment.rotation_downsample,
+                                               self._experiment.rotation_smoothing)
+
+    @staticmethod
+    def _determine_rotation_offset(image, coarse_step=Constants.ROTATION_COARSE_ANGLE_STEP, downsample=1,
+                                   smoothing="disk"):
+        """
+        Finds rotational skew so that the sides of the central trench are (nearly) perfectly vertical.
+
+        :param image:       raw image data in a 2D (i.e. grayscale) numpy array
+        :type image:        np.array()
+        :param coarse_step: the spacing of the first, coarse search for lines, in radians. See
+                            fylm.model.hough.find_line_angles()
+        :type coarse_step:  float
+        :param downsample:  shrink the image by this factor before searching for lines
+        :type downsample:   int
+        :param smoothing:   how to measure edge density. See ImageUtilities._segment_edge_areas()
+        :type smoothing:    str
 
         """
-        segmentation = ImageUtilities.create_vertical_segments(image)
+        segmentation = ImageUtilities.create_vertical_segments(image, smoothing)
         # Draw a line that follows the center of the segments at each point, which should be roughly vertical
         # We should expect this to give us four approximately-vertical lines, possibly with many gaps in each line
         skeletons = skeletonize(segmentation)
         # Use the Hough transform to get the closest lines that approximate those four lines
-        hough = transform.hough_line(skeletons, np.arange(-Constants.FIFTEEN_DEGREES_IN_RADIANS,
-                                                          Constants.FIFTEEN_DEGREES_IN_RADIANS,
-                                                          0.0001))
-        # Create a list of the angles (in radians) of all of the lines the Hough transform produced, with 0.0 being
-        # completely vertical
+        # This gives us a list of the angles (in radians) of all of the lines the Hough transform produced, with 0.0
+        # being completely vertical
         # These angles correspond to the angles of the four sides of the channels, which we need to correct for
-        angles = [angle for _, angle, dist in zip(*transform.hough_line_peaks(*hough))]
+        angles = find_line_angles(skeletons, coarse_step=coarse_step, downsample=downsample)
         if not angles:
             log.warn("Image skew could not be calculated. The image is probably invalid.")
             return 0.0
@@ -1,9 +1,9 @@
 from fylm.model.timestamp import Timestamps
 from fylm.service.reader import Reader
 from fylm.service.base import BaseSetService
+from fylm.service.nd2_pool import nd2_pool
 from fylm.service.utilities import timer
 import logging
-import nd2reader
 import time
 
 log = logging.getLogger(__name__)
@@ -18,6 +18,8 @@ class TimestampSet(BaseSetService):
         super(TimestampSet, self).__init__()
         self._experiment = experiment
         self._name = "timestamps"
+        # The timestamps of every field of view of each ND2 we've read, keyed by filename
+        self._nd2_timestamps = {}
 
     @timer
     def save_action(self, timestamps_model):
@@ -31,20 +33,44 @@ class TimestampSet(BaseSetService):
         :type timestamps_model: fylm.model.Timestamps()
 
         """
-        # ND2 timestamps are relative to the beginning of acquisition of a single time period. So to get the true timestamp
-        # we need to look at the datetime that each ND2 began and compare it to the first ND2. This will be zero for the
-        # first one.
-        timestamp_offset = self._experiment.exact_start_time(timestamps_model.time_period) - self._experiment.exact_start_time(1)
-        log.debug("Timestamp offset for time period %s: %s" % (timestamps_model.time_period, timestamp_offset))
+        timestamp_offset = self.get_timestamp_offset(timestamps_model.time_period)
         log.info("Creating timestamps for time_period:%s, Field of View:%s" % (timestamps_model.time_period,
                                                                                timestamps_model.field_of_view))
         nd2_filename = self._experiment.get_nd2_from_time_period(timestamps_model.time_period)
-        nd2 = nd2reader.Nd2(nd2_filename)
-        # subtract 1 from the field of view since nd2reader uses 0-based indexing, but we
-        # refer to the fields of view with 1-based indexing
-        for image_set in nd2.image_sets(field_of_view=timestamps_model.field_of_view,
-                                        channels=[""],
-                                        z_levels=[0]):
-            image = [i for i in image_set][0]
-            timestamp = image.timestamp + timestamp_offset
-            timestamps_model.add(timestamp)
\ No newline at end of file
+        for timestamp in self._read_timestamps(nd2_filename, timestamps_model.field_of_view):
+            timestamps_model.add(timestamp + timestamp_offset)
+
+    def get_timestamp_offset(self, time_period):
+        """
+        ND2 timestamps are relative to the beginning of acquisition of a single time period. So to get the true timestamp
+        we need to look at the datetime that each ND2 began and compare it to the first ND2. This will be zero for the
+        first one.
+
+        :returns:   the number of seconds to add to the timestamps of a time period
+
+        """
+        timestamp_offset = self._experiment.exact_start_time(time_period) - self._experiment.exact_start_time(1)
+        log.debug("Timestamp offset for time period %s: %s" % (time_period, timestamp_offset))
+        return timestamp_offset
+
+    def _read_timestamps(self, nd2_filename, field_of_view):
+        """
+        Gets the timestamps of one field of view, relative to the start of its ND2.
+
+        With the mmap and indexed ND2 backends, the timestamps of every field of view are read in one pass the first
+        time any of them is asked for. That still reads the first row of each bright field image, to leave out frames
+        that were never acquired, and the whole image when that row is black. With nd2reader, the default, we have to
+        read every bright field image of the field of view.
+
+        :returns:   list of float
+
+        """
+        if nd2_filename not in self._nd2_timestamps:
+            with nd2_pool.open(nd2_filename) as nd2:
+                if not hasattr(nd2, "read_timestamps"):
+                    # subtract 1 from the field of view since nd2reader uses 0-based indexing, but we
+                    # refer to the fields of view with 1-based indexing
+                    return [[image for image in image_set][0].timestamp
+                            for image_set in nd2.image_sets(field_of_view=field_of_view, channels=[""], z_levels=[0])]
+                self._nd2_timestamps[nd2_filename] = nd2.read_timestamps()
+        return self._nd2_timestamps[nd2_filename].get(field_of_view, [])
\ No newline at end of file
@@ -1,6 +1,9 @@
 import argparse
 from fylm.service.experiment import Experiment as ExperimentService
 from fylm.activity import Activity
+from fylm.service.cache import frame_cache
+from fylm.service.nd2_pool import nd2_pool
+from fylm.model.constants import Constants
 import logging
 import sys
 import os
@@ -33,14 +36,48 @@ try:
     parser.add_argument('--movies', action='store_true', help='Make movies for space-separated time periods')
     parser.add_argument("-v", "--verbosity", action="count", default=0, help="Specify -v through -vvvvv")
     parser.add_argument('-r', "--review", action='store_true', help="Review all annotations regardless of whether they've been completed")
+    parser.add_argument('--prefetch', type=int, default=Constants.PREFETCH_DEPTH, help='Number of images to read ahead while processing (0 disables prefetching)')
+    parser.add_argument('--frame-cache', type=int, default=Constants.FRAME_CACHE_MEGABYTES, help='Megabytes of memory to use for reusing corrected images (0 disables the cache)')
+    parser.add_argument('--dtype', choices=('float32', 'float64'), default=Constants.WORKING_DTYPE, help='Floating point type for corrected images, kymographs and movie frames')
+    parser.add_argument('--pixel-tolerance', type=float, default=Constants.WHOLE_PIXEL_TOLERANCE, help='How close to a whole-pixel shift (in pixels) a correction must be to skip interpolation')
+    parser.add_argument('--max-open-nd2s', type=int, default=Constants.MAX_OPEN_ND2_FILES, help='Number of ND2 files to keep open for reuse')
+    parser.add_argument('--nd2-backend', choices=('mmap', 'indexed', 'nd2reader'), default=Constants.ND2_BACKEND, help='How to read images from ND2 files. mmap and indexed use our own ND2 reader, which is faster but experimental. They also read timestamps in one pass, reading just the first row of each frame instead of the whole frame')
+    parser.add_argument('--fft-backend', choices=('numpy', 'fftw'), default=Constants.FFT_BACKEND, help='Which library does the FFTs for registration')
+    parser.add_argument('--fft-threads', type=int, default=Constants.FFT_THREADS, help='Number of threads each FFTW transform uses')
+    parser.add_argument('-j', '--jobs', type=int, default=Constants.JOBS, help='Number of processes to calculate registration offsets with')
+    parser.add_argument('--registration-bands', type=float, nargs='+', default=[edge for band in Constants.REGISTRATION_BANDS for edge in band], help='Left and right edges of each band of the image used for registration, as fractions of its width')
+    parser.add_argument('--registration-upsample', type=int, default=Constants.REGISTRATION_UPSAMPLE_FACTOR, help='Find registration offsets to within 1/N of a pixel')
+    parser.add_argument('--registration-downsample', type=int, default=Constants.REGISTRATION_DOWNSAMPLE, help='Average NxN blocks of pixels for coarse-to-fine registration (1 is full resolution). Use --action registration-accuracy to see what this costs')
+    parser.add_argument('--registration-keyframes', type=int, default=Constants.REGISTRATION_KEYFRAME_INTERVAL, help='Register every Nth frame and interpolate the rest (1 registers every frame)')
+    parser.add_argument('--keyframe-threshold', type=float, default=Constants.REGISTRATION_KEYFRAME_THRESHOLD, help='Register the frames between two keyframes anyway if their offsets differ by more than this many pixels')
+    parser.add_argument('--rotation-coarse-step', type=float, default=Constants.ROTATION_COARSE_ANGLE_STEP, help='Spacing in radians of the coarse rotation search (0 tries every angle)')
+    parser.add_argument('--rotation-downsample', type=int, default=Constants.ROTATION_DOWNSAMPLE, help='Shrink images by this factor when finding the rotation (1 uses the full image)')
+    parser.add_argument('--rotation-smoothing', choices=('disk', 'box'), default=Constants.ROTATION_SMOOTHING, help='How to measure edge density when finding the rotation. box is faster but approximate')
+    parser.add_argument('--kymograph-sampling', choices=('raw', 'corrected'), default=Constants.KYMOGRAPH_SAMPLING, help='raw interpolates kymograph lines straight from the raw frames, corrected corrects the rows they come from first')
     args = parser.parse_args(namespace=Args())
-
-    experiment = ExperimentService().get_experiment(args.date, args.dir, version, args.review)
+    frame_cache.max_bytes = args.frame_cache * 1048576
+    nd2_pool.max_open_files = args.max_open_nd2s
+
+    experiment = ExperimentService().get_experiment(args.date, args.dir, version, args.review, args.nd2_backend)
+    experiment.prefetch_depth = args.prefetch
+    experiment.working_dtype = args.dtype
+    experiment.whole_pixel_tolerance = args.pixel_tolerance
+    experiment.rotation_coarse_angle_step = args.rotation_coarse_step
+    experiment.rotation_downsample = args.rotation_downsample
+    experiment.rotation_smoothing = args.rotation_smoothing
+    experiment.kymograph_sampling = args.kymograph_sampling
+    experiment.fft_backend = args.fft_backend
+    experiment.fft_threads = args.fft_threads
+    experiment.jobs = args.jobs
+    experiment.registration_bands = tuple(zip(args.registration_bands[::2], args.registration_bands[1::2]))
+    experiment.registration_upsample_factor = args.registration_upsample
+    experiment.registration_downsample = args.registration_downsample
+    experiment.registration_keyframe_interval = args.registration_keyframes
+    experiment.registration_keyframe_threshold = args.keyframe_threshold
 
     # These are the actions that need to be run to completion for each experiment.
-    first_activities = ("rotation",
-                        "timestamp",
-                        "registration",
+    # Preprocessing finds the rotation offsets, timestamps and registration offsets together
+    first_activities = ("preprocess",
                         "location",
                         "kymograph")
 
@@ -51,26 +88,31 @@ try:
 
     # Define what each action is and the arguments it takes (note: not all methods take arguments)
     act = Activity(experiment)
-    actions = {"rotation": act.calculate_rotation_offset,
+    actions = {"preprocess": act.preprocess,
+               "rotation": act.calculate_rotation_offset,
                "timestamp": act.extract_timestamps,
                "registration": act.calculate_registration,
                "location": act.input_channel_locations,
+               "store": act.store_corrected_images,
                "kymograph": act.create_kymographs,
                "movies": act.make_movies,
                "annotation": act.annotate_kymographs,
                "fluorescence": act.quantify_fluorescence,
                "output": act.generate_output,
-               "summary": act.generate_summary
+               "summary": act.generate_summary,
+               "registration-accuracy": act.evaluate_registration
                }
 
-    action_args = {"movies": (args.movies,)}
+    action_args = {"preprocess": (args.skip,),
+                   "movies": (args.movies,),
+                   "registration-accuracy": (args.timeperiod, args.fov)}
 
     # Now run whatever methods are needed
     if not args.action:
         # The user didn't specify a specific action, so we'll do the standard set of actions
         for activity in first_activities:
             if activity not in args.skip:
-                actions[activity]()
+                actions[activity](*action_args.get(activity, ()))
 
         # movies get special treatment since they're almost always needed but take a very long time to produce
         if args.movies:
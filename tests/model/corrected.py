@@ -0,0 +1,60 @@
+import unittest
+from fylm.model.corrected import CorrectedStack, CorrectedStackSet
+
+
+class MockExperiment(object):
+    def __init__(self):
+        self.data_dir = "/tmp/"
+        self.time_periods = [1, 2]
+        self.field_of_view_count = 2
+
+
+class CorrectedStackSetTests(unittest.TestCase):
+    def setUp(self):
+        self.stack_set = CorrectedStackSet(MockExperiment())
+
+    def test_ignores_stack_files(self):
+        self.stack_set.add_existing_data_file("tp1-fov0.txt")
+        self.stack_set.add_existing_data_file("tp1-fov0-channel_-z0.npy")
+        self.assertEqual(len(list(self.stack_set.remaining)), 3)
+
+    def test_invalidate(self):
+        self.stack_set.add_existing_data_file("tp1-fov0.txt")
+        model = self.stack_set.existing[0]
+        self.stack_set.invalidate(model)
+        self.assertListEqual(self.stack_set.existing, [])
+        self.assertEqual(len(list(self.stack_set.remaining)), 4)
+
+
+class CorrectedStackTests(unittest.TestCase):
+    def setUp(self):
+        self.stack = CorrectedStack()
+        self.stack.base_path = "/tmp/corrected"
+        self.stack.time_period = 2
+        self.stack.field_of_view = 3
+
+    def test_stack_path(self):
+        self.assertEqual(self.stack.get_stack_path("GFP", 1), "/tmp/corrected/tp2-fov3-channel_GFP-z1.npy")
+
+    def test_has_image(self):
+        self.stack.add_stack("", 0)
+        self.stack.add_stack("GFP", 1, [1, 3])
+        self.assertTrue(self.stack.has_image("", 0, 1))
+        self.assertTrue(self.stack.has_image("GFP", 1, 2))
+        self.assertFalse(self.stack.has_image("GFP", 1, 3))
+        self.assertFalse(self.stack.has_image("dsRed", 1, 0))
+
+    def test_lines_and_load(self):
+        self.stack.fingerprint = "abc123"
+        self.stack.frame_count = 4
+        self.stack.shape = (10, 20)
+        self.stack.dtype = "float32"
+        self.stack.add_stack("", 0)
+        self.stack.add_stack("GFP", 1, [1, 3])
+        loaded = CorrectedStack()
+        loaded.load(list(self.stack.lines))
+        self.assertEqual(loaded.fingerprint, "abc123")
+        self.assertEqual(loaded.frame_count, 4)
+        self.assertTupleEqual(loaded.shape, (10, 20))
+        self.assertEqual(loaded.dtype, "float32")
+        self.assertListEqual(list(loaded.data), [("", 0, set()), ("GFP", 1, {1, 3})])
@@ -0,0 +1,12 @@
+from fylm.model.fft_wisdom import FFTWisdom
+import unittest
+
+
+class FFTWisdomTests(unittest.TestCase):
+    def test_round_trip(self):
+        wisdom = FFTWisdom()
+        wisdom.wisdom = ("(fftw-3.3.4 fftw_wisdom #x3c273403\n)\n", "(fftw-3.3.4 fftwf_wisdom\n)\n", "")
+        loaded = FFTWisdom()
+        loaded.load(list(wisdom.lines))
+        self.assertEqual(loaded.wisdom, wisdom.wisdom)
+        self.assertEqual(loaded.filename, "fftw-wisdom.txt")
@@ -0,0 +1,33 @@
+from fylm.model.hough import find_line_angles
+import numpy as np
+import unittest
+
+
+def make_skeleton(angle, shape=(512, 640), columns=(100, 115, 500, 515)):
+    """
+    Draws one pixel wide lines that are `angle` radians from vertical, like the sides of the central trench.
+
+    """
+    skeleton = np.zeros(shape, dtype=np.bool)
+    rows = np.arange(50, shape[0] - 50)
+    for column in columns:
+        skeleton[rows, np.round(column + (rows - shape[0] / 2.0) * np.tan(angle)).astype(int)] = True
+    return skeleton
+
+
+class FindLineAnglesTests(unittest.TestCase):
+    def test_matches_full_search(self):
+        for angle in (0.0, 0.0123, -0.031, 0.2):
+            skeleton = make_skeleton(angle)
+            self.assertEqual(sorted(find_line_angles(skeleton)), sorted(find_line_angles(skeleton, coarse_step=0.0)))
+
+    def test_finds_angle(self):
+        angles = find_line_angles(make_skeleton(0.0123))
+        self.assertAlmostEqual(np.mean(angles), -0.0123, delta=0.001)
+
+    def test_downsample(self):
+        skeleton = make_skeleton(-0.031)
+        self.assertAlmostEqual(np.mean(find_line_angles(skeleton, downsample=2)), 0.031, delta=0.002)
+
+    def test_no_lines(self):
+        self.assertEqual(find_line_angles(np.zeros((64, 64), dtype=np.bool)), [])
@@ -0,0 +1,275 @@
+import numpy as np
+import unittest
+from scipy import ndimage
+from skimage import transform
+from fylm.model.correction import CorrectiveTransform, RotationMap, CorrectionTable
+from fylm.model.corrected import CorrectedStack
+from fylm.model.image import Image, ImageSet, StoredImageSet
+from fylm.model.image_slice import ImageSlice
+from fylm.service.cache import FrameCache
+
+
+class CorrectiveTransformTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.raw = (ndimage.gaussian_filter(random.rand(120, 160), 2) * 65535).astype(np.uint16)
+
+    def _two_step(self, rotation_offset, dx, dy):
+        image = transform.warp(self.raw, transform.AffineTransform(translation=(-dx, -dy)))
+        return transform.rotate(image, rotation_offset)
+
+    @staticmethod
+    def _interior(image_data, margin=6):
+        return image_data[margin:-margin, margin:-margin]
+
+    def test_matrix_identity(self):
+        matrix = CorrectiveTransform(0.0, 0.0, 0.0).matrix((120, 160))
+        self.assertTrue(np.allclose(matrix, np.identity(3)))
+
+    def test_matrix_translation(self):
+        matrix = CorrectiveTransform(0.0, 2.5, -1.5).matrix((120, 160))
+        self.assertTrue(np.allclose(matrix[:2, 2], [-2.5, 1.5]))
+
+    def test_matrix_rotates_about_center(self):
+        matrix = CorrectiveTransform(3.0, 0.0, 0.0).matrix((120, 160))
+        center = np.array([79.5, 59.5, 1.0])
+        self.assertTrue(np.allclose(matrix.dot(center), center))
+
+    def test_whole_pixel_offsets_match_two_step(self):
+        fused = CorrectiveTransform(0.4, 2.0, -3.0).apply(self.raw)
+        self.assertTrue(np.allclose(self._interior(fused), self._interior(self._two_step(0.4, 2.0, -3.0))))
+
+    def test_subpixel_offsets_within_tolerance(self):
+        fused = CorrectiveTransform(1.2, 1.37, -2.61).apply(self.raw)
+        two_step = self._two_step(1.2, 1.37, -2.61)
+        difference = np.abs(self._interior(fused) - self._interior(two_step))
+        self.assertLess(difference.max(), 0.02 * np.ptp(two_step))
+
+    def test_image_data(self):
+        image = Image(self.raw, 0.7, -1.25, 0.5, 12.0)
+        self.assertTrue(np.allclose(image.data, CorrectiveTransform(0.7, -1.25, 0.5).apply(self.raw)))
+        self.assertEqual(image.data.shape, self.raw.shape)
+
+
+class RotationMapTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(7)
+        self.raw = (random.rand(40, 60) * 65535).astype(np.uint16)
+
+    def test_raw_coordinates(self):
+        matrix = CorrectiveTransform(1.5, 2.0, -0.5).matrix((40, 60))
+        raw_rows, raw_columns = RotationMap(1.5).raw_coordinates((40, 60), np.array([3, 20]), np.array([7, 51]), 2.0, -0.5)
+        for row, column, raw_row, raw_column in zip((3, 20), (7, 51), raw_rows, raw_columns):
+            raw_x, raw_y, _ = matrix.dot([column, row, 1.0])
+            self.assertAlmostEqual(raw_row, raw_y)
+            self.assertAlmostEqual(raw_column, raw_x)
+
+    def test_identity(self):
+        corrected = RotationMap(0.0).correct(self.raw, 0.0, 0.0)
+        self.assertTrue(np.allclose(corrected, self.raw / 65535.0))
+
+    def test_matches_fused_transform(self):
+        rotation_map = RotationMap(1.2)
+        for dx, dy in ((2.0, -3.0), (1.37, -2.61), (-0.4, 0.8)):
+            expected = CorrectiveTransform(1.2, dx, dy).apply(self.raw)
+            corrected = rotation_map.correct(self.raw, dx, dy)
+            self.assertTrue(np.allclose(corrected, expected))
+
+    def test_image_uses_rotation_map(self):
+        rotation_map = RotationMap(0.8)
+        image = Image(self.raw, 0.8, 1.5, -0.5, 12.0, rotation_map)
+        self.assertTrue(np.allclose(image.data, rotation_map.correct(self.raw, 1.5, -0.5)))
+
+    def test_correct_region_matches_full_correction(self):
+        rotation_map = RotationMap(1.2)
+        corrected = rotation_map.correct_region(self.raw, 1.37, -2.61, (0, 40, 0, 60))
+        # only the edge of the area that comes from inside the raw image is blended differently by correct()
+        interior = rotation_map.correct(self.raw, 1.37, -2.61)[6:-6, 6:-6]
+        self.assertTrue(np.allclose(corrected[6:-6, 6:-6], interior))
+        for bounds in ((5, 15, 10, 30), (30, 40, 50, 60), (0, 3, 0, 4)):
+            top, bottom, left, right = bounds
+            region = rotation_map.correct_region(self.raw, 1.37, -2.61, bounds)
+            self.assertTrue(np.allclose(region, corrected[top:bottom, left:right]))
+
+    def test_correct_region_outside_raw_image(self):
+        region = RotationMap(0.0).correct_region(self.raw, 100.0, 0.0, (0, 10, 0, 20))
+        self.assertTupleEqual(region.shape, (10, 20))
+        self.assertFalse(region.any())
+
+    def test_sample_matches_full_correction(self):
+        rows, columns = np.mgrid[0:40:3, 0:60:7]
+        for rotation_offset, dx, dy in ((1.2, 1.37, -2.61), (0.0, 3.0, -2.0), (0.0, 70.0, 0.0), (0.0, 0.0, 0.0)):
+            rotation_map = RotationMap(rotation_offset)
+            corrected = rotation_map.correct_region(self.raw, dx, dy, (0, 40, 0, 60))
+            samples = rotation_map.sample(self.raw, dx, dy, rows, columns)
+            self.assertTupleEqual(samples.shape, rows.shape)
+            self.assertTrue(np.allclose(samples, corrected[rows, columns]))
+
+    def test_dtype(self):
+        rotation_map = RotationMap(1.2, np.float32)
+        expected = RotationMap(1.2).correct(self.raw, 1.37, -2.61)
+        corrected = rotation_map.correct(self.raw, 1.37, -2.61)
+        self.assertEqual(corrected.dtype, np.float32)
+        self.assertTrue(np.allclose(corrected, expected, atol=1e-6))
+        self.assertEqual(rotation_map.correct_region(self.raw, 1.37, -2.61, (0, 10, 0, 20)).dtype, np.float32)
+
+    def test_whole_pixel_shift_matches_interpolation(self):
+        # a negative tolerance makes every frame go through interpolation
+        interpolating_map = RotationMap(0.0, tolerance=-1.0)
+        rotation_map = RotationMap(0.0)
+        for dx, dy in ((0.0, 0.0), (3.0, -2.0), (70.0, 0.0)):
+            expected = interpolating_map.correct(self.raw, dx, dy)
+            self.assertTrue(np.allclose(rotation_map.correct(self.raw, dx, dy), expected))
+            for bounds in ((5, 15, 10, 30), (0, 40, 0, 60), (30, 40, 50, 60)):
+                top, bottom, left, right = bounds
+                region = rotation_map.correct_region(self.raw, dx, dy, bounds)
+                self.assertTrue(np.allclose(region, expected[top:bottom, left:right]))
+        # Within the tolerance of a whole pixel, only the edge that interpolation would have blacked out differs
+        expected = interpolating_map.correct(self.raw, -1.0, 0.004)
+        corrected = rotation_map.correct(self.raw, -1.0, 0.004)
+        self.assertTrue(np.allclose(corrected[1:], expected[1:], atol=0.01))
+
+    def test_count_frame(self):
+        rotation_map = RotationMap(0.0)
+        for dx, dy in ((0.0, 0.0), (3.0, -2.0), (70.0, 0.0), (-1.0, 0.004), (1.37, -2.61)):
+            rotation_map.count_frame((40, 60), dx, dy)
+        self.assertEqual(rotation_map.path_counts[RotationMap.UNCHANGED], 1)
+        self.assertEqual(rotation_map.path_counts[RotationMap.SHIFTED], 3)
+        self.assertEqual(rotation_map.path_counts[RotationMap.INTERPOLATED], 1)
+
+    def test_get_whole_pixel_shift(self):
+        self.assertTupleEqual(RotationMap(0.0).get_whole_pixel_shift((40, 60), 2.004, -3.0), (2, -3))
+        self.assertIsNone(RotationMap(0.0).get_whole_pixel_shift((40, 60), 2.5, -3.0))
+        self.assertIsNone(RotationMap(0.5).get_whole_pixel_shift((40, 60), 2.0, -3.0))
+        self.assertTupleEqual(RotationMap(1e-5).get_whole_pixel_shift((40, 60), 0.0, 0.0), (0, 0))
+
+
+class MockNd2Image(object):
+    def __init__(self, data, channel, z_level):
+        self.data = data
+        self.channel = channel
+        self.z_level = z_level
+
+
+class ImageSetTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(3)
+        self.raw = (random.rand(40, 60) * 65535).astype(np.uint16)
+        nd2_image_set = [MockNd2Image(self.raw, "", 0), MockNd2Image(self.raw[::-1], "GFP", 1)]
+        self.image_set = ImageSet(nd2_image_set, 0.9, (1.25, -0.5), 3, 120.0)
+
+    def test_get_image_slices(self):
+        image_slices = [ImageSlice(5, 10, 20, 4), ImageSlice(30, 20, 25, 5, fliplr=True)]
+        self.assertTrue(self.image_set.get_image_slices(image_slices, channel="GFP", z_level=1, y_margin=2))
+        full_image = self.image_set.get_image(channel="GFP", z_level=1)
+        for image_slice in image_slices:
+            expected = ImageSlice(image_slice.top_left_coordinates.x, image_slice.top_left_coordinates.y,
+                                  image_slice.width, image_slice.height, image_slice.fliplr)
+            expected.set_image(full_image, y_margin=2)
+            self.assertTrue(np.allclose(image_slice.image_data, expected.image_data))
+
+    def test_get_image_regions(self):
+        regions = [(10, 13, 5, 25), (22, 25, 30, 55)]
+        out = np.zeros(self.raw.shape)
+        image_data = self.image_set.get_image_regions(regions, out, channel="GFP", z_level=1)
+        self.assertIs(image_data, out)
+        full_image = self.image_set.get_image(channel="GFP", z_level=1)
+        for top, bottom, left, right in regions:
+            self.assertTrue(np.allclose(out[top:bottom, left:right], full_image[top:bottom, left:right]))
+        self.assertIsNone(self.image_set.get_image_regions(regions, out, channel="dsRed", z_level=1))
+
+    def test_get_samples(self):
+        rows, columns = np.mgrid[10:13, 5:25]
+        full_image = self.image_set.get_image(channel="GFP", z_level=1)
+        samples = self.image_set.get_samples(rows, columns, channel="GFP", z_level=1)
+        self.assertTrue(np.allclose(samples, full_image[rows, columns]))
+        self.assertIsNone(self.image_set.get_samples(rows, columns, channel="dsRed", z_level=1))
+
+    def test_counts_image_set_once(self):
+        rotation_map = RotationMap(0.9)
+        nd2_image_set = [MockNd2Image(self.raw, "", 0), MockNd2Image(self.raw[::-1], "GFP", 1)]
+        image_set = ImageSet(nd2_image_set, 0.9, (1.25, -0.5), 3, 120.0, rotation_map)
+        image_set.get_image_slices([ImageSlice(5, 10, 20, 4), ImageSlice(30, 20, 25, 5)], channel="GFP", z_level=1)
+        image_set.get_image_regions([(10, 13, 5, 25), (22, 25, 30, 55)], np.zeros(self.raw.shape), channel="",
+                                    z_level=0)
+        image_set.get_samples(*np.mgrid[10:13, 5:25], channel="GFP", z_level=1)
+        image_set.get_image(channel="", z_level=0)
+        list(image_set)
+        self.assertEqual(sum(rotation_map.path_counts.values()), 1)
+        self.assertEqual(rotation_map.path_counts[RotationMap.INTERPOLATED], 1)
+        ImageSet(nd2_image_set, 0.9, (1.25, -0.5), 4, 122.0, rotation_map).get_image(channel="", z_level=0)
+        self.assertEqual(rotation_map.path_counts[RotationMap.INTERPOLATED], 2)
+
+    def test_get_image_slices_missing_channel(self):
+        self.assertFalse(self.image_set.get_image_slices([ImageSlice(5, 10, 20, 4)], channel="dsRed", z_level=1))
+
+    def test_get_image_uses_frame_cache(self):
+        frame_cache = FrameCache(1048576)
+        nd2_image_set = [MockNd2Image(self.raw, "", 0)]
+        image_set = ImageSet(nd2_image_set, 0.9, (1.25, -0.5), 3, 120.0, frame_cache=frame_cache, cache_key=(2, 4))
+        image_data = image_set.get_image(channel="", z_level=0)
+        self.assertIsNotNone(frame_cache.get(FrameCache.key(2, 4, 3, "", 0, 0.9, 1.25, -0.5, np.float64)))
+        # the raw data is gone, so the second request has to come from the cache
+        nd2_image_set.pop()
+        self.assertIs(image_set.get_image(channel="", z_level=0), image_data)
+        image_slice = ImageSlice(5, 10, 20, 4)
+        self.assertTrue(image_set.get_image_slices([image_slice], channel="", z_level=0))
+        self.assertTrue(np.allclose(image_slice.image_data, image_data[10:18, 5:25]))
+
+    def test_frame_cache_checks_offsets(self):
+        frame_cache = FrameCache(1048576)
+        nd2_image_set = [MockNd2Image(self.raw, "", 0)]
+        ImageSet(nd2_image_set, 0.9, (1.25, -0.5), 3, 120.0, frame_cache=frame_cache, cache_key=(2, 4)).get_image("", 0)
+        # the registration offsets were recalculated, so the cached image is out of date
+        image_set = ImageSet(nd2_image_set, 0.9, (1.0, -0.5), 3, 120.0, frame_cache=frame_cache, cache_key=(2, 4))
+        self.assertTrue(np.allclose(image_set.get_image("", 0), RotationMap(0.9).correct(self.raw, 1.0, -0.5)))
+        self.assertEqual(frame_cache.hits, 0)
+
+
+class StoredImageSetTests(unittest.TestCase):
+    def setUp(self):
+        self.stacks = {("", 0): np.arange(3 * 40 * 60, dtype=np.float32).reshape((3, 40, 60)),
+                       ("GFP", 1): np.ones((3, 40, 60), dtype=np.float32)}
+        self.stack_model = CorrectedStack()
+        self.stack_model.add_stack("", 0)
+        self.stack_model.add_stack("GFP", 1, [0, 2])
+
+    def test_get_image(self):
+        image_set = StoredImageSet(self.stacks, self.stack_model, 1, 120.0)
+        image_data = image_set.get_image(channel="", z_level=0)
+        self.assertTrue((image_data == self.stacks[("", 0)][1]).all())
+        self.assertIsNotNone(image_set.get_image(channel="GFP", z_level=1))
+        self.assertIsNone(image_set.get_image(channel="dsRed", z_level=1))
+
+    def test_missing_image(self):
+        image_set = StoredImageSet(self.stacks, self.stack_model, 2, 240.0)
+        self.assertIsNone(image_set.get_image(channel="GFP", z_level=1))
+        self.assertFalse(image_set.get_image_slices([ImageSlice(5, 10, 20, 4)], channel="GFP", z_level=1))
+        self.assertEqual(len(list(image_set)), 1)
+
+    def test_get_image_slices(self):
+        image_set = StoredImageSet(self.stacks, self.stack_model, 1, 120.0)
+        image_slice = ImageSlice(5, 10, 20, 4)
+        self.assertTrue(image_set.get_image_slices([image_slice], channel="", z_level=0))
+        self.assertTrue((image_slice.image_data == self.stacks[("", 0)][1, 10:18, 5:25]).all())
+
+
+class CorrectionTableTests(unittest.TestCase):
+    def setUp(self):
+        self.table = CorrectionTable([(0.5, -0.25), (1.0, -0.5), (1.5, -0.75)], [2.5, 123.4, 244.1])
+
+    def test_len(self):
+        self.assertEqual(len(self.table), 3)
+
+    def test_get_offset(self):
+        self.assertTupleEqual(self.table.get_offset(0), (0.5, -0.25))
+        self.assertTupleEqual(self.table.get_offset(2), (1.5, -0.75))
+
+    def test_get_timestamp(self):
+        self.assertEqual(self.table.get_timestamp(1), 123.4)
+
+    def test_empty(self):
+        table = CorrectionTable([], [])
+        self.assertEqual(len(table), 0)
+        with self.assertRaises(IndexError):
+            table.get_offset(0)
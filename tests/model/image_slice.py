@@ -0,0 +1,30 @@
+import numpy as np
+import unittest
+from fylm.model.image_slice import ImageSlice
+
+
+class ImageSliceTests(unittest.TestCase):
+    def setUp(self):
+        self.image = np.arange(40 * 60).reshape((40, 60))
+
+    def test_get_bounds(self):
+        image_slice = ImageSlice(10.0, 12.0, 20.0, 4.0)
+        self.assertTupleEqual(image_slice.get_bounds(self.image.shape), (12, 20, 10, 30))
+
+    def test_get_bounds_margin(self):
+        image_slice = ImageSlice(10.0, 12.0, 20.0, 4.0)
+        self.assertTupleEqual(image_slice.get_bounds(self.image.shape, y_margin=2), (10, 26, 10, 30))
+
+    def test_get_bounds_clipped(self):
+        image_slice = ImageSlice(50.0, 35.0, 20.0, 4.0)
+        self.assertTupleEqual(image_slice.get_bounds(self.image.shape), (35, 40, 50, 60))
+
+    def test_set_image(self):
+        image_slice = ImageSlice(10, 12, 20, 4, fliplr=True)
+        image_slice.set_image(self.image)
+        self.assertTrue((image_slice.image_data == np.fliplr(self.image[12:20, 10:30])).all())
+
+    def test_set_image_data(self):
+        image_slice = ImageSlice(10, 12, 20, 4, fliplr=True)
+        image_slice.set_image_data(self.image[12:20, 10:30])
+        self.assertTrue((image_slice.image_data == np.fliplr(self.image[12:20, 10:30])).all())
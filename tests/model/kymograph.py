@@ -0,0 +1,110 @@
+import numpy as np
+import unittest
+from fylm.model.coordinates import Coordinates
+from fylm.model.correction import RotationMap
+from fylm.model.kymograph import Kymograph, KymographExtractor
+
+
+class KymographExtractorTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(5)
+        self.images = random.rand(4, 80, 120)
+        self.kymographs = []
+        # a channel pointing right, one pointing left, one with an odd height and one at the edge of the image
+        for channel_number, (notch, tube) in enumerate(((Coordinates(10, 30), Coordinates(40, 20)),
+                                                        (Coordinates(90, 50), Coordinates(55, 42)),
+                                                        (Coordinates(20, 71), Coordinates(45, 64)),
+                                                        (Coordinates(100, 12), Coordinates(120, 2)))):
+            kymograph = Kymograph()
+            kymograph.channel_number = channel_number
+            kymograph.set_location(notch, tube)
+            self.kymographs.append(kymograph)
+
+    def expected_lines(self, kymograph):
+        expected = np.zeros((len(self.images), int(kymograph.width)))
+        kymograph.allocate_memory(len(self.images))
+        for time_index, image in enumerate(self.images):
+            kymograph.set_image(image)
+            kymograph.add_line(time_index)
+        expected[:] = kymograph.data
+        kymograph.free_memory()
+        return expected
+
+    def test_matches_image_slices(self):
+        expected = [self.expected_lines(kymograph) for kymograph in self.kymographs]
+        extractor = KymographExtractor(self.kymographs, self.images[0].shape)
+        extractor.allocate_memory(len(self.images))
+        for time_index, image in enumerate(self.images):
+            extractor.add_lines(time_index, image)
+        for kymograph, lines in zip(self.kymographs, expected):
+            self.assertTrue(np.allclose(kymograph.data, lines))
+
+    def test_only_needs_regions(self):
+        expected = [self.expected_lines(kymograph) for kymograph in self.kymographs]
+        extractor = KymographExtractor(self.kymographs, self.images[0].shape)
+        extractor.allocate_memory(len(self.images))
+        image = np.zeros(self.images[0].shape)
+        for top, bottom, left, right in extractor.regions:
+            self.assertEqual(bottom - top, 3)
+            image[top:bottom, left:right] = self.images[0][top:bottom, left:right]
+        extractor.add_lines(0, image)
+        for kymograph, lines in zip(self.kymographs, expected):
+            self.assertTrue(np.allclose(kymograph.data[0], lines[0]))
+
+    def test_add_samples(self):
+        expected = [self.expected_lines(kymograph) for kymograph in self.kymographs]
+        extractor = KymographExtractor(self.kymographs, self.images[0].shape)
+        extractor.allocate_memory(len(self.images))
+        self.assertTupleEqual(extractor.rows.shape, extractor.columns.shape)
+        for time_index, image in enumerate(self.images):
+            extractor.add_samples(time_index, image[extractor.rows, extractor.columns])
+        for kymograph, lines in zip(self.kymographs, expected):
+            self.assertTrue(np.allclose(kymograph.data, lines))
+
+    def test_sampling_raw_images_matches_correction(self):
+        rotation_map = RotationMap(0.7)
+        offsets = ((1.37, -2.61), (0.0, 0.0), (-0.5, 3.25), (2.0, 1.0))
+        corrected = [rotation_map.correct_region(image, dx, dy, (0, 80, 0, 120))
+                     for image, (dx, dy) in zip(self.images, offsets)]
+        extractor = KymographExtractor(self.kymographs, self.images[0].shape)
+        extractor.allocate_memory(len(self.images))
+        for time_index, (image, (dx, dy)) in enumerate(zip(self.images, offsets)):
+            extractor.add_samples(time_index, rotation_map.sample(image, dx, dy, extractor.rows, extractor.columns))
+        sampled = [kymograph.data.copy() for kymograph in self.kymographs]
+        for time_index, image in enumerate(corrected):
+            extractor.add_lines(time_index, image)
+        for kymograph, lines in zip(self.kymographs, sampled):
+            self.assertTrue(np.allclose(kymograph.data, lines))
+
+    def test_allocate_memory(self):
+        extractor = KymographExtractor(self.kymographs, self.images[0].shape)
+        allocated_bytes = extractor.allocate_memory(10, np.float32)
+        self.assertEqual(allocated_bytes, 10 * sum(int(kymograph.width) for kymograph in self.kymographs) * 4)
+        for kymograph in self.kymographs:
+            self.assertEqual(kymograph.data.shape, (10, int(kymograph.width)))
+            self.assertEqual(kymograph.data.dtype, np.float32)
+
+    def test_fractional_coordinates(self):
+        kymographs = []
+        for channel_number, (notch, tube) in enumerate(((Coordinates(14.5, 30.0), Coordinates(20.1, 20.0)),
+                                                        (Coordinates(40.2, 50.0), Coordinates(30.9, 42.0)))):
+            kymograph = Kymograph()
+            kymograph.channel_number = channel_number
+            kymograph.set_location(notch, tube)
+            kymographs.append(kymograph)
+        extractor = KymographExtractor(kymographs, self.images[0].shape)
+        extractor.allocate_memory(len(self.images))
+        for time_index, image in enumerate(self.images):
+            extractor.add_lines(time_index, image)
+        for kymograph in kymographs:
+            top, bottom, left, right = kymograph.image_slice.get_bounds(self.images[0].shape)
+            self.assertEqual(kymograph.data.shape, (len(self.images), right - left))
+            for time_index, image in enumerate(self.images):
+                kymograph.image_slice.set_image(image)
+                self.assertTrue(np.allclose(kymograph.data[time_index], kymograph.image_slice.average_around_center))
+
+    def test_no_kymographs(self):
+        extractor = KymographExtractor([], (80, 120))
+        extractor.allocate_memory(2)
+        extractor.add_lines(0, self.images[0])
+        self.assertEqual(extractor.regions, [])
@@ -69,4 +69,9 @@ class LocationModelTests(unittest.TestCase):
         location_data = [(channel_number, location[0].x, location[0].y, location[1].x, location[1].y) for channel_number, location in data]
         self.assertTupleEqual(location_data[0], (1, 14.666, 17.888, 19.999, 10.000))
         self.assertTupleEqual(location_data[1], (2, 24.666, 27.888, 29.999, 20.000))
-        self.assertTupleEqual(location_data[2], (4, 4.666, 7.888, 9.999, 0.000))
\ No newline at end of file
+        self.assertTupleEqual(location_data[2], (4, 4.666, 7.888, 9.999, 0.000))
+
+    def test_channel_bounds(self):
+        data = ["3.444 7.888 9.888 24.222", "1 skipped", "2 40.0 20.0 8.0 12.0", "3 50.0 40.0 90.0 30.0"]
+        self.location.load(data)
+        self.assertEqual(list(self.location.channel_bounds), [(8.0, 12.0, 40.0, 20.0), (50.0, 30.0, 90.0, 40.0)])
@@ -0,0 +1,55 @@
+from fylm.model.nd2_index import Nd2Index
+import unittest
+
+
+class Nd2IndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = Nd2Index()
+        self.index.nd2_filename = "/data/FYLM-141111-001.nd2"
+        self.index.nd2_size = 123456
+        self.index.nd2_mtime = 1415723456.25
+        self.index.start_unix_timestamp = 1415700000.0
+        self.index.field_of_view_count = 2
+        self.index.time_index_count = 2
+        self.index.z_level_count = 3
+        self.index.channel_names = ["", "GFP"]
+        self.index.height = 4
+        self.index.width = 5
+        # two channels in every image group except the last, which only has bright field
+        self.index.image_groups = [(1000 * n, 8 + 4 * 5 * 2 * 2) for n in range(11)] + [(11000, 8 + 4 * 5 * 2)]
+
+    def test_filename(self):
+        self.assertEqual(self.index.filename, "FYLM-141111-001.txt")
+
+    def test_round_trip(self):
+        index = Nd2Index()
+        index.load(list(self.index.lines))
+        self.assertEqual(index.nd2_size, 123456)
+        self.assertEqual(index.nd2_mtime, 1415723456.25)
+        self.assertEqual(index.channel_names, ["", "GFP"])
+        self.assertEqual(index.image_groups, self.index.image_groups)
+        self.assertTrue(index.is_current(123456, 1415723456.25))
+        self.assertFalse(index.is_current(123457, 1415723456.25))
+        self.assertFalse(index.is_current(123456, 1415723457.0))
+
+    def test_get_image_group_number(self):
+        self.assertEqual(self.index.get_image_group_number(0, 0, 0), 0)
+        self.assertEqual(self.index.get_image_group_number(0, 1, 2), 5)
+        self.assertEqual(self.index.get_image_group_number(1, 0, 1), 7)
+
+    def test_get_frame_offset(self):
+        self.assertTupleEqual(self.index.get_frame_offset(1, 0, "", 1), (7008, 4))
+        self.assertTupleEqual(self.index.get_frame_offset(1, 0, "GFP", 1), (7010, 4))
+
+    def test_get_frame_offset_missing(self):
+        self.assertIsNone(self.index.get_frame_offset(2, 0, "", 0))
+        self.assertIsNone(self.index.get_frame_offset(0, 0, "RFP", 0))
+        self.assertIsNone(self.index.get_frame_offset(1, 1, "GFP", 2))
+        self.assertTupleEqual(self.index.get_frame_offset(1, 1, "", 2), (11008, 2))
+        self.index.image_groups[3] = None
+        self.assertIsNone(self.index.get_frame_offset(0, 1, "", 0))
+
+    def test_has_fluorescent_channels(self):
+        self.assertTrue(self.index.has_fluorescent_channels)
+        self.index.channel_names = [""]
+        self.assertFalse(self.index.has_fluorescent_channels)
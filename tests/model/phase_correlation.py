@@ -0,0 +1,216 @@
+import unittest
+from fylm.model.phase_correlation import FFTWTransform, PhaseCorrelator, band_windows, evaluate_correlators, \
+    format_evaluation, location_windows, pyfftw
+from fylm.model.correction import CorrectiveTransform
+import numpy as np
+from scipy import fftpack, ndimage
+
+try:
+    from skimage.feature.phase_correlate import phase_correlate
+
+    def reference_shift(base_section, uncorrected_section, upsample_factor):
+        return phase_correlate(base_section, uncorrected_section, upsample_factor=upsample_factor)[:2]
+except ImportError:
+    # phase_correlate was released as register_translation
+    from skimage.feature import register_translation
+
+    def reference_shift(base_section, uncorrected_section, upsample_factor):
+        return register_translation(base_section, uncorrected_section, upsample_factor=upsample_factor)[0]
+
+
+def reference_offset(base_image, uncorrected_image, upsample_factor=20):
+    """
+    How registration offsets were found before PhaseCorrelator, one frame and one band at a time.
+
+    """
+    width = base_image.shape[1]
+    left_dy, left_dx = reference_shift(base_image[:, int(width * 0.1): int(width * 0.3)],
+                                       uncorrected_image[:, int(width * 0.1): int(width * 0.3)], upsample_factor)
+    right_dy, right_dx = reference_shift(base_image[:, int(width * 0.7): int(width * 0.9)],
+                                         uncorrected_image[:, int(width * 0.7): int(width * 0.9)], upsample_factor)
+    return (left_dx + right_dx) / 2.0, (left_dy + right_dy) / 2.0
+
+
+class PhaseCorrelatorTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(3)
+        self.base_image = ndimage.gaussian_filter(random.rand(100, 200) * 4000.0, 1.0)
+        self.images = np.array([ndimage.shift(self.base_image, (dy, dx), mode="wrap") + random.rand(100, 200) * 5.0
+                                for dx, dy in ((0.0, 0.0), (1.3, -0.45), (-2.0, 3.0), (0.7, 0.7), (1.3, -0.4))])
+        self.images = self.images.astype(np.uint16)
+
+    def test_band_windows(self):
+        self.assertEqual(band_windows((1024, 1280)), [(slice(None), slice(128, 384)), (slice(None), slice(896, 1152))])
+
+    def test_register_stack_matches_reference(self):
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        offsets = correlator.register_stack(self.images)
+        for image, offset in zip(self.images, offsets):
+            self.assertEqual(offset, reference_offset(self.base_image, image))
+
+    def test_register_images_in_batches(self):
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        expected = correlator.register_stack(self.images)
+        self.assertEqual(list(correlator.register_images(iter(self.images), batch_size=2)), expected)
+
+    def test_register_single_image(self):
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        self.assertEqual(correlator.register(self.images[1]), reference_offset(self.base_image, self.images[1]))
+
+    def test_finds_shift(self):
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        dx, dy = correlator.register(self.images[2])
+        self.assertAlmostEqual(dx, 2.0, delta=0.1)
+        self.assertAlmostEqual(dy, -3.0, delta=0.1)
+
+    def test_whole_pixel_only(self):
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape), upsample_factor=1)
+        self.assertEqual(correlator.register(self.images[2]), reference_offset(self.base_image, self.images[2], 1))
+
+    def test_coarse_to_fine(self):
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape), downsample=2)
+        for image in self.images:
+            expected_dx, expected_dy = reference_offset(self.base_image, image)
+            dx, dy = correlator.register(image)
+            self.assertAlmostEqual(dx, expected_dx, delta=0.25)
+            self.assertAlmostEqual(dy, expected_dy, delta=0.25)
+
+    def test_evaluate_correlators(self):
+        windows = band_windows(self.base_image.shape)
+        reference = PhaseCorrelator(self.base_image, windows)
+        candidates = [PhaseCorrelator(self.base_image, windows),
+                      PhaseCorrelator(self.base_image, windows, downsample=2)]
+        results = evaluate_correlators(self.images, reference, candidates)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(np.all(results[1][3] == 0.0))
+        self.assertEqual(len(results[2][3]), len(self.images))
+        self.assertEqual(len(list(format_evaluation(results))), 4)
+
+    def test_location_windows(self):
+        channel_bounds = [(100.0, 200.0, 300.0, 230.0), (110.0, 600.0, 290.0, 630.0), (900.0, 300.0, 1100.0, 330.0)]
+        windows = location_windows((1024, 1280), channel_bounds, margin=10)
+        self.assertEqual(len(windows), 2)
+        (left_rows, left_columns), (right_rows, right_columns) = windows
+        self.assertTrue(left_rows.start <= 190 and left_rows.stop >= 640)
+        self.assertTrue(left_columns.start <= 90 and left_columns.stop >= 310)
+        self.assertTrue(right_rows.start <= 290 and right_rows.stop >= 340)
+        self.assertTrue(right_columns.start <= 890 and right_columns.stop >= 1110)
+        for window in windows:
+            for axis in window:
+                length = axis.stop - axis.start
+                self.assertEqual(fftpack.next_fast_len(length), length)
+
+    def test_location_windows_rotated(self):
+        # a channel near the corner of the image moves by several pixels when the rotation is undone
+        windows = location_windows((1024, 1280), [(10.0, 10.0, 200.0, 40.0)], rotation_offset=2.0, margin=0)
+        rows, columns = windows[0]
+        matrix = CorrectiveTransform(2.0, 0.0, 0.0).matrix((1024, 1280))
+        for x, y in ((10.0, 10.0), (200.0, 10.0), (10.0, 40.0), (200.0, 40.0)):
+            raw_x, raw_y, _ = matrix.dot([x, y, 1.0])
+            self.assertTrue(columns.start <= max(0.0, raw_x) <= columns.stop)
+            self.assertTrue(rows.start <= max(0.0, raw_y) <= rows.stop)
+
+    def test_location_windows_stay_inside_image(self):
+        windows = location_windows((100, 200), [(0.0, 0.0, 60.0, 99.0)], margin=32)
+        rows, columns = windows[0]
+        self.assertTrue(rows.start >= 0 and rows.stop <= 100)
+        self.assertTrue(columns.start >= 0 and columns.stop <= 200)
+
+    def test_location_windows_without_channels(self):
+        self.assertEqual(location_windows((1024, 1280), []), [])
+
+    def test_register_with_location_windows(self):
+        windows = location_windows(self.base_image.shape, [(10.0, 20.0, 60.0, 70.0), (130.0, 20.0, 180.0, 70.0)])
+        dx, dy = PhaseCorrelator(self.base_image, windows).register(self.images[2])
+        self.assertAlmostEqual(dx, 2.0, delta=0.1)
+        self.assertAlmostEqual(dy, -3.0, delta=0.1)
+
+    def make_drifting_stack(self, count, jump_at=None):
+        random = np.random.RandomState(6)
+        offsets = np.array([(0.05 * i, -0.03 * i) for i in range(count)])
+        if jump_at is not None:
+            offsets[jump_at:] += (2.0, 1.0)
+        stack = np.array([ndimage.shift(self.base_image, (dy, dx), mode="wrap") + random.rand(100, 200) * 5.0
+                          for dx, dy in offsets])
+        return stack.astype(np.uint16)
+
+    def test_register_keyframes(self):
+        stack = self.make_drifting_stack(9)
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        requested = []
+
+        def get_image(index):
+            requested.append(index)
+            return stack[index]
+
+        offsets = correlator.register_keyframes(get_image, len(stack), 4, 0.5)
+        self.assertEqual(sorted(requested), [0, 4, 8])
+        self.assertEqual([interpolated for _, _, interpolated in offsets],
+                         [False, True, True, True, False, True, True, True, False])
+        exact = correlator.register_stack(stack)
+        for (dx, dy, _), (exact_dx, exact_dy) in zip(offsets, exact):
+            self.assertAlmostEqual(dx, exact_dx, delta=0.1)
+            self.assertAlmostEqual(dy, exact_dy, delta=0.1)
+        self.assertEqual(offsets[4][:2], exact[4])
+
+    def test_register_keyframes_refines_jumps(self):
+        stack = self.make_drifting_stack(9, jump_at=6)
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        offsets = correlator.register_keyframes(lambda index: stack[index], len(stack), 4, 0.5)
+        self.assertEqual([interpolated for _, _, interpolated in offsets],
+                         [False, True, True, True, False, False, False, False, False])
+        exact = correlator.register_stack(stack)
+        for index in range(4, 9):
+            self.assertEqual(offsets[index][:2], exact[index])
+
+    def test_register_keyframes_includes_last_frame(self):
+        stack = self.make_drifting_stack(6)
+        correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        offsets = correlator.register_keyframes(lambda index: stack[index], len(stack), 4, 0.5)
+        self.assertEqual([interpolated for _, _, interpolated in offsets], [False, True, True, True, False, False])
+
+
+@unittest.skipIf(pyfftw is None, "pyfftw isn't installed")
+class FFTWTransformTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(4)
+        self.base_image = ndimage.gaussian_filter(random.rand(100, 200) * 4000.0, 1.0)
+        self.images = np.array([ndimage.shift(self.base_image, (dy, dx), mode="wrap") + random.rand(100, 200) * 5.0
+                                for dx, dy in ((0.0, 0.0), (1.3, -0.45), (-2.0, 3.0))])
+        self.transform = FFTWTransform(threads=2, planner_effort="FFTW_ESTIMATE")
+
+    def test_padded_shape(self):
+        self.assertEqual(self.transform.padded_shape((16, 1024, 256)), (16, 1024, 256))
+        self.assertEqual(self.transform.padded_shape((3, 97, 131)), (3, 100, 135))
+
+    def test_matches_numpy(self):
+        numpy_correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape))
+        fftw_correlator = PhaseCorrelator(self.base_image, band_windows(self.base_image.shape),
+                                          transform=self.transform)
+        for expected, actual in zip(numpy_correlator.register_stack(self.images),
+                                    fftw_correlator.register_stack(self.images)):
+            self.assertAlmostEqual(expected[0], actual[0], places=6)
+            self.assertAlmostEqual(expected[1], actual[1], places=6)
+
+    def test_padded_sections(self):
+        base_image = self.base_image[:97, :]
+        correlator = PhaseCorrelator(base_image, [(slice(None), slice(23, 154))], transform=self.transform)
+        dx, dy = correlator.register(self.images[2][:97, :])
+        self.assertAlmostEqual(dx, 2.0, delta=0.1)
+        self.assertAlmostEqual(dy, -3.0, delta=0.1)
+
+    def test_wisdom(self):
+        self.transform.forward(self.images[:, :64, :64])
+        wisdom = self.transform.export_wisdom()
+        self.assertEqual(len(wisdom), 3)
+        self.transform.import_wisdom(wisdom)
+
+    def test_plans_are_shared_by_frame_counts(self):
+        transform = FFTWTransform(threads=2, planner_effort="FFTW_ESTIMATE", batch_size=2)
+        for frames in (1, 2, 3):
+            sections = self.images[:frames, :64, :64]
+            frequencies = transform.forward(sections)
+            self.assertEqual(frequencies.shape, (frames, 64, 64))
+            self.assertTrue(np.allclose(frequencies, np.fft.fftn(sections, axes=(-2, -1))))
+            self.assertTrue(np.allclose(transform.inverse(frequencies), sections))
+        self.assertEqual(len(transform._plans), 1)
@@ -45,4 +45,16 @@ class RegistrationTests(unittest.TestCase):
         self.assertDictEqual(self.r._offsets, expected)
         self.r.add(12.222, 12.222)
         expected = {1: (-2.222, 0.002), 2: (4.444, -3.222), 3: (8.888, 6.666), 4: (12.222, 12.222)}
-        self.assertDictEqual(self.r._offsets, expected)
\ No newline at end of file
+        self.assertDictEqual(self.r._offsets, expected)
+
+    def test_interpolated(self):
+        self.r.add(-2.222, 0.002)
+        self.r.add(-2.2000003, 0.0000004, interpolated=True)
+        self.r.add(8.888, 6.666)
+        self.assertEqual(self.r.interpolated, [2])
+        lines = list(self.r.lines)
+        self.assertListEqual(["1 -2.222 0.002", "2 -2.2 0.0 interpolated", "3 8.888 6.666"], lines)
+        registration = Registration()
+        registration.load(lines)
+        self.assertEqual(registration.interpolated, [2])
+        self.assertEqual(list(registration.data), [(-2.222, 0.002), (-2.2, 0.0), (8.888, 6.666)])
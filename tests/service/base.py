@@ -0,0 +1,109 @@
+from fylm.model.base import BaseTextFile
+from fylm.service.base import BaseSetService
+from fylm.service.utilities import FileInteractor
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class MockModel(BaseTextFile):
+    def __init__(self, base_path, time_period):
+        super(MockModel, self).__init__()
+        self.base_path = base_path
+        self.time_period = time_period
+        self.field_of_view = 0
+        self.value = None
+
+    def load(self, data):
+        self.value = data
+
+    @property
+    def data(self):
+        return self.value
+
+    @property
+    def lines(self):
+        yield "%s %s" % (self.value, os.getpid())
+        if self.value == "fail":
+            raise ValueError("interrupted while writing")
+
+
+class MockModelSet(object):
+    def __init__(self, models):
+        self.remaining = models
+
+
+class MockService(BaseSetService):
+    def __init__(self):
+        super(MockService, self).__init__()
+        self.jobs = None
+
+    def start_worker(self, jobs):
+        self.jobs = jobs
+
+    def save_action(self, model):
+        if model.time_period == 3:
+            return False
+        model.value = "tp%s %s" % (model.time_period, self.jobs)
+
+
+class BaseSetServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.models = [MockModel(self.directory, time_period) for time_period in range(1, 6)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, time_period):
+        with open(os.path.join(self.directory, "tp%s-fov0.txt" % time_period)) as f:
+            return f.read().split()
+
+    def test_save_text(self):
+        MockService().save_text(MockModelSet(self.models))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["tp1-fov0.txt", "tp2-fov0.txt", "tp4-fov0.txt", "tp5-fov0.txt"])
+        self.assertEqual(self.read(1), ["tp1", "None", str(os.getpid())])
+
+    def test_save_text_in_parallel(self):
+        MockService().save_text(MockModelSet(self.models), jobs=2)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["tp1-fov0.txt", "tp2-fov0.txt", "tp4-fov0.txt", "tp5-fov0.txt"])
+        for time_period in (1, 2, 4, 5):
+            label, jobs, pid = self.read(time_period)
+            self.assertEqual(label, "tp%s" % time_period)
+            self.assertEqual(jobs, "2")
+            self.assertNotEqual(pid, str(os.getpid()))
+
+
+class FileInteractorTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.model = MockModel(self.directory, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_text(self):
+        self.model.value = "done"
+        FileInteractor(self.model).write_text()
+        self.assertEqual(os.listdir(self.directory), ["tp1-fov0.txt"])
+
+    def test_interrupted_write_leaves_nothing(self):
+        self.model.value = "fail"
+        with self.assertRaises(ValueError):
+            FileInteractor(self.model).write_text()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_interrupted_write_keeps_old_file(self):
+        self.model.value = "done"
+        FileInteractor(self.model).write_text()
+        self.model.value = "fail"
+        with self.assertRaises(ValueError):
+            FileInteractor(self.model).write_text()
+        self.assertEqual(self.read(), "done")
+
+    def read(self):
+        with open(self.model.path) as f:
+            return f.read().split()[0]
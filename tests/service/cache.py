@@ -0,0 +1,68 @@
+import numpy as np
+import unittest
+from fylm.service.cache import FrameCache
+
+
+class FrameCacheTests(unittest.TestCase):
+    def setUp(self):
+        # room for exactly three 10x10 float64 images
+        self.cache = FrameCache(2400)
+
+    @staticmethod
+    def _image(value):
+        return np.zeros((10, 10)) + value
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get((1, 0, 0, "", 0)))
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_hit(self):
+        self.cache.put((1, 0, 0, "", 0), self._image(1))
+        image_data = self.cache.get((1, 0, 0, "", 0))
+        self.assertTrue((image_data == 1).all())
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_put_makes_read_only(self):
+        image_data = self.cache.put((1, 0, 0, "", 0), self._image(1))
+        self.assertFalse(image_data.flags.writeable)
+
+    def test_key(self):
+        key = FrameCache.key(1, 0, 5, "", 0, 0.5, 1, -2.0, "float32")
+        self.assertEqual(key, FrameCache.key(1, 0, 5, "", 0, 0.5, 1.0, -2.0, np.float32))
+        self.assertNotEqual(key, FrameCache.key(1, 0, 5, "", 0, 0.5, 1.0, -2.5, np.float32))
+        self.assertNotEqual(key, FrameCache.key(1, 0, 5, "", 0, 0.5, 1.0, -2.0, np.float64))
+
+    def test_evicts_least_recently_used(self):
+        for time_index in range(3):
+            self.cache.put((1, 0, time_index, "", 0), self._image(time_index))
+        # touch the oldest image so that the second one becomes the least recently used
+        self.cache.get((1, 0, 0, "", 0))
+        self.cache.put((1, 0, 3, "", 0), self._image(3))
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNone(self.cache.get((1, 0, 1, "", 0)))
+        self.assertIsNotNone(self.cache.get((1, 0, 0, "", 0)))
+        self.assertEqual(self.cache.size, 2400)
+
+    def test_replace(self):
+        self.cache.put((1, 0, 0, "", 0), self._image(1))
+        self.cache.put((1, 0, 0, "", 0), self._image(2))
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, 800)
+
+    def test_shrink_budget(self):
+        for time_index in range(3):
+            self.cache.put((1, 0, time_index, "", 0), self._image(time_index))
+        self.cache.max_bytes = 800
+        self.assertEqual(len(self.cache), 1)
+        self.assertIsNotNone(self.cache.get((1, 0, 2, "", 0)))
+
+    def test_disabled(self):
+        cache = FrameCache(0)
+        image_data = cache.put((1, 0, 0, "", 0), self._image(1))
+        # it isn't shared with anyone, so it can still be changed
+        self.assertTrue(image_data.flags.writeable)
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get((1, 0, 0, "", 0)))
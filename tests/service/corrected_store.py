@@ -0,0 +1,67 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+from fylm.model.corrected import CorrectedStack
+from fylm.service.corrected_store import CorrectedStore
+
+
+class MockExperiment(object):
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+
+
+class CorrectedStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        for subdir in ("corrected", "registration", "rotation"):
+            os.makedirs(self.data_dir + "/" + subdir)
+        self._write(self.data_dir + "/registration/tp1-fov0.txt", "1 0.5 -0.25\n2 0.75 -0.5\n")
+        self._write(self.data_dir + "/rotation/fov0.txt", "0.12\n")
+        self.store = CorrectedStore(MockExperiment(self.data_dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    @staticmethod
+    def _write(path, text):
+        with open(path, "w") as f:
+            f.write(text)
+
+    def _save_stack(self):
+        model = CorrectedStack()
+        model.base_path = self.data_dir + "/corrected"
+        model.time_period = 1
+        model.field_of_view = 0
+        model.fingerprint = self.store.fingerprint(1, 0)
+        model.frame_count = 2
+        model.shape = (4, 5)
+        model.dtype = "float32"
+        model.add_stack("", 0)
+        stack = np.lib.format.open_memmap(model.get_stack_path("", 0), mode="w+", dtype=np.float32, shape=(2, 4, 5))
+        stack[:] = 0.5
+        stack.flush()
+        self._write(model.path, "\n".join(model.lines))
+
+    def test_fingerprint_missing_files(self):
+        self.assertIsNone(self.store.fingerprint(2, 0))
+
+    def test_fingerprint_changes(self):
+        fingerprint = self.store.fingerprint(1, 0)
+        self._write(self.data_dir + "/rotation/fov0.txt", "0.13\n")
+        self.assertNotEqual(fingerprint, self.store.fingerprint(1, 0))
+
+    def test_get_model(self):
+        self.assertIsNone(self.store.get_model(1, 0))
+        self._save_stack()
+        model = self.store.get_model(1, 0)
+        self.assertEqual(model.frame_count, 2)
+        stacks = self.store.open_stacks(model)
+        self.assertIsInstance(stacks[("", 0)], np.memmap)
+        self.assertTrue((stacks[("", 0)][1] == 0.5).all())
+
+    def test_get_model_out_of_date(self):
+        self._save_stack()
+        self._write(self.data_dir + "/registration/tp1-fov0.txt", "1 0.5 -0.25\n2 0.8 -0.5\n")
+        self.assertIsNone(self.store.get_model(1, 0))
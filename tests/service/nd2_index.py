@@ -0,0 +1,198 @@
+from fylm.model.nd2_index import Nd2Index
+from fylm.service.nd2_index import Nd2IndexService, IndexedNd2, MappedNd2
+import numpy as np
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+
+def write_nd2(path, frames, timestamps):
+    """
+    Writes a minimal ND2 file with the same chunk layout as real ones: a chunk for each image group, followed by the
+    chunk map and a pointer to it.
+
+    :param frames:      uint16 array with shape (time index, field of view, z-level, channel, height, width)
+    :param timestamps:  the timestamp of each time index, in milliseconds
+    :returns:           list of the (offset, length) of each image group's data
+
+    """
+    time_index_count, field_of_view_count, z_level_count, channel_count, height, width = frames.shape
+    chunk_locations = []
+    image_groups = []
+    with open(path, "wb") as f:
+        f.write(_chunk("ND2 FILE SIGNATURE CHUNK NAME01!", "Ver3.0"))
+        chunk_locations.append(("ImageAttributesLV!", f.tell()))
+        f.write(_chunk("ImageAttributesLV!", "\x00" * 37))
+        image_group_number = 0
+        for time_index in range(time_index_count):
+            for field_of_view in range(field_of_view_count):
+                for z_level in range(z_level_count):
+                    name = "ImageDataSeq|%d!" % image_group_number
+                    # channels are interleaved pixel by pixel
+                    pixels = np.transpose(frames[time_index, field_of_view, z_level], (1, 2, 0)).astype("<u2")
+                    data = struct.pack("<d", timestamps[time_index]) + pixels.tostring()
+                    chunk_locations.append((name, f.tell()))
+                    image_groups.append((f.tell() + 16 + len(name), len(data)))
+                    f.write(_chunk(name, data))
+                    image_group_number += 1
+        chunk_map_location = f.tell()
+        f.write("ND2 FILEMAP SIGNATURE NAME 0001!")
+        for name, location in chunk_locations:
+            f.write(name + struct.pack("<QQ", location, 0))
+        f.write("ND2 CHUNK MAP SIGNATURE 0000001!" + struct.pack("<QQ", chunk_map_location, 0))
+        f.write(struct.pack("<Q", chunk_map_location))
+    return image_groups
+
+
+def _chunk(name, data):
+    return struct.pack("<IIQ", 0x0ABECEDA, len(name), len(data)) + name + data
+
+
+def make_index(path, frames):
+    time_index_count, field_of_view_count, z_level_count, channel_count, height, width = frames.shape
+    index = Nd2Index()
+    index.nd2_filename = path
+    index.field_of_view_count = field_of_view_count
+    index.time_index_count = time_index_count
+    index.z_level_count = z_level_count
+    index.channel_names = ["", "GFP", "RFP"][:channel_count]
+    index.height = height
+    index.width = width
+    index.image_groups = Nd2IndexService.read_image_groups(path)
+    return index
+
+
+class Nd2IndexServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "FYLM-141111-001.nd2")
+        random = np.random.RandomState(3)
+        self.frames = random.randint(1, 65535, size=(3, 2, 2, 2, 6, 7)).astype(np.uint16)
+        # the GFP image of the second time index wasn't taken
+        self.frames[1, :, :, 1] = 0
+        self.timestamps = [0.0, 2000.0, 4000.5]
+        self.image_groups = write_nd2(self.path, self.frames, self.timestamps)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_image_groups(self):
+        self.assertEqual(Nd2IndexService.read_image_groups(self.path), self.image_groups)
+        self.assertEqual(len(self.image_groups), 12)
+
+    def test_read_image_groups_of_malformed_nd2(self):
+        with open(self.path, "r+b") as f:
+            f.seek(-8, 2)
+            chunk_map_location = struct.unpack("<Q", f.read(8))[0]
+            # point past the signature of the chunk map
+            f.seek(-8, 2)
+            f.write(struct.pack("<Q", chunk_map_location + 1))
+        self.assertRaises(ValueError, Nd2IndexService.read_image_groups, self.path)
+        with open(self.path, "r+b") as f:
+            # cut the chunk map off in the location of its first chunk, so that even with the pointer after it, the
+            # entry is too short
+            f.truncate(chunk_map_location + len("ND2 FILEMAP SIGNATURE NAME 0001!ImageAttributesLV!") + 4)
+            f.seek(0, 2)
+            f.write(struct.pack("<Q", chunk_map_location))
+        self.assertRaises(ValueError, Nd2IndexService.read_image_groups, self.path)
+
+    def test_get_image(self):
+        nd2 = IndexedNd2(self.path, make_index(self.path, self.frames))
+        for time_index in range(3):
+            for field_of_view in range(2):
+                for z_level in range(2):
+                    image = nd2.get_image(time_index, field_of_view, "", z_level)
+                    self.assertTrue(np.array_equal(image.data, self.frames[time_index, field_of_view, z_level, 0]))
+                    self.assertEqual(image.timestamp, self.timestamps[time_index] / 1000.0)
+                    self.assertEqual(image.channel, "")
+                    self.assertEqual(image.z_level, z_level)
+        self.assertTrue(np.array_equal(nd2.get_image(2, 1, "GFP", 1).data, self.frames[2, 1, 1, 1]))
+        nd2.close()
+
+    def test_missing_images(self):
+        nd2 = IndexedNd2(self.path, make_index(self.path, self.frames))
+        self.assertIsNone(nd2.get_image(1, 0, "GFP", 0))
+        self.assertIsNone(nd2.get_image(3, 0, "", 0))
+        self.assertIsNone(nd2.get_image(0, 0, "RFP", 0))
+        nd2.close()
+
+    def test_image_sets(self):
+        nd2 = IndexedNd2(self.path, make_index(self.path, self.frames))
+        image_sets = list(nd2.image_sets(1))
+        self.assertEqual(len(image_sets), 3)
+        self.assertEqual(len(image_sets[0]), 4)
+        self.assertEqual(len(image_sets[1]), 2)
+        image_sets = list(nd2.image_sets(1, channels=[""], z_levels=[0]))
+        self.assertTrue(all(len(image_set) == 1 for image_set in image_sets))
+        self.assertTrue(np.array_equal(image_sets[2][0].data, self.frames[2, 1, 0, 0]))
+        nd2.close()
+
+    def test_read_timestamps(self):
+        index = make_index(self.path, self.frames)
+        # the last time index was cut short after the first field of view
+        index.image_groups[10] = None
+        nd2 = IndexedNd2(self.path, index)
+        self.assertEqual(nd2.read_timestamps(), {0: [0.0, 2.0, 4.0005], 1: [0.0, 2.0]})
+        nd2.close()
+
+    def test_read_timestamps_skips_missing_images(self):
+        nd2 = IndexedNd2(self.path, make_index(self.path, self.frames))
+        # the GFP image of the second time index is all zeros, like a frame that was never acquired
+        self.assertEqual(nd2.read_timestamps("GFP", 1), {0: [0.0, 4.0005], 1: [0.0, 4.0005]})
+        self.assertEqual(nd2.read_timestamps("RFP"), {0: [], 1: []})
+        for field_of_view, timestamps in nd2.read_timestamps("GFP", 0).items():
+            self.assertEqual(timestamps, [image_set[0].timestamp for image_set in
+                                          nd2.image_sets(field_of_view, channels=["GFP"], z_levels=[0]) if image_set])
+        nd2.close()
+
+
+class MappedNd2Tests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "FYLM-141111-001.nd2")
+        random = np.random.RandomState(5)
+        self.frames = random.randint(1, 65535, size=(2, 2, 3, 3, 8, 5)).astype(np.uint16)
+        self.frames[0, 1, 2, 2] = 0
+        # only the first row of this one is zero
+        self.frames[1, 0, 0, 0, 0] = 0
+        write_nd2(self.path, self.frames, [10.0, 2010.0])
+        index = make_index(self.path, self.frames)
+        self.mapped = MappedNd2(self.path, index)
+        self.indexed = IndexedNd2(self.path, index)
+
+    def tearDown(self):
+        self.mapped.close()
+        self.indexed.close()
+        shutil.rmtree(self.directory)
+
+    def test_matches_indexed_reader(self):
+        for time_index in range(2):
+            for field_of_view in range(2):
+                for channel_name in ("", "GFP", "RFP"):
+                    for z_level in range(3):
+                        mapped = self.mapped.get_image(time_index, field_of_view, channel_name, z_level)
+                        indexed = self.indexed.get_image(time_index, field_of_view, channel_name, z_level)
+                        if indexed is None:
+                            self.assertIsNone(mapped)
+                            continue
+                        self.assertTrue(np.array_equal(mapped.data, indexed.data))
+                        self.assertEqual(mapped.timestamp, indexed.timestamp)
+
+    def test_frames_are_views(self):
+        image = self.mapped.get_image(1, 0, "GFP", 2)
+        self.assertTrue(np.array_equal(image.data, self.frames[1, 0, 2, 1]))
+        self.assertFalse(image.data.flags.owndata)
+        self.assertFalse(image.data.flags.writeable)
+
+    def test_frames_outlive_close(self):
+        image = self.mapped.get_image(1, 1, "", 0)
+        self.mapped.close()
+        self.assertTrue(np.array_equal(image.data, self.frames[1, 1, 0, 0]))
+
+    def test_read_timestamps(self):
+        expected = {0: [0.01, 2.01], 1: [0.01, 2.01]}
+        self.assertEqual(self.indexed.read_timestamps(), expected)
+        self.assertEqual(self.mapped.read_timestamps(z_level=2), expected)
+        self.assertEqual(self.mapped.read_timestamps("RFP", 2), {0: [0.01, 2.01], 1: [2.01]})
@@ -0,0 +1,76 @@
+from fylm.service.nd2_pool import Nd2Pool
+import unittest
+
+
+class MockNd2(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Nd2PoolTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = Nd2Pool(2, MockNd2)
+
+    def test_reuses_handles(self):
+        nd2 = self.pool.acquire("a.nd2")
+        self.pool.release("a.nd2")
+        self.assertIs(self.pool.acquire("a.nd2"), nd2)
+        self.assertEqual(self.pool.opened, 1)
+        self.assertEqual(self.pool.reused, 1)
+
+    def test_closes_least_recently_used_idle_handles(self):
+        handles = {}
+        for filename in ("a.nd2", "b.nd2", "c.nd2"):
+            with self.pool.open(filename) as nd2:
+                handles[filename] = nd2
+        self.assertEqual(len(self.pool), 2)
+        self.assertTrue(handles["a.nd2"].closed)
+        self.assertFalse(handles["b.nd2"].closed)
+        self.assertFalse(handles["c.nd2"].closed)
+
+    def test_never_closes_handles_in_use(self):
+        handles = [self.pool.acquire(filename) for filename in ("a.nd2", "b.nd2", "c.nd2")]
+        self.assertEqual(len(self.pool), 3)
+        self.assertFalse(any(nd2.closed for nd2 in handles))
+        self.pool.release("a.nd2")
+        self.assertEqual(len(self.pool), 2)
+        self.assertTrue(handles[0].closed)
+
+    def test_reference_counting(self):
+        self.pool.max_open_files = 0
+        nd2 = self.pool.acquire("a.nd2")
+        self.pool.acquire("a.nd2")
+        self.pool.release("a.nd2")
+        self.assertFalse(nd2.closed)
+        self.pool.release("a.nd2")
+        self.assertTrue(nd2.closed)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_open_releases_on_error(self):
+        self.pool.max_open_files = 0
+        try:
+            with self.pool.open("a.nd2"):
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(len(self.pool), 0)
+
+    def test_clear(self):
+        idle = self.pool.acquire("a.nd2")
+        self.pool.release("a.nd2")
+        busy = self.pool.acquire("b.nd2")
+        self.pool.clear()
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_reset(self):
+        nd2 = self.pool.acquire("a.nd2")
+        self.pool.reset()
+        self.assertTrue(nd2.closed)
+        self.assertEqual(len(self.pool), 0)
+        self.assertIsNot(self.pool.acquire("a.nd2"), nd2)
@@ -0,0 +1,49 @@
+import threading
+import unittest
+from fylm.service.prefetch import Prefetcher
+
+
+class PrefetcherTests(unittest.TestCase):
+    def test_order(self):
+        self.assertListEqual(list(Prefetcher(xrange(50), 4)), range(50))
+
+    def test_disabled(self):
+        threads = []
+        items = list(Prefetcher(xrange(5), 0, lambda item: threads.append(threading.current_thread()) or item * 2))
+        self.assertListEqual(items, [0, 2, 4, 6, 8])
+        self.assertTrue(all(thread is threading.current_thread() for thread in threads))
+
+    def test_prepare_runs_on_worker(self):
+        threads = []
+        items = list(Prefetcher(xrange(5), 2, lambda item: threads.append(threading.current_thread()) or item * 2))
+        self.assertListEqual(items, [0, 2, 4, 6, 8])
+        self.assertTrue(all(thread is not threading.current_thread() for thread in threads))
+
+    def test_bounded(self):
+        produced = []
+
+        def produce():
+            for item in xrange(100):
+                produced.append(item)
+                yield item
+
+        prefetcher = iter(Prefetcher(produce(), 3))
+        next(prefetcher)
+        # the worker can hold at most three items in the queue plus one it's waiting to add
+        threading.Event().wait(0.3)
+        self.assertLessEqual(len(produced), 5)
+        prefetcher.close()
+
+    def test_stop_early(self):
+        for item in Prefetcher(xrange(1000), 2):
+            if item == 3:
+                break
+        self.assertEqual(item, 3)
+
+    def test_exception(self):
+        def produce():
+            yield 1
+            raise ValueError("bad ND2")
+
+        with self.assertRaises(ValueError):
+            list(Prefetcher(produce(), 2))
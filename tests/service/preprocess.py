@@ -0,0 +1,110 @@
+from fylm.model.constants import Constants
+from fylm.model.registration import Registration
+from fylm.model.rotation import Rotation
+from fylm.model.timestamp import Timestamps
+from fylm.service.nd2_index import IndexedNd2
+from fylm.service.nd2_pool import nd2_pool
+from fylm.service.preprocess import Preprocessor
+from tests.service.nd2_index import make_index, write_nd2
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class MockExperiment(object):
+    def __init__(self, directory, nd2_filename):
+        self.data_dir = directory
+        self.field_of_view_count = 2
+        self.time_periods = [1]
+        self.fft_backend = "numpy"
+        self.fft_threads = 1
+        self.registration_bands = Constants.REGISTRATION_BANDS
+        self.registration_upsample_factor = Constants.REGISTRATION_UPSAMPLE_FACTOR
+        self.registration_downsample = 1
+        self.registration_keyframe_interval = 1
+        self._nd2_filename = nd2_filename
+
+    def get_nd2_from_time_period(self, time_period):
+        return self._nd2_filename
+
+    @staticmethod
+    def exact_start_time(time_period):
+        return 100.0 * time_period
+
+
+class MockRotationService(object):
+    @staticmethod
+    def find_offset(image):
+        return image.mean()
+
+
+class RecordingNd2(IndexedNd2):
+    def __init__(self, nd2_filename, index):
+        super(RecordingNd2, self).__init__(nd2_filename, index)
+        self.requests = []
+
+    def get_image(self, time_index, field_of_view, channel_name, z_level):
+        self.requests.append((time_index, field_of_view, z_level))
+        return super(RecordingNd2, self).get_image(time_index, field_of_view, channel_name, z_level)
+
+
+class PreprocessorTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for subdirectory in ("location", "rotation"):
+            os.mkdir(os.path.join(self.directory, subdirectory))
+        self.path = os.path.join(self.directory, "FYLM-141111-001.nd2")
+        random = np.random.RandomState(7)
+        self.frames = random.randint(1, 65535, size=(5, 2, 2, 1, 32, 64)).astype(np.uint16)
+        write_nd2(self.path, self.frames, [1000.0 * time_index for time_index in range(5)])
+        self.nd2 = RecordingNd2(self.path, make_index(self.path, self.frames))
+        nd2_pool.reset()
+        nd2_pool.opener = lambda filename: self.nd2
+        self.preprocessor = Preprocessor(MockExperiment(self.directory, self.path))
+        self.preprocessor._rotation_service = MockRotationService()
+
+    def tearDown(self):
+        nd2_pool.reset()
+        shutil.rmtree(self.directory)
+
+    def make_model(self, model_class, field_of_view):
+        model = model_class()
+        model.time_period = 1
+        model.field_of_view = field_of_view
+        model.base_path = self.directory
+        return model
+
+    def test_sweep(self):
+        rotation = self.make_model(Rotation, 1)
+        timestamps = self.make_model(Timestamps, 0)
+        registrations = [self.make_model(Registration, field_of_view) for field_of_view in range(2)]
+        models = [("rotation", rotation), ("timestamp", timestamps)] + [("registration", registration)
+                                                                        for registration in registrations]
+        self.preprocessor.sweep(1, models)
+        self.assertEqual(rotation.offset, self.frames[0, 1, 1, 0].mean())
+        self.assertEqual(list(timestamps.data), [(index + 1, float(index)) for index in range(5)])
+        for field_of_view, registration in enumerate(registrations):
+            correlator = self.preprocessor._registration_service.get_correlator(field_of_view)
+            expected = correlator.register_stack(self.frames[:, field_of_view, 0, 0])
+            self.assertEqual(list(registration.data), expected)
+        for model in [rotation, timestamps] + registrations:
+            self.assertTrue(os.path.isfile(model.path))
+
+    def test_timestamps_without_images(self):
+        timestamps = [self.make_model(Timestamps, field_of_view) for field_of_view in range(2)]
+        self.preprocessor.sweep(1, [("timestamp", model) for model in timestamps])
+        self.assertEqual(self.nd2.requests, [])
+        for model in timestamps:
+            self.assertEqual(list(model.data), [(index + 1, float(index)) for index in range(5)])
+            self.assertTrue(os.path.isfile(model.path))
+
+    def test_reads_file_in_order(self):
+        models = [("registration", self.make_model(Registration, field_of_view)) for field_of_view in range(2)]
+        models.append(("rotation", self.make_model(Rotation, 0)))
+        self.preprocessor.sweep(1, models)
+        # the base images for registration are read first, then each image that's needed exactly once
+        sweep = self.nd2.requests[2:]
+        self.assertEqual(sweep, sorted(set(sweep)))
+        self.assertEqual(len(sweep), 11)
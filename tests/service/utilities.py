@@ -0,0 +1,46 @@
+from fylm.service.utilities import ImageUtilities
+from fylm.model.hough import find_line_angles
+import numpy as np
+from scipy import ndimage
+from skimage.filter import rank
+from skimage.morphology import disk, skeletonize
+import unittest
+
+
+def make_frame(angle_degrees, shape=(512, 640)):
+    """
+    Draws four bands of dense vertical edges, like the ends of the catch channels on either side of the central trench.
+
+    """
+    random = np.random.RandomState(0)
+    image = np.full(shape, 1000.0)
+    for left in (150, 280, 345, 475):
+        image[30:-30, left:left + 30:4] = 3000.0
+        image[30:-30, left + 1:left + 30:4] = 3000.0
+    image = ndimage.rotate(image, angle_degrees, reshape=False, order=1, mode="nearest")
+    return (image + random.randn(*shape) * 50.0).astype(np.uint16)
+
+
+class ImageUtilitiesTests(unittest.TestCase):
+    def test_box_mean(self):
+        binary_image = np.random.RandomState(1).rand(40, 50) > 0.5
+        box_mean = ImageUtilities._box_mean(binary_image, 9)
+        # a disk of radius 9 has about the same area as a 17x17 square
+        for y, x in ((0, 0), (20, 25), (39, 49), (2, 48)):
+            expected = binary_image[max(0, y - 8):y + 9, max(0, x - 8):x + 9].mean() * 255.0
+            self.assertAlmostEqual(box_mean[y, x], expected)
+
+    def test_box_mean_approximates_disk(self):
+        binary_image = ndimage.gaussian_filter(np.random.RandomState(2).rand(200, 300), 4.0) > 0.5
+        disk_mean = rank.mean(binary_image, disk(9))
+        box_mean = ImageUtilities._box_mean(binary_image, 9)
+        self.assertTrue(np.mean((disk_mean < 200) == (box_mean < 200)) > 0.95)
+
+    def test_rotation_offsets_agree(self):
+        for angle in (0.0, 0.7, -1.3):
+            offsets = []
+            for smoothing in ("disk", "box"):
+                segments = ImageUtilities.create_vertical_segments(make_frame(angle), smoothing)
+                offsets.append(np.degrees(np.mean(find_line_angles(skeletonize(segments)))))
+            self.assertAlmostEqual(offsets[0], offsets[1], delta=0.1)
+            self.assertAlmostEqual(offsets[1], -angle, delta=0.1)